@@ -0,0 +1,235 @@
+"""
+Catálogo en memoria de la biblioteca de audio.
+
+Se construye una vez al arrancar y después se actualiza por incrementos:
+cuando termina una descarga, cuando se borra un archivo o cuando llegan
+eventos del sistema de archivos (watchdog, opcional). Sin watchdog se
+reconcilia con el disco cada cierto tiempo en un hilo aparte. /health y
+/downloads leen una instantánea ya ordenada en lugar de recorrer el
+directorio en cada petición.
+
+Cada cambio sube la versión del catálogo y queda en un registro acotado,
+para que los clientes puedan pedir solo lo que cambió desde la versión N.
+"""
+import bisect
+import logging
+import os
+import re
+import threading
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog es opcional
+    FileSystemEventHandler = object
+    Observer = None
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.webm'}
+# Sufijo " [id del video]" que LIBRARY_OUTTMPL pone en el nombre (no es parte del título)
+VIDEO_ID_SUFFIX = re.compile(r' \[[\w-]+\]$')
+
+
+class LibraryCatalog:
+    """Índice en memoria de los archivos de audio de un directorio"""
+
+    def __init__(self, directory: Path, path_for: Callable[[Path], str],
+                 rescan_interval: float = 300.0, changelog_size: int = 2000):
+        self.directory = directory
+        self.path_for = path_for
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._snapshot: Optional[List[Dict[str, Any]]] = None
+        self._snapshot_keys: List[Tuple[float, str]] = []
+        self._changelog: "deque[Tuple[int, str]]" = deque(maxlen=changelog_size)
+        self._total_bytes = 0
+        self.version = 0
+        # Las versiones solo valen dentro de un mismo proceso
+        self.epoch = uuid.uuid4().hex[:8]
+        self._observer = None
+        self._stop = threading.Event()
+        # mtime del directorio en el último escaneo (ver scan_if_changed)
+        self._directory_mtime: Optional[int] = None
+
+    def scan(self):
+        """Reconciliar el catálogo con el contenido real del directorio"""
+        found: Dict[str, Dict[str, Any]] = {}
+        try:
+            # Antes de listar: un cambio durante el escaneo fuerza otro
+            self._directory_mtime = self.directory.stat().st_mtime_ns
+            with os.scandir(self.directory) as it:
+                for item in it:
+                    path = Path(item.path)
+                    if item.is_file() and path.suffix.lower() in AUDIO_EXTENSIONS:
+                        found[item.name] = self._make_entry(path, item.stat())
+        except OSError as e:
+            logger.error(f"Error escaneando {self.directory}: {e}")
+            return
+
+        with self._lock:
+            for name in self._entries.keys() - found.keys():
+                self._total_bytes -= self._entries.pop(name)["size"]
+                self._changed(name)
+            for name, entry in found.items():
+                previous = self._entries.get(name)
+                if previous != entry:
+                    self._total_bytes += entry["size"] - (previous["size"] if previous else 0)
+                    self._entries[name] = entry
+                    self._changed(name)
+        logger.info(f"🗂️ Catálogo: {len(found)} archivos en {self.directory}")
+
+    def scan_if_changed(self) -> bool:
+        """
+        Reescanear solo si cambió el directorio. Su mtime cambia al crear,
+        borrar o renombrar archivos, así que un stat basta para saberlo
+        (para procesos que no reciben los avisos de fin de descarga)
+        """
+        try:
+            mtime = self.directory.stat().st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._directory_mtime:
+            return False
+        self.scan()
+        return True
+
+    def add(self, path: Path):
+        """Añadir o actualizar un archivo"""
+        if path.suffix.lower() not in AUDIO_EXTENSIONS:
+            return
+        try:
+            entry = self._make_entry(path, path.stat())
+        except OSError:
+            self.remove(path.name)
+            return
+        with self._lock:
+            previous = self._entries.get(path.name)
+            if previous == entry:
+                return
+            if previous is not None:
+                self._total_bytes -= previous["size"]
+            self._entries[path.name] = entry
+            self._total_bytes += entry["size"]
+            self._changed(path.name)
+
+    def remove(self, filename: str):
+        with self._lock:
+            entry = self._entries.pop(filename, None)
+            if entry is not None:
+                self._total_bytes -= entry["size"]
+                self._changed(filename)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Archivos ordenados por fecha de modificación (más recientes primero)"""
+        with self._lock:
+            return self._ensure_snapshot()
+
+    def page(self, after: Optional[Tuple[float, str]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[Tuple[float, str]], int]:
+        """
+        Página de la instantánea a partir de una clave de cursor
+        (modified, filename). Devuelve (archivos, cursor siguiente, versión).
+        """
+        with self._lock:
+            files = self._ensure_snapshot()
+            start = 0
+            if after is not None:
+                start = bisect.bisect_right(self._snapshot_keys, (-after[0], after[1]))
+            items = files[start:start + limit]
+            next_key = None
+            if start + limit < len(files) and items:
+                next_key = (items[-1]["modified"], items[-1]["filename"])
+            return items, next_key, self.version
+
+    def changes_since(self, version: int) -> Optional[Tuple[List[Dict[str, Any]], List[str], int]]:
+        """
+        Cambios posteriores a una versión: (actualizados, borrados, versión
+        actual). None si el registro ya no llega tan atrás.
+        """
+        with self._lock:
+            if version > self.version:
+                return None
+            if version < self.version and (not self._changelog or self._changelog[0][0] > version + 1):
+                return None
+            names = {name for changed_at, name in self._changelog if changed_at > version}
+            updated = [self._entries[name] for name in names if name in self._entries]
+            deleted = sorted(name for name in names if name not in self._entries)
+            updated.sort(key=lambda e: (-e["modified"], e["filename"]))
+            return updated, deleted, self.version
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def start_watching(self):
+        """Seguir cambios del directorio con watchdog o, si no está, reescaneando"""
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_CatalogEventHandler(self), str(self.directory), recursive=False)
+            self._observer.daemon = True
+            self._observer.start()
+            logger.info("👀 Catálogo siguiendo eventos del sistema de archivos")
+        elif self.rescan_interval > 0:
+            threading.Thread(target=self._rescan_loop, name="catalog-rescan", daemon=True).start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+    def _rescan_loop(self):
+        while not self._stop.wait(self.rescan_interval):
+            self.scan()
+
+    def _make_entry(self, path: Path, stat: os.stat_result) -> Dict[str, Any]:
+        return {
+            "filename": path.name,
+            "title": VIDEO_ID_SUFFIX.sub('', path.stem),
+            "size": stat.st_size,
+            "modified": stat.st_mtime,
+            "path": self.path_for(path),
+        }
+
+    def _ensure_snapshot(self) -> List[Dict[str, Any]]:
+        # Llamar con el lock tomado
+        if self._snapshot is None:
+            self._snapshot = sorted(self._entries.values(), key=lambda e: (-e["modified"], e["filename"]))
+            self._snapshot_keys = [(-e["modified"], e["filename"]) for e in self._snapshot]
+        return self._snapshot
+
+    def _changed(self, filename: str):
+        # Llamar con el lock tomado
+        self._snapshot = None
+        self.version += 1
+        self._changelog.append((self.version, filename))
+
+
+class _CatalogEventHandler(FileSystemEventHandler):
+    def __init__(self, catalog: LibraryCatalog):
+        self.catalog = catalog
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.catalog.add(Path(event.src_path))
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.catalog.add(Path(event.src_path))
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.catalog.remove(Path(event.src_path).name)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.catalog.remove(Path(event.src_path).name)
+            self.catalog.add(Path(event.dest_path))
@@ -10,18 +10,102 @@ MAX_FILE_SIZE = os.getenv('MAX_FILE_SIZE', '100MB')
 REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', '1800'))
 DEBUG_MODE = os.getenv('DEBUG_MODE', 'true').lower() == 'true'
 YOUTUBE_BYPASS = os.getenv('YOUTUBE_BYPASS', 'true').lower() == 'true'
-SLEEP_INTERVAL = float(os.getenv('SLEEP_INTERVAL', '0.01'))
-MAX_RETRIES = int(os.getenv('MAX_RETRIES', '100'))
+
+# POOLS DE TRABAJO (yt-dlp fuera del event loop)
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', '4'))
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '3'))
+TRANSCODE_WORKERS = int(os.getenv('TRANSCODE_WORKERS', str(os.cpu_count() or 2)))
+# Búsquedas: pool propio para que las variantes no ocupen la extracción de las descargas
+SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', '2'))
+
+# COLA DE DESCARGAS (límite global y por fuente)
+MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', '4'))
+MAX_JOBS_PER_SOURCE = int(os.getenv('MAX_JOBS_PER_SOURCE', '3'))
+
+# REGISTRO DE TAREAS (segundos que se conserva una tarea terminada / tope de terminadas)
+TASK_TTL = float(os.getenv('TASK_TTL', '3600'))
+MAX_FINISHED_TASKS = int(os.getenv('MAX_FINISHED_TASKS', '1000'))
+# Reinicios tras los que una tarea sin terminar deja de reanudarse
+RESUME_MAX_ATTEMPTS = int(os.getenv('RESUME_MAX_ATTEMPTS', '3'))
+
+# EVENTOS DE PROGRESO (SSE / WebSocket): segundos entre progresos de una tarea,
+# keep-alive y duración máxima de un stream SSE (EventSource se reconecta solo)
+PROGRESS_EVENT_INTERVAL = float(os.getenv('PROGRESS_EVENT_INTERVAL', '0.5'))
+EVENTS_KEEPALIVE = float(os.getenv('EVENTS_KEEPALIVE', '15'))
+SSE_MAX_DURATION = float(os.getenv('SSE_MAX_DURATION', '120'))
+# Segundos que el apagado espera a las conexiones abiertas (streams SSE, /stream)
+SHUTDOWN_GRACE = float(os.getenv('SHUTDOWN_GRACE', '5'))
+
+# BASE DE DATOS (vacío = SQLite en DOWNLOADS_DIR/.library.db) Y ESCRITURA DIFERIDA
+DATABASE_URL = os.getenv('DATABASE_URL', '')
+DATABASE_ECHO = os.getenv('DATABASE_ECHO', 'false').lower() == 'true'
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_FLUSH_INTERVAL = float(os.getenv('DB_FLUSH_INTERVAL', '1'))
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', '200'))
+
+# CACHÉ DE BÚSQUEDAS (segundos / entradas / bytes)
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '600'))
+SEARCH_CACHE_STALE_TTL = float(os.getenv('SEARCH_CACHE_STALE_TTL', '3600'))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '500'))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv('SEARCH_CACHE_MAX_BYTES', str(20 * 1024 * 1024)))
+
+# MOTOR DE BÚSQUEDA: sequential | first | merge
+SEARCH_MODE = os.getenv('SEARCH_MODE', 'first')
+SEARCH_BUDGET = float(os.getenv('SEARCH_BUDGET', '15'))
+# Variantes en vuelo a la vez (first/merge); las demás esperan turno
+SEARCH_PARALLEL = int(os.getenv('SEARCH_PARALLEL', '2'))
+SEARCH_VARIANTS = [v.strip() for v in os.getenv('SEARCH_VARIANTS', '{q},{q} música,{q} audio,{q} song').split(',') if v.strip()]
+
+# CACHÉ DE METADATOS (las URLs de formato de YouTube caducan en horas)
+METADATA_CACHE_TTL = float(os.getenv('METADATA_CACHE_TTL', '1800'))
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv('METADATA_CACHE_MAX_ENTRIES', '200'))
+
+# TRANSCODIFICACIÓN AL VUELO (/listen): FFmpeg a la vez fuera del pool de transcodificación
+MAX_LIVE_TRANSCODES = int(os.getenv('MAX_LIVE_TRANSCODES', '2'))
+
+# CATÁLOGO EN MEMORIA (reescaneo de respaldo si no hay watchdog)
+CATALOG_RESCAN_INTERVAL = float(os.getenv('CATALOG_RESCAN_INTERVAL', '300'))
+
+# ESTRATEGIAS DE DESCARGA (plazo total por trabajo; los reintentos son los de UPSTREAM_RETRIES)
+DOWNLOAD_DEADLINE = float(os.getenv('DOWNLOAD_DEADLINE', '300'))
+# Carrera de estrategias: cuántas a la vez (1 = en serie) y ventaja de la primera
+HEDGE_STRATEGIES = int(os.getenv('HEDGE_STRATEGIES', '2'))
+HEDGE_DELAY = float(os.getenv('HEDGE_DELAY', '8'))
+
+# TRÁFICO HACIA YOUTUBE (limitador compartido, circuit breaker y backoff de reintentos)
+UPSTREAM_RATE = float(os.getenv('UPSTREAM_RATE', '5'))  # peticiones por segundo (0 = sin límite)
+UPSTREAM_BURST = int(os.getenv('UPSTREAM_BURST', '10'))
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', '5'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_COOLDOWN = float(os.getenv('CIRCUIT_COOLDOWN', '60'))
+RETRY_BACKOFF_BASE = float(os.getenv('RETRY_BACKOFF_BASE', '1'))
+RETRY_BACKOFF_MAX = float(os.getenv('RETRY_BACKOFF_MAX', '30'))
+
+# ALMACENAMIENTO (presupuesto de disco de DOWNLOADS_DIR; acepta 500MB, 2GB...)
+def parse_size(value: str) -> int:
+    units = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+    value = value.strip().upper()
+    for unit, factor in units.items():
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * factor)
+    return int(value.rstrip('B') or 0)
+
+MAX_FILE_SIZE_BYTES = parse_size(MAX_FILE_SIZE)
+STORAGE_BUDGET = parse_size(os.getenv('STORAGE_BUDGET', '2GB'))
 
 # Configuración base
 BASE_DIR = Path(__file__).parent
 DOWNLOADS_DIR = Path(DOWNLOADS_DIR_ENV) if DOWNLOADS_DIR_ENV.startswith('/') else BASE_DIR / "downloads"
 DOWNLOADS_DIR.mkdir(exist_ok=True)
 
+# Nombre de los archivos de la biblioteca: con el id del video, dos videos
+# con el mismo título no se pisan el archivo
+LIBRARY_OUTTMPL = '%(title)s [%(id)s].%(ext)s'
+
 # Configuración de yt-dlp PREMIUM
 YT_DLP_CONFIG = {
     'format': 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best',
-    'outtmpl': str(DOWNLOADS_DIR / '%(title)s.%(ext)s'),
+    'outtmpl': str(DOWNLOADS_DIR / LIBRARY_OUTTMPL),
     'writethumbnail': False,
     'writeinfojson': False,
     'quiet': False,
@@ -36,16 +120,13 @@ YT_DLP_CONFIG = {
     
     # CONFIGURACIÓN ULTRA-ROBUSTA PREMIUM
     'socket_timeout': REQUEST_TIMEOUT,
-    'retries': MAX_RETRIES,
-    'fragment_retries': MAX_RETRIES,
+    # Reintentos: solo los de upstream.ydl_options() (UPSTREAM_RETRIES con backoff)
     'http_chunk_size': 1048576,  # 1MB chunks
-    'sleep_interval': SLEEP_INTERVAL,
-    'max_sleep_interval': 0.1,
     
     # BYPASS AGRESIVO PARA CALIDAD PREMIUM
     'age_limit': 0,
     'no_check_certificate': True,
-    'ignoreerrors': True,
+    # Sin ignoreerrors: los fallos tienen que llegar al circuit breaker
     'extract_flat': False,
     'writedescription': False,
     'writecomments': False,
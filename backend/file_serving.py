@@ -0,0 +1,207 @@
+"""
+Servir archivos de audio con HTTP Range y GET condicional.
+
+FileResponse (según la versión de Starlette) no recorta rangos ni responde
+304, así que el reproductor volvía a bajar el archivo entero en cada salto.
+Aquí se implementa:
+  - ETag fuerte (inodo + tamaño + mtime; los archivos se reemplazan de forma
+    atómica, así que cambian los tres si cambia el contenido) y Last-Modified
+  - If-None-Match / If-Modified-Since -> 304
+  - Range de un solo intervalo (con If-Range) -> 206, o 416 si no es válido
+  - Envío por bloques de CHUNK_SIZE leídos en un hilo. Si el servidor ASGI
+    ofrece la extensión "http.response.zerocopy" se le pasa el descriptor
+    para que use sendfile del kernel, pero uvicorn (el servidor de este
+    proyecto) no la ofrece: ahí siempre se usa la lectura por bloques
+"""
+import asyncio
+import os
+import urllib.parse
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+from fastapi import Request, Response
+
+CHUNK_SIZE = 256 * 1024
+
+MEDIA_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.m4a': 'audio/mp4',
+    '.webm': 'audio/webm',
+    '.wav': 'audio/wav',
+}
+
+
+def media_type_for(path: Path) -> str:
+    return MEDIA_TYPES.get(path.suffix.lower(), 'audio/mpeg')
+
+
+def file_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def content_disposition(filename: str, disposition: str = 'attachment') -> str:
+    quoted = urllib.parse.quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Interpretar una cabecera Range de un solo intervalo. Devuelve (inicio,
+    fin) inclusivos, o None si hay que ignorarla y servir el archivo entero.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        # Varios intervalos: se permite responder con el archivo completo
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first == '':
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _if_range_matches(request: Request, etag: str, last_modified: str) -> bool:
+    if_range = request.headers.get('if-range')
+    if if_range is None:
+        return True
+    # Comparación fuerte: ETag exacto o la fecha exacta de Last-Modified
+    return if_range.strip() in (etag, last_modified)
+
+
+class AudioFileResponse(Response):
+    """Respuesta que envía length bytes de un archivo a partir de start"""
+
+    def __init__(self, path: Path, start: int, length: int, status_code: int, headers: dict, media_type: str,
+                 on_close: Optional[Callable[[], None]] = None):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.length = length
+        self.on_close = on_close
+        self.headers['content-length'] = str(length)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self._send_file(scope, send)
+        finally:
+            if self.on_close:
+                self.on_close()
+
+    async def _send_file(self, scope, send):
+        await send({
+            'type': 'http.response.start',
+            'status': self.status_code,
+            'headers': self.raw_headers,
+        })
+        if scope.get('method') == 'HEAD' or self.length == 0:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        with open(self.path, 'rb') as f:
+            if 'http.response.zerocopy' in scope.get('extensions', {}):
+                await send({
+                    'type': 'http.response.zerocopy',
+                    'file': f.fileno(),
+                    'offset': self.start,
+                    'count': self.length,
+                })
+                return
+
+            loop = asyncio.get_running_loop()
+            f.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await loop.run_in_executor(None, f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+            if remaining > 0:
+                # El archivo se acortó mientras se enviaba
+                await send({'type': 'http.response.body', 'body': b''})
+
+
+def file_response(
+    request: Request,
+    file_path: Path,
+    filename: Optional[str] = None,
+    cache_control: str = 'public, max-age=31536000',
+    disposition: str = 'attachment',
+    extra_headers: Optional[dict] = None,
+    on_close: Optional[Callable[[], None]] = None,
+) -> Response:
+    """
+    Construir la respuesta 200/206/304/416 para un archivo de audio.
+    on_close se llama al terminar de enviar el cuerpo (o si no hay cuerpo).
+    """
+    try:
+        stat = file_path.stat()
+    except OSError:
+        if on_close:
+            on_close()
+        raise
+    size = stat.st_size
+    etag = file_etag(stat)
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': cache_control,
+        **(extra_headers or {}),
+    }
+
+    if _not_modified(request, etag, stat.st_mtime):
+        if on_close:
+            on_close()
+        return Response(status_code=304, headers=headers)
+
+    media_type = media_type_for(file_path)
+    headers['Content-Disposition'] = content_disposition(filename or file_path.name, disposition)
+
+    range_header = request.headers.get('range')
+    if range_header and request.method == 'GET' and _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            if on_close:
+                on_close()
+            return Response(status_code=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+        if byte_range is not None:
+            start, end = byte_range
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            return AudioFileResponse(file_path, start, end - start + 1, 206, headers, media_type, on_close)
+
+    return AudioFileResponse(file_path, 0, size, 200, headers, media_type, on_close)
@@ -1,10 +1,12 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 import yt_dlp
 import asyncio
+import base64
 import os
 import json
+import zlib
 import time
 import uuid
 import re
@@ -12,6 +14,27 @@ import urllib.parse
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 import logging
+from workers import worker_pools
+from jobs import job_scheduler, source_for_url, canonical_video_id, FINAL_STATES
+from pipeline import transcode_to_mp3, store_native, partial_path, ffmpeg_binary, NATIVE_FORMAT
+from search_cache import search_cache
+from search_engine import search_engine
+from library_index import LibraryIndex
+from metadata_cache import metadata_cache
+from catalog import LibraryCatalog
+from file_serving import file_response, media_type_for
+from variants import VariantStore, VARIANT_BITRATES, VARIANT_HINT_HEADERS
+from streaming import GrowingFile, LiveTranscodes, tail_growing_file, select_audio_source, ffmpeg_pipe_command, ffmpeg_stream
+from config import (
+    CATALOG_RESCAN_INTERVAL, STORAGE_BUDGET, MAX_FILE_SIZE_BYTES, TASK_TTL, MAX_FINISHED_TASKS, RESUME_MAX_ATTEMPTS,
+    EVENTS_KEEPALIVE, SSE_MAX_DURATION, SHUTDOWN_GRACE, MAX_LIVE_TRANSCODES, LIBRARY_OUTTMPL,
+)
+from storage import StorageManager, remove_orphan_partials
+from upstream import upstream, CircuitOpen
+from task_registry import TaskRegistry
+from store import store
+from database import SQLITE_FILES
+from progress_events import progress_hub
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -20,6 +43,14 @@ logger = logging.getLogger(__name__)
 # Configuración
 DOWNLOADS_DIR = Path("/tmp/downloads")  # Railway usa /tmp para archivos temporales
 DOWNLOADS_DIR.mkdir(exist_ok=True)
+# Origen de las conversiones a MP3: fuera de DOWNLOADS_DIR, donde puede estar
+# (o escribiéndose) la copia nativa del mismo video
+FETCH_DIR = DOWNLOADS_DIR / '.fetch'
+FETCH_DIR.mkdir(exist_ok=True)
+MP3_QUALITY = '192'
+LIBRARY_FORMAT = f"mp3-{MP3_QUALITY}"
+# quality de /download: MP3 (por defecto) o el audio nativo sin recodificar
+QUALITIES = ("best", "mp3", NATIVE_FORMAT)
 
 # Crear app FastAPI
 app = FastAPI(
@@ -58,6 +89,12 @@ class SearchResult:
         return title.strip()
 
 class DownloadTask:
+    # Registro compacto: sin __dict__ por tarea
+    __slots__ = (
+        'id', 'url', 'quality', 'status', 'progress', 'file_path', 'error', 'title', 'artist',
+        'duration', 'result', 'created_at', 'started_at', 'finished_at', 'stream', 'attempts',
+    )
+    
     def __init__(self, url: str, quality: str = "best"):
         self.id = str(uuid.uuid4())
         self.url = url
@@ -69,10 +106,96 @@ class DownloadTask:
         self.title = None
         self.artist = None
         self.duration = 0
+        self.result = None
         self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Archivo que se está escribiendo ahora mismo (para /stream)
+        self.stream: Optional[GrowingFile] = None
+        # Veces que se ha reencolado tras un reinicio
+        self.attempts = 0
+    
+    @classmethod
+    def from_record(cls, row: Dict[str, Any]) -> "DownloadTask":
+        """Reconstruir una tarea sin terminar del diario para reanudarla"""
+        task = cls(row['url'], row['quality'] or "best")
+        task.id = row['id']
+        task.title = row['title']
+        task.artist = row['artist']
+        task.duration = row['duration'] or 0
+        task.progress = row['progress'] or 0
+        task.created_at = row['created_at'] or task.created_at
+        task.attempts = (row['attempts'] or 0) + 1
+        return task
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "task_id": self.id,
+            "url": self.url,
+            "status": self.status,
+            "progress": self.progress,
+            "title": self.title,
+            "artist": self.artist,
+            "error": self.error,
+            "file": self.result,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+# Registro en memoria: las tareas terminadas caducan (TASK_TTL / MAX_FINISHED_TASKS)
+download_tasks = TaskRegistry(TASK_TTL, MAX_FINISHED_TASKS, store)
+
+def task_updated(task: DownloadTask):
+    """Guardar la tarea y avisar a los suscritos a /tasks/events y /ws/tasks"""
+    download_tasks.save(task)
+    progress_hub.stage(task)
+
+job_scheduler.on_update = task_updated
+
+# Clave del info dict con la que los hooks de yt-dlp encuentran su tarea
+TASK_ID_KEY = '__download_task_id'
+
+# Índice persistente de pistas ya descargadas
+library_index = LibraryIndex(DOWNLOADS_DIR, store)
+
+# Variantes de bitrate generadas bajo demanda (DOWNLOADS_DIR/.variants)
+variant_store = VariantStore(DOWNLOADS_DIR)
+
+def forget_evicted(path: Path):
+    """Quitar de índices y catálogo una pista desalojada por el presupuesto de disco"""
+    if path.parent == DOWNLOADS_DIR:
+        library_index.remove_file(path.name)
+        catalog.remove(path.name)
+        variant_store.remove(path.name)
 
-# Almacenamiento en memoria
-download_tasks: Dict[str, DownloadTask] = {}
+def files_being_written() -> List[Path]:
+    """Temporales de las descargas y conversiones en curso"""
+    return [task.stream.path for task in download_tasks.values() if task.stream and not task.stream.complete]
+
+# Presupuesto de disco de DOWNLOADS_DIR (pistas y variantes; también cuentan
+# los temporales, .fetch y la base de datos, que no se desalojan)
+storage = StorageManager(
+    [DOWNLOADS_DIR, variant_store.directory],
+    STORAGE_BUDGET,
+    MAX_FILE_SIZE_BYTES,
+    on_evict=forget_evicted,
+    rescan_interval=CATALOG_RESCAN_INTERVAL,
+    scratch=[FETCH_DIR, *SQLITE_FILES],
+    writing=files_being_written
+)
+variant_store.on_add = storage.add
+variant_store.on_remove = storage.remove
+
+# Catálogo en memoria para /health y /downloads (ruta completa real del archivo)
+catalog = LibraryCatalog(
+    DOWNLOADS_DIR,
+    path_for=lambda file_path: str(file_path.absolute()),
+    rescan_interval=CATALOG_RESCAN_INTERVAL
+)
+
+# Plazas de /listen (FFmpeg al vuelo, fuera del pool de transcodificación)
+live_transcodes = LiveTranscodes(MAX_LIVE_TRANSCODES)
 
 def get_ffmpeg_path():
     """Detectar automáticamente la ruta de FFmpeg"""
@@ -96,6 +219,76 @@ def get_ffmpeg_path():
     logger.warning("FFmpeg no encontrado, las descargas pueden fallar")
     return None
 
+def extract_info_sync(ydl_opts: dict, target: str) -> Optional[dict]:
+    """Extraer información con yt-dlp (bloqueante, se ejecuta en un pool)"""
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.extract_info(target, download=False)
+
+def library_format(quality: str) -> str:
+    """Clave de formato en la biblioteca para un valor de quality"""
+    return NATIVE_FORMAT if quality == NATIVE_FORMAT else LIBRARY_FORMAT
+
+def library_file(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Respuesta de archivo a partir de una entrada del índice"""
+    return {
+        "title": entry.get('title'),
+        "artist": entry.get('artist'),
+        "duration": entry.get('duration', 0),
+        "thumbnail": entry.get('thumbnail', ''),
+        "file_path": f"/download/{entry['filename']}",
+        "file_size": entry['file_size'],
+        "filename": entry['filename']
+    }
+
+@app.on_event("startup")
+async def load_library_index():
+    progress_hub.start()
+    store.start()
+    library_index.load()
+    catalog.scan()
+    catalog.start_watching()
+    resume_unfinished_tasks()
+    storage.rescan()
+    storage.start_rescanning()
+    storage.enforce()
+
+def resume_unfinished_tasks():
+    """Reencolar las tareas del diario que no terminaron (caída o reinicio)"""
+    keep = set()
+    resumed = 0
+    for row in store.unfinished_tasks():
+        task = DownloadTask.from_record(row)
+        if task.attempts > RESUME_MAX_ATTEMPTS:
+            task.status = "error"
+            task.error = f"Abandonada tras {RESUME_MAX_ATTEMPTS} reinicios"
+            task.finished_at = time.time()
+            download_tasks.add(task)
+            continue
+        key = f"{canonical_video_id(task.url) or task.url}:{library_format(task.quality)}"
+        running = job_scheduler.submit(task, source_for_url(task.url), lambda task=task: run_download(task), key=key)
+        if running is not task:
+            task.status = "error"
+            task.error = f"Unificada con la tarea {running.id} al reanudar"
+            task.finished_at = time.time()
+        download_tasks.add(task)
+        if running is task:
+            resumed += 1
+            if row['partial_path']:
+                keep.add(Path(row['partial_path']).name.removesuffix('.part'))
+    # En .fetch todo es temporal: también los orígenes que no llegaron a convertirse
+    freed = remove_orphan_partials(DOWNLOADS_DIR, keep) + remove_orphan_partials(FETCH_DIR, keep, everything=True)
+    if resumed or freed:
+        logger.info(f"♻️ {resumed} descargas reanudadas; {freed / 1024 / 1024:.1f} MB de temporales huérfanos borrados")
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    progress_hub.close()
+    catalog.stop_watching()
+    storage.stop_rescanning()
+    await job_scheduler.shutdown()
+    worker_pools.shutdown()
+    store.stop()
+
 @app.get("/")
 async def root():
     return {
@@ -121,19 +314,8 @@ async def health_check():
         # Verificar FFmpeg
         ffmpeg_ok = get_ffmpeg_path() is not None
         
-        # Contar archivos descargados
-        files = []
-        if DOWNLOADS_DIR.exists():
-            for file_path in DOWNLOADS_DIR.iterdir():
-                if file_path.is_file() and file_path.suffix.lower() in ['.mp3', '.wav', '.m4a', '.webm']:
-                    stat = file_path.stat()
-                    files.append({
-                        "filename": file_path.name,
-                        "title": file_path.stem,
-                        "size": stat.st_size,
-                        "modified": stat.st_mtime,
-                        "path": str(file_path.absolute())  # Ruta completa real del archivo
-                    })
+        # Archivos descargados (instantánea del catálogo en memoria)
+        files = catalog.snapshot()
         
         return {
             "status": "success",
@@ -145,6 +327,18 @@ async def health_check():
                 "ffmpeg_path": get_ffmpeg_path(),
                 "total_files": len(files)
             },
+            "workers": worker_pools.stats(),
+            "scheduler": job_scheduler.stats(),
+            "tasks": download_tasks.stats(),
+            "store": store.stats(),
+            "search_cache": search_cache.stats(),
+            "library": library_index.stats(),
+            "variants": variant_store.stats(),
+            "storage": storage.stats(),
+            "metadata_cache": metadata_cache.stats(),
+            "upstream": upstream.stats(),
+            "events": progress_hub.stats(),
+            "live_transcodes": live_transcodes.stats(),
             "downloads": files,
             "total": len(files)
         }
@@ -159,274 +353,354 @@ async def health_check():
 
 @app.post("/search")
 async def search_music(query: str):
-    """Búsqueda mejorada en YouTube"""
+    """Búsqueda mejorada en YouTube (con caché por query normalizada)"""
     try:
         if not query or len(query.strip()) < 2:
             raise HTTPException(400, "Query debe tener al menos 2 caracteres")
         
         logger.info(f"🔍 Buscando: {query}")
         
-        # Configuración mejorada para búsqueda
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'extract_flat': True,
-            'quiet': False,  # Mostrar más información para debug
-            'no_warnings': False,  # Mostrar warnings para debug
-            'default_search': 'ytsearch',
-            'max_downloads': 20,  # Más resultados
-            'socket_timeout': 30,  # Timeout más largo
-            'retries': 3,  # Reintentos
-        }
-        
-        # Intentar diferentes variaciones de búsqueda
-        search_queries = [
-            f"ytsearch20:{query.strip()}",  # Búsqueda original
-            f"ytsearch20:{query.strip()} música",  # Con palabra música
-            f"ytsearch20:{query.strip()} audio",  # Con palabra audio
-            f"ytsearch20:{query.strip()} song",  # Con palabra song
-        ]
+        results, cache_state = await search_cache.get_or_load(query, lambda: search_youtube(query))
         
-        all_results = []
-        
-        for search_query in search_queries:
-            try:
-                logger.info(f"🔍 Intentando búsqueda: {search_query}")
-                
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    search_results = ydl.extract_info(search_query, download=False)
-                
-                if search_results and 'entries' in search_results:
-                    all_results.extend(search_results['entries'])
-                    logger.info(f"✅ Encontrados {len(search_results['entries'])} resultados")
-                    break  # Si encontramos resultados, no probar más
-                    
-            except Exception as e:
-                logger.warning(f"⚠️ Error en búsqueda '{search_query}': {e}")
-                continue
-        
-        # Si no encontramos nada, intentar búsqueda más amplia
-        if not all_results:
-            logger.info("🔍 Intentando búsqueda más amplia...")
-            try:
-                # Dividir la query en palabras y buscar cada una
-                words = query.strip().split()
-                if len(words) > 1:
-                    for word in words:
-                        if len(word) > 2:  # Solo palabras de más de 2 caracteres
-                            broad_query = f"ytsearch20:{word} música"
-                            logger.info(f"🔍 Búsqueda amplia: {broad_query}")
-                            
-                            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                                search_results = ydl.extract_info(broad_query, download=False)
-                            
-                            if search_results and 'entries' in search_results:
-                                all_results.extend(search_results['entries'])
-                                break
-            except Exception as e:
-                logger.warning(f"⚠️ Error en búsqueda amplia: {e}")
-        
-        search_results = {'entries': all_results} if all_results else None
-            
-        if not search_results or 'entries' not in search_results:
-            return {"status": "success", "results": []}
-        
-        # Procesar y validar resultados
-        results = []
-        logger.info(f"🔍 Procesando {len(search_results['entries'])} entradas...")
-        
-        for i, entry in enumerate(search_results['entries']):
-            if entry:  # Verificar que la entrada no sea None
-                try:
-                    # Debug: mostrar información de la entrada
-                    logger.info(f"📋 Entrada {i+1}: {entry.get('title', 'Sin título')}")
-                    logger.info(f"🔗 URL: {entry.get('webpage_url', entry.get('url', 'Sin URL'))}")
-                    
-                    result = SearchResult(entry)
-                    results.append({
-                        'id': result.id,
-                        'title': result.title,
-                        'artist': result.uploader,
-                        'duration': result.duration,
-                        'thumbnail': result.thumbnail,
-                        'url': result.url,
-                        'view_count': result.view_count
-                    })
-                    logger.info(f"✅ Procesado: {result.title}")
-                except Exception as e:
-                    logger.warning(f"⚠️ Error procesando resultado {i+1}: {e}")
-                    logger.warning(f"📋 Datos de entrada: {entry}")
-                    continue
-            else:
-                logger.warning(f"⚠️ Entrada {i+1} es None")
-        
-        logger.info(f"✅ Encontrados {len(results)} resultados")
+        logger.info(f"✅ Encontrados {len(results)} resultados (caché: {cache_state})")
         return {
             "status": "success",
             "results": results,
             "total": len(results),
-            "query": query
+            "query": query,
+            "cache": cache_state
         }
         
+    except HTTPException:
+        raise
+    except CircuitOpen as e:
+        logger.warning(f"🚫 Búsqueda rechazada: {e}")
+        raise HTTPException(503, str(e), headers={"Retry-After": str(int(e.retry_after) or 1)})
     except Exception as e:
         logger.error(f"Error en búsqueda: {e}")
         raise HTTPException(500, f"Error en búsqueda: {str(e)}")
 
-@app.post("/download")
-async def download_audio(url: str, quality: str = "best"):
-    """Descarga mejorada con manejo robusto de errores"""
-    try:
-        logger.info(f"🔽 Iniciando descarga: {url}")
-        
-        if not url:
-            raise HTTPException(400, "URL es requerida")
+async def search_youtube(query: str) -> List[Dict[str, Any]]:
+    """Ejecutar la búsqueda en YouTube y devolver resultados procesados"""
+    # Configuración mejorada para búsqueda
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'extract_flat': True,
+        'quiet': False,  # Mostrar más información para debug
+        'no_warnings': False,  # Mostrar warnings para debug
+        'default_search': 'ytsearch',
+        'max_downloads': 20,  # Más resultados
+        'socket_timeout': 30,  # Timeout más largo
+        **upstream.ydl_options(),
+    }
+    
+    async def run_variant(text: str) -> List[Dict[str, Any]]:
+        search_results = await upstream.call(worker_pools.run, 'search', extract_info_sync, ydl_opts, f"ytsearch20:{text}")
+        if search_results and 'entries' in search_results:
+            return search_results['entries']
+        return []
+    
+    # Con el circuito abierto todas las variantes fallarían y se respondería
+    # "sin resultados": mejor un 503 con Retry-After
+    upstream.breaker.check()
+    
+    # Variantes de búsqueda (en paralelo o secuenciales según SEARCH_MODE)
+    all_results, timings = await search_engine.search(query.strip(), run_variant)
+    for timing in timings:
+        logger.info(f"⏱️ Variante '{timing['query']}': {timing['status']} en {timing['elapsed_ms']}ms")
+    
+    search_results = {'entries': all_results} if all_results else None
         
-        # Validar URL de YouTube
-        if 'youtube.com' not in url and 'youtu.be' not in url:
-            raise HTTPException(400, "Solo se permiten URLs de YouTube")
+    if not search_results or 'entries' not in search_results:
+        return []
+    
+    # Procesar y validar resultados
+    results = []
+    logger.info(f"🔍 Procesando {len(search_results['entries'])} entradas...")
+    
+    for i, entry in enumerate(search_results['entries']):
+        if entry:  # Verificar que la entrada no sea None
+            try:
+                # Debug: mostrar información de la entrada
+                logger.info(f"📋 Entrada {i+1}: {entry.get('title', 'Sin título')}")
+                logger.info(f"🔗 URL: {entry.get('webpage_url', entry.get('url', 'Sin URL'))}")
+                
+                result = SearchResult(entry)
+                results.append({
+                    'id': result.id,
+                    'title': result.title,
+                    'artist': result.uploader,
+                    'duration': result.duration,
+                    'thumbnail': result.thumbnail,
+                    'url': result.url,
+                    'view_count': result.view_count
+                })
+                logger.info(f"✅ Procesado: {result.title}")
+            except Exception as e:
+                logger.warning(f"⚠️ Error procesando resultado {i+1}: {e}")
+                logger.warning(f"📋 Datos de entrada: {entry}")
+                continue
+        else:
+            logger.warning(f"⚠️ Entrada {i+1} es None")
+    
+    return results
+
+@app.get("/search/cache")
+async def search_cache_status():
+    """Estadísticas de la caché de búsquedas"""
+    return {"status": "success", "cache": search_cache.stats()}
+
+@app.get("/search/variants")
+async def search_variants_status():
+    """Tiempos y aciertos por variante de búsqueda"""
+    return {"status": "success", "engine": search_engine.stats()}
+
+@app.post("/download", status_code=202)
+async def download_audio(response: Response, url: str, quality: str = "best"):
+    """Encolar descarga y responder de inmediato con el task_id"""
+    logger.info(f"🔽 Encolando descarga: {url}")
+    
+    if not url:
+        raise HTTPException(400, "URL es requerida")
+    
+    # Validar URL de YouTube
+    if 'youtube.com' not in url and 'youtu.be' not in url:
+        raise HTTPException(400, "Solo se permiten URLs de YouTube")
+    
+    if quality not in QUALITIES:
+        raise HTTPException(400, f"Calidad no soportada: {quality} (opciones: {', '.join(QUALITIES)})")
+    
+    video_id = canonical_video_id(url)
+    task = DownloadTask(url, quality)
+    
+    # Si la pista ya está en la biblioteca se responde sin red ni FFmpeg
+    cached = library_index.lookup(video_id, library_format(quality))
+    if cached:
+        logger.info(f"📚 Ya en la biblioteca: {cached['filename']}")
+        task.title = cached.get('title')
+        task.artist = cached.get('artist')
+        task.duration = cached.get('duration', 0)
+        task.file_path = str(DOWNLOADS_DIR / cached['filename'])
+        task.status = "completed"
+        task.progress = 100
+        task.result = library_file(cached)
+        task.finished_at = time.time()
+        download_tasks.add(task)
+        response.status_code = 200
+        return {
+            "status": "success",
+            "task_id": task.id,
+            "file": task.result,
+            "cached": True
+        }
+    
+    # Crear tarea de descarga (o engancharse a la que ya baja este video)
+    key = f"{video_id or url}:{library_format(quality)}"
+    running = job_scheduler.submit(task, source_for_url(url), lambda: run_download(task), key=key)
+    if running is task:
+        download_tasks.add(task)
+    
+    return {
+        "status": "queued",
+        "task_id": running.id,
+        "status_url": f"/tasks/{running.id}",
+        "coalesced": running is not task
+    }
+
+def set_task_status(task: DownloadTask, status: str):
+    """Cambiar de etapa, guardar la tarea y publicar la transición"""
+    task.status = status
+    task_updated(task)
+
+async def run_download(task: DownloadTask) -> Dict[str, Any]:
+    """Trabajo de descarga: extraer, descargar (red) y convertir a MP3 (CPU)"""
+    url = task.url
+    info = None
+    fmt = library_format(task.quality)
+    # Origen bajado a .fetch (modo MP3): si la conversión falla hay que borrarlo
+    fetched: Optional[Path] = None
+    try:
+        # Configuración mejorada para yt-dlp
+        ffmpeg_path = get_ffmpeg_path()
         
-        # Crear tarea de descarga
-        task = DownloadTask(url, quality)
-        download_tasks[task.id] = task
+        ydl_opts = {
+            'format': 'bestaudio[ext=m4a]/bestaudio/best',
+            # Cada formato baja a su sitio: un trabajo nativo y uno MP3 del
+            # mismo video (claves distintas) nunca comparten archivo
+            'outtmpl': str((DOWNLOADS_DIR if fmt == NATIVE_FORMAT else FETCH_DIR) / LIBRARY_OUTTMPL),
+            'writethumbnail': False,
+            'writeinfojson': False,
+            'quiet': False,
+            'no_warnings': False,
+            'extract_flat': False,
+            'writedescription': False,
+            'writecomments': False,
+            'writeautomaticsub': False,
+            'writesubtitles': False,
+            
+            # Sin postprocesado inline: la conversión a MP3 es otra etapa
+            'ffmpeg_location': ffmpeg_path if ffmpeg_path else None,
+            
+            # Bypass restricciones
+            'age_limit': 0,
+            'no_check_certificate': True,
+            # Sin ignoreerrors: los fallos de yt-dlp llegan como excepción a
+            # upstream.call, que los cuenta para el circuit breaker
+            
+            # Callbacks para progreso y ruta final del archivo (compartidos;
+            # la tarea se identifica por TASK_ID_KEY en el info dict)
+            'progress_hooks': [update_progress],
+            'postprocessor_hooks': [update_postprocessing],
+            
+            # Configuración de red
+            'socket_timeout': 30,
+            'max_filesize': MAX_FILE_SIZE_BYTES or None,
+            # Reanudar el .part que dejó una ejecución anterior (Range desde lo ya bajado)
+            'continuedl': True,
+            
+            # Reintentos con backoff exponencial + jitter y limitador compartido
+            **upstream.ydl_options(),
+        }
         
-        try:
-            # Configuración mejorada para yt-dlp
-            ffmpeg_path = get_ffmpeg_path()
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # Extraer información una sola vez (o reutilizar la de la caché)
+            set_task_status(task, "extracting")
+            info = metadata_cache.get(canonical_video_id(url))
+            if info is None:
+                info = await upstream.call(worker_pools.run, 'extract', ydl.extract_info, url, download=False)
+                metadata_cache.put(info)
             
-            ydl_opts = {
-                'format': 'bestaudio[ext=m4a]/bestaudio/best',
-                'outtmpl': str(DOWNLOADS_DIR / '%(title)s.%(ext)s'),
-                'writethumbnail': False,
-                'writeinfojson': False,
-                'quiet': False,
-                'no_warnings': False,
-                'extract_flat': False,
-                'writedescription': False,
-                'writecomments': False,
-                'writeautomaticsub': False,
-                'writesubtitles': False,
-                
-                # Configuración de postprocesamiento
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-                
-                # Configuración de FFmpeg
-                'ffmpeg_location': ffmpeg_path if ffmpeg_path else None,
-                
-                # Bypass restricciones
-                'age_limit': 0,
-                'no_check_certificate': True,
-                'ignoreerrors': True,
-                
-                # Callbacks para progreso
-                'progress_hooks': [lambda d: update_progress(task.id, d)],
-                
-                # Configuración de red
-                'socket_timeout': 30,
-                'retries': 3,
-            }
+            if not info:
+                raise Exception("No se pudo extraer información del video")
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Extraer información primero
-                task.status = "extracting"
-                info = ydl.extract_info(url, download=False)
-                
-                task.title = info.get('title', 'Canción Descargada')
-                task.artist = info.get('uploader', 'Artista desconocido')
-                task.duration = info.get('duration', 0)
-                
-                logger.info(f"📀 Descargando: {task.title} - {task.artist}")
-                
-                # Descargar el archivo
-                task.status = "downloading"
-                ydl.download([url])
-                
-                # Buscar el archivo descargado
-                downloaded_file = find_downloaded_file(task.title)
+            task.title = info.get('title', 'Canción Descargada')
+            task.artist = info.get('uploader', 'Artista desconocido')
+            task.duration = info.get('duration', 0)
+            
+            # La URL no traía un id reconocible: volver a mirar la biblioteca
+            cached = library_index.lookup(info.get('id'), fmt)
+            if cached:
+                logger.info(f"📚 Ya en la biblioteca: {cached['filename']}")
+                task.file_path = str(DOWNLOADS_DIR / cached['filename'])
+                task.progress = 100
+                return library_file(cached)
+            
+            logger.info(f"📀 Descargando: {task.title} - {task.artist}")
+            
+            # Descargar reutilizando el info dict, sin una segunda extracción
+            set_task_status(task, "downloading")
+            # Contadores de progreso de la descarga (ver progress_events.py)
+            progress_hub.track(task)
+            try:
+                await upstream.call(worker_pools.run, 'download', ydl.process_ie_result, {**info, TASK_ID_KEY: task.id}, download=True)
+            finally:
+                progress_hub.untrack(task)
+            
+            # Ruta reportada por los hooks de yt-dlp (sin escanear el directorio)
+            if not task.file_path or not os.path.isfile(task.file_path):
+                raise Exception("yt-dlp no reportó el archivo descargado")
+            downloaded_file = Path(task.file_path)
+            if fmt != NATIVE_FORMAT:
+                fetched = downloaded_file
+            
+            # Etapa de transcodificación (pool de procesos); /stream sigue su salida
+            set_task_status(task, "transcoding")
+            if fmt == NATIVE_FORMAT:
+                downloaded_file = await store_native(downloaded_file, ffmpeg_path)
+            else:
+                # Del temporal de .fetch al MP3 de la biblioteca (el temporal se borra)
+                target = DOWNLOADS_DIR / downloaded_file.with_suffix('.mp3').name
+                if downloaded_file.suffix.lower() != '.mp3':
+                    task.stream = GrowingFile(Path(partial_path(str(target))), target)
+                downloaded_file = await transcode_to_mp3(downloaded_file, MP3_QUALITY, ffmpeg_path, target=target)
+                if task.stream:
+                    task.stream.final_path = downloaded_file
+                    task.stream.finish()
+            
+            storage.check_size(downloaded_file)
+            task.file_path = str(downloaded_file)
+            task.progress = 100
+            catalog.add(downloaded_file)
+            storage.add(downloaded_file)
+            
+            logger.info(f"✅ Descarga completada: {downloaded_file.name}")
+            
+            library_index.record(info.get('id'), fmt, downloaded_file, {
+                "title": task.title,
+                "artist": task.artist,
+                "duration": task.duration,
+                "thumbnail": info.get('thumbnail', ''),
+                "url": url
+            })
+            storage.enforce()
+            
+            return {
+                "title": task.title,
+                "artist": task.artist,
+                "duration": task.duration,
+                "thumbnail": info.get('thumbnail', ''),
+                "file_path": f"/download/{downloaded_file.name}",
+                "file_size": downloaded_file.stat().st_size,
+                "filename": downloaded_file.name
+            }
                 
-                if downloaded_file:
-                    task.file_path = str(downloaded_file)
-                    task.status = "completed"
-                    
-                    logger.info(f"✅ Descarga completada: {downloaded_file.name}")
-                    
-                    return {
-                        "status": "success",
-                        "task_id": task.id,
-                        "file": {
-                            "title": task.title,
-                            "artist": task.artist,
-                            "duration": task.duration,
-                            "thumbnail": info.get('thumbnail', ''),
-                            "file_path": f"/download/{downloaded_file.name}",
-                            "file_size": downloaded_file.stat().st_size,
-                            "filename": downloaded_file.name
-                        }
-                    }
-                else:
-                    raise Exception("Archivo descargado pero no encontrado")
-                    
-        except Exception as e:
-            task.status = "error"
-            task.error = str(e)
-            logger.error(f"❌ Error en descarga: {e}")
-            raise Exception(f"Error en descarga: {str(e)}")
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"❌ Error general en descarga: {e}")
-        return {"status": "error", "message": f"Error en descarga: {str(e)}"}
-
-def update_progress(task_id: str, d: dict):
-    """Actualizar progreso de descarga"""
-    if task_id in download_tasks:
-        if d['status'] == 'downloading':
-            if 'total_bytes' in d and d['total_bytes']:
-                progress = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                download_tasks[task_id].progress = progress
-
-def find_downloaded_file(title: str) -> Optional[Path]:
-    """Encontrar archivo descargado por título"""
-    try:
-        # Limpiar título para búsqueda
-        clean_title = re.sub(r'[<>:"/\\|?*]', '', title)
-        clean_title = clean_title.strip()
-        
-        # Buscar archivos recientes (últimos 60 segundos)
-        current_time = time.time()
-        recent_files = []
-        
-        for file_path in DOWNLOADS_DIR.glob("*"):
-            if file_path.is_file() and (current_time - file_path.stat().st_mtime) < 60:
-                # Buscar por similitud en el nombre
-                if clean_title.lower() in file_path.name.lower():
-                    recent_files.append(file_path)
-        
-        if recent_files:
-            # Tomar el archivo más reciente
-            return max(recent_files, key=os.path.getctime)
-        
-        # Si no se encuentra por título, tomar el más reciente
-        all_recent = []
-        for file_path in DOWNLOADS_DIR.glob("*"):
-            if file_path.is_file() and (current_time - file_path.stat().st_mtime) < 60:
-                all_recent.append(file_path)
-        
-        if all_recent:
-            return max(all_recent, key=os.path.getctime)
-        
-        return None
-        
     except Exception as e:
-        logger.error(f"Error buscando archivo: {e}")
-        return None
+        if task.stream:
+            task.stream.fail()
+        if fetched is not None and fetched.parent == FETCH_DIR:
+            fetched.unlink(missing_ok=True)
+        # Las URLs de formato pueden haber caducado: no reutilizar ese info dict
+        if info:
+            metadata_cache.invalidate(info.get('id'))
+        logger.error(f"❌ Error en descarga: {e}")
+        raise Exception(f"Error en descarga: {str(e)}")
+
+def task_for_hook(d: dict) -> Optional[DownloadTask]:
+    """Tarea a la que pertenece un evento de progreso/postprocesado de yt-dlp"""
+    return download_tasks.get((d.get('info_dict') or {}).get(TASK_ID_KEY))
+
+def update_progress(d: dict):
+    """Actualizar progreso de descarga y registrar el archivo bajado"""
+    if d['status'] == 'downloading':
+        # Camino de cada bloque: solo apuntar; porcentaje, velocidad y ETA
+        # los calcula el publicador
+        tracker = progress_hub.tracker_for((d.get('info_dict') or {}).get(TASK_ID_KEY))
+        if tracker is None:
+            return
+        tracker.record(d.get('downloaded_bytes'), d.get('total_bytes'), d.get('total_bytes_estimate'))
+        # Publicar el .part de yt-dlp para reproducir mientras se descarga
+        # (y anotarlo en el diario para reanudarlo si el proceso muere)
+        task = tracker.task
+        if task.stream is None and d.get('tmpfilename'):
+            task.stream = GrowingFile(Path(d['tmpfilename']), Path(d.get('filename') or d['tmpfilename']))
+            download_tasks.save(task, urgent=True)
+    elif d['status'] == 'finished' and d.get('filename'):
+        task = task_for_hook(d)
+        if task is None:
+            return
+        task.file_path = d['filename']
+        if task.stream:
+            task.stream.finish()
+
+def update_postprocessing(d: dict):
+    """Registrar la ruta final que deja cada postprocesador de yt-dlp"""
+    task = task_for_hook(d)
+    if task is None:
+        return
+    if d['status'] == 'finished':
+        filepath = d.get('info_dict', {}).get('filepath')
+        if filepath:
+            task.file_path = filepath
 
 @app.get("/download/{filename:path}")
-async def download_file(filename: str):
-    """Servir archivos descargados con validación mejorada"""
+async def download_file(filename: str, request: Request, bitrate: Optional[str] = None):
+    """
+    Servir archivos descargados con validación mejorada.
+    
+    Con ?bitrate=128|192|320 (o Save-Data/ECT/Downlink) se sirve una
+    variante MP3 más ligera si ya está generada; si no, se encarga y
+    mientras tanto se sirve la copia maestra.
+    """
     try:
         logger.info(f"📁 Sirviendo archivo: {filename}")
         
@@ -437,6 +711,8 @@ async def download_file(filename: str):
         # Validar que no contenga rutas peligrosas
         if '..' in decoded_filename or '/' in decoded_filename:
             raise HTTPException(400, "Nombre de archivo inválido")
+        if bitrate and bitrate not in VARIANT_BITRATES:
+            raise HTTPException(400, f"Bitrate no soportado: {bitrate}")
         
         file_path = DOWNLOADS_DIR / decoded_filename
         
@@ -450,26 +726,22 @@ async def download_file(filename: str):
             logger.warning(f"Archivo vacío: {file_path}")
             raise HTTPException(400, "Archivo corrupto")
         
-        # Determinar tipo de media
-        media_type = 'audio/mpeg'  # Por defecto
-        if decoded_filename.lower().endswith('.m4a'):
-            media_type = 'audio/mp4'
-        elif decoded_filename.lower().endswith('.webm'):
-            media_type = 'audio/webm'
-        elif decoded_filename.lower().endswith('.wav'):
-            media_type = 'audio/wav'
-        
         logger.info(f"✅ Sirviendo archivo: {decoded_filename} ({file_size} bytes)")
         
-        return FileResponse(
-            path=str(file_path),
-            filename=decoded_filename,
-            media_type=media_type,
-            headers={
-                'Accept-Ranges': 'bytes',
-                'Content-Length': str(file_size),
-                'Cache-Control': 'public, max-age=31536000'
-            }
+        # Variante según ?bitrate= o las pistas de red del cliente
+        served_path, variant_bitrate = variant_store.select(
+            file_path, bitrate, request.headers, library_index.format_of(decoded_filename), get_ffmpeg_path
+        )
+        headers = {'Vary': VARIANT_HINT_HEADERS, 'Accept-CH': VARIANT_HINT_HEADERS}
+        served_name = decoded_filename
+        if variant_bitrate:
+            headers['X-Variant'] = f"{variant_bitrate}k"
+            served_name = f"{file_path.stem}.mp3"
+        
+        # Range/If-Range (206) y validadores ETag/Last-Modified (304)
+        return file_response(
+            request, served_path, filename=served_name, extra_headers=headers,
+            on_close=storage.acquire(served_path)
         )
         
     except HTTPException:
@@ -479,7 +751,7 @@ async def download_file(filename: str):
         raise HTTPException(500, f"Error sirviendo archivo: {str(e)}")
 
 @app.get("/file/{filename}")
-async def serve_file(filename: str):
+async def serve_file(filename: str, request: Request):
     """Servir archivo de audio para reproducción en Expo Go"""
     try:
         # Decodificar el nombre del archivo
@@ -495,16 +767,20 @@ async def serve_file(filename: str):
         
         logger.info(f"🎵 Sirviendo archivo para reproducción: {decoded_filename}")
         
-        return FileResponse(
-            str(file_path),
-            media_type='audio/mpeg',
+        # Se puede cachear: el reproductor revalida con ETag y salta con Range
+        return file_response(
+            request,
+            file_path,
             filename=decoded_filename,
-            headers={
+            cache_control='public, max-age=86400',
+            disposition='inline',
+            extra_headers={
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Cache-Control': 'no-cache'  # No cachear para reproducción
-            }
+                'Access-Control-Allow-Headers': 'Content-Type, Range',
+                'Access-Control-Expose-Headers': 'Content-Range, Content-Length, ETag'
+            },
+            on_close=storage.acquire(file_path)
         )
         
     except HTTPException:
@@ -513,31 +789,176 @@ async def serve_file(filename: str):
         logger.error(f"Error sirviendo archivo para reproducción: {e}")
         raise HTTPException(500, f"Error sirviendo archivo: {str(e)}")
 
+@app.get("/stream/{task_id}")
+async def stream_task(task_id: str, request: Request):
+    """
+    Reproducir mientras se descarga: sirve el archivo de la tarea según se
+    va escribiendo (audio nativo durante la descarga, MP3 durante la
+    transcodificación) o el archivo final si ya terminó.
+    """
+    task = download_tasks.get(task_id)
+    if task is None:
+        raise HTTPException(404, "Tarea no encontrada")
+    
+    # Esperar a que la tarea empiece a escribir algo
+    deadline = time.monotonic() + 30
+    while True:
+        if task.status == "completed" and task.file_path and os.path.isfile(task.file_path):
+            return file_response(
+                request, Path(task.file_path), disposition='inline',
+                on_close=storage.acquire(Path(task.file_path))
+            )
+        if task.status == "error":
+            raise HTTPException(409, f"La descarga falló: {task.error}")
+        if task.stream is not None and not task.stream.failed:
+            break
+        if time.monotonic() > deadline:
+            raise HTTPException(504, "La descarga todavía no ha empezado")
+        await asyncio.sleep(0.25)
+    
+    growing = task.stream
+    logger.info(f"📡 Stream progresivo de la tarea {task_id} ({task.status})")
+    return StreamingResponse(
+        storage.pinned(growing.final_path, tail_growing_file(growing, request.is_disconnected)),
+        media_type=media_type_for(growing.final_path),
+        headers={'Cache-Control': 'no-store', 'X-Stream-Stage': task.status}
+    )
+
+@app.get("/listen")
+async def listen(url: str, bitrate: str = MP3_QUALITY):
+    """
+    Escucha puntual: transcodifica a MP3 al vuelo con FFmpeg y lo envía por
+    trozos, sin guardar nada en la biblioteca.
+    """
+    if 'youtube.com' not in url and 'youtu.be' not in url:
+        raise HTTPException(400, "Solo se permiten URLs de YouTube")
+    if bitrate not in ('128', '192', '256', '320'):
+        raise HTTPException(400, "Bitrate no soportado")
+    
+    ffmpeg_bin = ffmpeg_binary(get_ffmpeg_path())
+    if not ffmpeg_bin:
+        raise HTTPException(503, "FFmpeg no disponible")
+    
+    info = metadata_cache.get(canonical_video_id(url))
+    if info is None:
+        ydl_opts = {'format': 'bestaudio[ext=m4a]/bestaudio/best', 'quiet': True, 'no_warnings': True, **upstream.ydl_options()}
+        try:
+            info = await upstream.call(worker_pools.run, 'extract', extract_info_sync, ydl_opts, url)
+        except CircuitOpen as e:
+            raise HTTPException(503, str(e), headers={"Retry-After": str(int(e.retry_after) or 1)})
+        except Exception as e:
+            logger.error(f"Error extrayendo audio para escuchar: {e}")
+            raise HTTPException(502, f"No se pudo extraer el audio: {str(e)}")
+        metadata_cache.put(info)
+    
+    source = select_audio_source(info or {})
+    if source is None:
+        raise HTTPException(502, "No se encontró un formato de audio")
+    source_url, http_headers = source
+    
+    # Cada escucha es un FFmpeg fuera del pool de transcodificación: con
+    # todas las plazas ocupadas se rechaza en vez de quitar CPU a la cola
+    release = live_transcodes.try_acquire()
+    if release is None:
+        raise HTTPException(503, "Demasiadas escuchas al vuelo, prueba en unos segundos", headers={"Retry-After": "5"})
+    
+    logger.info(f"🎧 Transcodificando al vuelo: {info.get('title')} ({bitrate}kbps)")
+    return StreamingResponse(
+        ffmpeg_stream(ffmpeg_pipe_command(ffmpeg_bin, source_url, http_headers, bitrate), release),
+        media_type='audio/mpeg',
+        headers={'Cache-Control': 'no-store'}
+    )
+
+def encode_cursor(key) -> str:
+    """Cursor opaco a partir de la clave (modified, filename)"""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        modified, filename = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(modified), str(filename)
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Cursor inválido")
+
+def catalog_version_token(version: int) -> str:
+    return f"{catalog.epoch}.{version}"
+
+def parse_catalog_version(token: str) -> Optional[int]:
+    """Versión del catálogo o None si es de otro proceso (hay que resincronizar)"""
+    epoch, _, version = token.partition('.')
+    if epoch != catalog.epoch or not version.isdigit():
+        return None
+    return int(version)
+
 @app.get("/downloads")
-async def list_downloads():
-    """Listar archivos descargados con información detallada"""
+async def list_downloads(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    since: Optional[str] = None
+):
+    """
+    Listar archivos descargados con información detallada.
+    
+    - limit/cursor: paginación por cursor (sin limit se devuelve todo)
+    - fields: proyección de campos, p.ej. fields=filename,size
+    - since: solo cambios desde esa versión del catálogo (modo delta)
+    Responde con ETag y 304 si el cliente ya tiene esa versión.
+    """
     try:
-        files = []
-        if DOWNLOADS_DIR.exists():
-            for file_path in DOWNLOADS_DIR.iterdir():
-                if file_path.is_file() and file_path.suffix.lower() in ['.mp3', '.wav', '.m4a', '.webm']:
-                    stat = file_path.stat()
-                    files.append({
-                        "filename": file_path.name,
-                        "title": file_path.stem,
-                        "size": stat.st_size,
-                        "modified": stat.st_mtime,
-                        "path": str(file_path.absolute())  # Ruta completa real del archivo
-                    })
-        
-        # Ordenar por fecha de modificación (más recientes primero)
-        files.sort(key=lambda x: x['modified'], reverse=True)
+        field_list = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
         
-        return {
-            "status": "success", 
-            "downloads": files, 
-            "total": len(files)
-        }
+        def project(files: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            if not field_list:
+                return files
+            return [{key: f[key] for key in field_list if key in f} for f in files]
+        
+        body = None
+        if since is not None:
+            since_version = parse_catalog_version(since)
+            changes = catalog.changes_since(since_version) if since_version is not None else None
+            if changes is not None:
+                updated, deleted, version = changes
+                body = {
+                    "status": "success",
+                    "mode": "delta",
+                    "downloads": project(updated),
+                    "deleted": deleted,
+                    "total": len(catalog),
+                    "version": catalog_version_token(version)
+                }
+        
+        if body is None:
+            # Instantánea ya ordenada (más recientes primero)
+            after = decode_cursor(cursor) if cursor else None
+            page_size = limit if limit else (100 if cursor else max(len(catalog), 1))
+            files, next_key, version = catalog.page(after, max(1, min(page_size, 10000)))
+            body = {
+                "status": "success",
+                "mode": "full",
+                "downloads": project(files),
+                "total": len(catalog),
+                "next_cursor": encode_cursor(next_key) if next_key else None,
+                "version": catalog_version_token(version)
+            }
+            if since is not None:
+                # La versión pedida ya no está en el registro: lista completa
+                body["reset"] = True
+        
+        # ETag = versión del catálogo + parámetros de la petición
+        params_hash = zlib.crc32(str(request.query_params).encode())
+        etag = f'"{body["version"]}-{params_hash:08x}"'
+        if_none_match = request.headers.get('if-none-match', '')
+        if etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+        return body
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error listando descargas: {e}")
         return {
@@ -564,6 +985,10 @@ async def delete_downloaded_file(filename: str):
             raise HTTPException(404, "Archivo no encontrado")
         
         file_path.unlink()
+        storage.remove(file_path)
+        library_index.remove_file(decoded_filename)
+        catalog.remove(decoded_filename)
+        variant_store.remove(decoded_filename)
         logger.info(f"🗑️ Archivo eliminado: {decoded_filename}")
         
         return {"status": "success", "message": "Archivo eliminado correctamente"}
@@ -574,22 +999,156 @@ async def delete_downloaded_file(filename: str):
         logger.error(f"Error eliminando archivo: {e}")
         raise HTTPException(500, f"Error eliminando archivo: {str(e)}")
 
+@app.get("/storage")
+async def storage_stats():
+    """Uso de disco, presupuesto y desalojos"""
+    return {"status": "success", "storage": storage.stats()}
+
+@app.get("/workers")
+async def workers_status():
+    """Estado de los pools de trabajo (cola, activos y tiempos de espera)"""
+    return {"status": "success", "pools": worker_pools.stats()}
+
+@app.get("/tasks")
+async def list_tasks(status: Optional[str] = None):
+    """Listar tareas de descarga, opcionalmente filtradas por estado"""
+    tasks = [
+        task.to_dict() for task in download_tasks.values()
+        if status is None or task.status == status
+    ]
+    tasks.sort(key=lambda t: t['created_at'], reverse=True)
+    return {
+        "status": "success",
+        "tasks": tasks,
+        "total": len(tasks),
+        "registry": download_tasks.stats(),
+        "scheduler": job_scheduler.stats()
+    }
+
+def parse_task_ids(ids: Optional[str]) -> Optional[List[str]]:
+    """Lista de ids de "a,b,c" (None = todas las tareas)"""
+    if not ids:
+        return None
+    return [task_id for task_id in (part.strip() for part in ids.split(',')) if task_id]
+
+def event_is_final(event: Dict[str, Any]) -> bool:
+    return event["type"] == "missing" or (event["type"] == "stage" and event["status"] in FINAL_STATES)
+
+async def task_snapshots(task_ids: Optional[List[str]]) -> List[Dict[str, Any]]:
+    """Estado actual de las tareas pedidas (o de todas las activas) como eventos"""
+    if task_ids is None:
+        return [{"type": "stage", **task.to_dict()} for task in download_tasks.values() if task.finished_at is None]
+    events = []
+    for task_id in task_ids:
+        task = download_tasks.get(task_id)
+        if task is not None:
+            events.append({"type": "stage", **task.to_dict()})
+            continue
+        saved = await asyncio.get_running_loop().run_in_executor(None, store.get_task, task_id)
+        events.append({"type": "stage", **saved} if saved else {"type": "missing", "task_id": task_id})
+    return events
+
+def sse_message(event: Dict[str, Any]) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+@app.get("/tasks/events")
+async def task_events(ids: Optional[str] = None):
+    """
+    Progreso en vivo por Server-Sent Events, en lugar de consultar
+    /tasks/{task_id} en bucle. ids=a,b,c sigue esas tareas y cierra cuando
+    todas terminan; sin ids sigue todas. Eventos: stage (cambio de etapa,
+    con la tarea completa), progress (bytes, velocidad y ETA, limitado a
+    PROGRESS_EVENT_INTERVAL) y missing (id desconocido).
+    """
+    task_ids = parse_task_ids(ids)
+    # Suscribirse antes de la instantánea para no perder transiciones
+    subscription = progress_hub.subscribe(task_ids)
+    
+    async def events():
+        try:
+            pending = set(task_ids) if task_ids is not None else None
+            deadline = time.monotonic() + SSE_MAX_DURATION
+            yield "retry: 2000\n\n"
+            batch = await task_snapshots(task_ids)
+            while True:
+                if batch:
+                    yield "".join(sse_message(event) for event in batch)
+                    if pending is not None:
+                        pending.difference_update(event["task_id"] for event in batch if event_is_final(event))
+                        if not pending:
+                            return
+                else:
+                    yield ": keep-alive\n\n"
+                # Streams acotados: el servidor puede apagarse y EventSource se reconecta
+                remaining = deadline - time.monotonic()
+                if subscription.closed or remaining <= 0:
+                    return
+                batch = await subscription.next_batch(min(EVENTS_KEEPALIVE, remaining))
+        finally:
+            progress_hub.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.websocket("/ws/tasks")
+async def task_events_ws(websocket: WebSocket, ids: Optional[str] = None):
+    """
+    Progreso en vivo por WebSocket: los mismos eventos que /tasks/events,
+    un mensaje JSON por evento. El cliente cambia de tareas enviando
+    {"subscribe": [ids]} o {"unsubscribe": [ids]}; sin ids sigue todas.
+    """
+    await websocket.accept()
+    task_ids = parse_task_ids(ids)
+    subscription = progress_hub.subscribe(task_ids)
+    
+    async def receive_commands():
+        try:
+            while True:
+                try:
+                    message = await websocket.receive_json()
+                except ValueError:
+                    continue
+                if not isinstance(message, dict):
+                    continue
+                follow = [str(task_id) for task_id in message.get("subscribe") or []]
+                if follow and subscription.task_ids is not None:
+                    subscription.follow(follow)
+                    for event in await task_snapshots(follow):
+                        subscription.push(event)
+                subscription.unfollow(str(task_id) for task_id in message.get("unsubscribe") or [])
+        except WebSocketDisconnect:
+            pass
+    
+    reader = asyncio.create_task(receive_commands())
+    # El cliente se fue (o mandó algo inválido): despertar al bucle de envío
+    reader.add_done_callback(lambda _: subscription.close())
+    try:
+        batch = await task_snapshots(task_ids)
+        while not subscription.closed:
+            for event in batch:
+                await websocket.send_json(event)
+            batch = await subscription.next_batch(EVENTS_KEEPALIVE)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        reader.cancel()
+        progress_hub.unsubscribe(subscription)
+
 @app.get("/tasks/{task_id}")
 async def get_task_status(task_id: str):
     """Obtener estado de una tarea de descarga"""
-    if task_id not in download_tasks:
-        raise HTTPException(404, "Tarea no encontrada")
+    task = download_tasks.get(task_id)
+    if task is not None:
+        return task.to_dict()
     
-    task = download_tasks[task_id]
-    return {
-        "task_id": task_id,
-        "status": task.status,
-        "progress": task.progress,
-        "title": task.title,
-        "artist": task.artist,
-        "error": task.error,
-        "created_at": task.created_at
-    }
+    # Ya olvidada en memoria (o de antes de reiniciar): buscarla en la base de datos
+    saved = await asyncio.get_running_loop().run_in_executor(None, store.get_task, task_id)
+    if saved is None:
+        raise HTTPException(404, "Tarea no encontrada")
+    return saved
 
 if __name__ == "__main__":
     import uvicorn
@@ -602,4 +1161,5 @@ if __name__ == "__main__":
     logger.info(f"🚀 Iniciando servidor en puerto {port}")
     logger.info(f"📁 Directorio de descargas: {DOWNLOADS_DIR}")
     
-    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
+    # Sin plazo, un stream SSE abierto retrasaría el apagado hasta SSE_MAX_DURATION
+    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info", timeout_graceful_shutdown=SHUTDOWN_GRACE)
@@ -0,0 +1,168 @@
+"""
+Planificador de trabajos de descarga.
+
+POST /download solo encola la tarea y responde con su task_id; el
+planificador ejecuta los trabajos en segundo plano respetando un límite
+global de concurrencia y otro por fuente (youtube, etc). Los trabajos con
+la misma clave (id de video) se unifican: mientras uno está en curso, las
+peticiones siguientes se enganchan a esa misma tarea.
+"""
+import asyncio
+import logging
+import re
+import time
+import urllib.parse
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from config import MAX_CONCURRENT_JOBS, MAX_JOBS_PER_SOURCE
+
+logger = logging.getLogger(__name__)
+
+# Estados de una tarea de descarga
+TASK_STATES = ("pending", "extracting", "downloading", "transcoding", "completed", "error")
+FINAL_STATES = {"completed", "error"}
+
+
+def source_for_url(url: str) -> str:
+    """Obtener la fuente (sitio) de una URL para limitar concurrencia"""
+    host = urllib.parse.urlparse(url).netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if host == "youtu.be" or host.endswith("youtube.com"):
+        return "youtube"
+    return host or "unknown"
+
+
+_VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+
+def canonical_video_id(url: str) -> Optional[str]:
+    """Extraer el id de video de YouTube de cualquier forma de URL"""
+    parsed = urllib.parse.urlparse(url.strip())
+    host = parsed.netloc.lower()
+    candidate = None
+    if host.endswith("youtu.be"):
+        candidate = parsed.path.strip("/").split("/")[0]
+    elif host.endswith("youtube.com"):
+        query = urllib.parse.parse_qs(parsed.query)
+        if "v" in query:
+            candidate = query["v"][0]
+        else:
+            parts = parsed.path.strip("/").split("/")
+            if len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+                candidate = parts[1]
+    if candidate and _VIDEO_ID_RE.match(candidate):
+        return candidate
+    return None
+
+
+class JobScheduler:
+    """Ejecuta trabajos async con límite global y por fuente"""
+
+    def __init__(self, max_concurrent: int, per_source: int):
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_source = max(1, per_source)
+        self._global = asyncio.Semaphore(self.max_concurrent)
+        self._sources: Dict[str, asyncio.Semaphore] = {}
+        self._jobs: Set[asyncio.Task] = set()
+        self._inflight: Dict[str, Any] = {}
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.coalesced = 0
+        # Se llama con la tarea cuando empieza y cuando termina (p. ej. para persistirla)
+        self.on_update: Optional[Callable[[Any], None]] = None
+        self.closing = False
+
+    def submit(self, task: Any, source: str, job: Callable[[], Awaitable[Any]], key: Optional[str] = None) -> Any:
+        """
+        Encolar un trabajo; `task` es el registro que se actualiza con el resultado.
+        Si ya hay un trabajo en curso con la misma clave se devuelve su tarea
+        en lugar de lanzar otro.
+        """
+        if key is not None:
+            current = self._inflight.get(key)
+            if current is not None:
+                self.coalesced += 1
+                logger.info(f"🔗 Descarga unificada con la tarea {current.id} ({key})")
+                return current
+            self._inflight[key] = task
+
+        job_task = asyncio.create_task(self._run(task, source, job, key))
+        # Mantener referencia para que el recolector no cancele el trabajo
+        self._jobs.add(job_task)
+        job_task.add_done_callback(self._jobs.discard)
+        return task
+
+    async def _run(self, task: Any, source: str, job: Callable[[], Awaitable[Any]], key: Optional[str]):
+        try:
+            await self._execute(task, source, job)
+        finally:
+            if key is not None and self._inflight.get(key) is task:
+                del self._inflight[key]
+
+    async def _execute(self, task: Any, source: str, job: Callable[[], Awaitable[Any]]):
+        semaphore = self._sources.setdefault(source, asyncio.Semaphore(self.per_source))
+        self.waiting += 1
+        try:
+            async with semaphore:
+                async with self._global:
+                    self.waiting -= 1
+                    self.running += 1
+                    task.started_at = time.time()
+                    self._notify(task)
+                    try:
+                        task.result = await job()
+                        task.status = "completed"
+                        self.completed += 1
+                    except Exception as e:
+                        task.status = "error"
+                        task.error = str(e)
+                        self.failed += 1
+                        logger.error(f"❌ Trabajo {task.id} falló: {e}")
+                    finally:
+                        self.running -= 1
+                        task.finished_at = time.time()
+                        self._notify(task)
+        except asyncio.CancelledError:
+            if task.started_at is None:
+                self.waiting -= 1
+            if self.closing:
+                # Apagado del servidor: la tarea queda sin terminar en el
+                # diario y se reanuda al arrancar
+                task.finished_at = None
+            else:
+                task.status = "error"
+                task.error = "Trabajo cancelado"
+                task.finished_at = time.time()
+            self._notify(task)
+            raise
+
+    def _notify(self, task: Any):
+        if self.on_update is not None:
+            try:
+                self.on_update(task)
+            except Exception as e:
+                logger.warning(f"⚠️ Error notificando la tarea {task.id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_per_source": self.per_source,
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
+
+    async def shutdown(self):
+        self.closing = True
+        for job_task in list(self._jobs):
+            job_task.cancel()
+        await asyncio.gather(*self._jobs, return_exceptions=True)
+
+
+job_scheduler = JobScheduler(MAX_CONCURRENT_JOBS, MAX_JOBS_PER_SOURCE)
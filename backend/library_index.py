@@ -0,0 +1,154 @@
+"""
+Índice persistente de la biblioteca: (id de video, formato) -> archivo.
+
+Antes de descargar se consulta el índice; si la pista ya existe con ese
+formato se devuelve sin tocar la red ni FFmpeg. Las consultas se resuelven
+en memoria; los cambios se guardan en la tabla downloaded_songs del
+almacén (escritura diferida, ver store.py). Al arrancar se carga desde la
+base de datos, se importa el antiguo .library_index.json si existe y se
+valida contra los archivos que realmente hay en disco.
+"""
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = ".library_index.json"
+
+
+class LibraryIndex:
+    """Mapa persistente id de video + formato -> archivo descargado"""
+
+    def __init__(self, downloads_dir: Path, store):
+        self.downloads_dir = downloads_dir
+        self.store = store
+        self.path = downloads_dir / INDEX_FILENAME
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        # nombre de archivo -> claves que lo apuntan (format_of y remove_file sin recorrer todo)
+        self._by_file: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(video_id: str, fmt: str) -> str:
+        return f"{video_id}:{fmt}"
+
+    def load(self):
+        """Cargar el índice y descartar entradas cuyo archivo ya no existe"""
+        entries = {self.key(entry["video_id"], entry["format"]): entry for entry in self.store.load_songs()}
+        legacy = self._load_legacy_json()
+        if legacy:
+            for key, entry in legacy.items():
+                if key not in entries:
+                    entries[key] = entry
+                    self.store.put_song(self._row(entry))
+            # Ya está en la base de datos: el JSON queda solo como copia
+            self.store.flush()
+            try:
+                self.path.replace(self.path.with_suffix(".json.imported"))
+            except OSError:
+                pass
+            logger.info(f"📥 Importadas {len(legacy)} pistas del índice JSON antiguo")
+
+        valid = {}
+        for key, entry in entries.items():
+            if self._file_matches(entry):
+                valid[key] = entry
+            else:
+                self.store.delete_song(entry["video_id"], entry["format"])
+        dropped = len(entries) - len(valid)
+        self._entries = {}
+        self._by_file = {}
+        for key, entry in valid.items():
+            self._put(key, entry)
+        logger.info(f"📚 Índice de biblioteca: {len(valid)} pistas ({dropped} descartadas)")
+
+    def lookup(self, video_id: Optional[str], fmt: str) -> Optional[Dict[str, Any]]:
+        """Devolver la entrada de una pista ya descargada, si sigue en disco"""
+        if not video_id:
+            return None
+        key = self.key(video_id, fmt)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if not self._file_matches(entry):
+            self._drop(key)
+            self.store.delete_song(video_id, fmt)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def record(self, video_id: Optional[str], fmt: str, file_path: Path, metadata: Dict[str, Any]):
+        """Registrar una pista recién descargada"""
+        if not video_id:
+            return
+        stat = file_path.stat()
+        entry = {
+            **metadata,
+            "video_id": video_id,
+            "format": fmt,
+            "filename": file_path.name,
+            "file_size": stat.st_size,
+            "indexed_at": time.time(),
+        }
+        self._put(self.key(video_id, fmt), entry)
+        self.store.put_song(self._row(entry))
+
+    def format_of(self, filename: str) -> Optional[str]:
+        """Formato con el que se registró un archivo de la biblioteca"""
+        for key in self._by_file.get(filename, ()):
+            return self._entries[key]["format"]
+        return None
+
+    def remove_file(self, filename: str):
+        """Quitar del índice todas las entradas que apuntan a un archivo"""
+        keys = list(self._by_file.get(filename, ()))
+        for key in keys:
+            self._drop(key)
+        if keys:
+            self.store.delete_file(filename)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"tracks": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _put(self, key: str, entry: Dict[str, Any]):
+        previous = self._entries.get(key)
+        if previous is not None and previous["filename"] != entry["filename"]:
+            self._drop(key)
+        self._entries[key] = entry
+        self._by_file.setdefault(entry["filename"], set()).add(key)
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        keys = self._by_file.get(entry["filename"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_file[entry["filename"]]
+
+    def _file_matches(self, entry: Dict[str, Any]) -> bool:
+        try:
+            stat = (self.downloads_dir / entry["filename"]).stat()
+        except (OSError, KeyError):
+            return False
+        return stat.st_size == entry.get("file_size")
+
+    def _row(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {**entry, "file_path": str(self.downloads_dir / entry["filename"])}
+
+    def _load_legacy_json(self) -> Dict[str, Dict[str, Any]]:
+        """Entradas del antiguo índice JSON (antes de usar la base de datos)"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Índice JSON antiguo ilegible, se ignora: {e}")
+            return {}
+        return entries
@@ -1,15 +1,42 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 import yt_dlp
 import asyncio
 import os
 import json
+import shutil
+import threading
 import time
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import uuid
-from config import DOWNLOADS_DIR, YT_DLP_CONFIG, API_CONFIG
+from yt_dlp.utils import DownloadCancelled
+from config import DOWNLOADS_DIR, LIBRARY_OUTTMPL, YT_DLP_CONFIG, API_CONFIG, CATALOG_RESCAN_INTERVAL, STORAGE_BUDGET, MAX_FILE_SIZE_BYTES, TASK_TTL, MAX_FINISHED_TASKS
+from workers import worker_pools
+from pipeline import transcode_to_mp3, store_native, OutputTracker, NATIVE_FORMAT
+from jobs import canonical_video_id
+
+from library_index import LibraryIndex
+from metadata_cache import metadata_cache
+from catalog import LibraryCatalog
+from storage import StorageManager
+from strategy_engine import strategy_engine, DownloadFailed, StrategyError, classify_error
+from upstream import upstream, CircuitOpen
+from task_registry import TaskRegistry
+from store import store
+from database import SQLITE_FILES
+from variants import VariantStore, VARIANT_BITRATES, VARIANT_HINT_HEADERS
+from file_serving import file_response
+
+# Calidad de la etapa de transcodificación PREMIUM
+PREMIUM_MP3_QUALITY = '320'
+PREMIUM_FORMAT = f"mp3-{PREMIUM_MP3_QUALITY}"
+FFMPEG_LOCATION = 'C:\\ffmpeg\\bin'
+
+def premium_format(quality: str) -> str:
+    """quality=native guarda el audio original sin recodificar a MP3"""
+    return NATIVE_FORMAT if quality == NATIVE_FORMAT else PREMIUM_FORMAT
 
 # Crear app FastAPI
 app = FastAPI(
@@ -39,6 +66,9 @@ class SearchResult:
         self.view_count = data.get('view_count', 0)
 
 class DownloadTask:
+    # Registro compacto: sin __dict__ por tarea
+    __slots__ = ('id', 'url', 'quality', 'status', 'progress', 'file_path', 'error', 'finished_at')
+    
     def __init__(self, url: str, quality: str = "best"):
         self.id = str(uuid.uuid4())
         self.url = url
@@ -47,9 +77,64 @@ class DownloadTask:
         self.progress = 0
         self.file_path = None
         self.error = None
+        self.finished_at = None
+
+# Almacenamiento en memoria: las tareas terminadas caducan (TASK_TTL / MAX_FINISHED_TASKS)
+download_tasks = TaskRegistry(TASK_TTL, MAX_FINISHED_TASKS)
 
-# Almacenamiento en memoria (para desarrollo)
-download_tasks: Dict[str, DownloadTask] = {}
+# Descargas en curso por id de video (peticiones iguales comparten resultado)
+inflight_downloads: Dict[str, asyncio.Task] = {}
+
+# Índice persistente de pistas ya descargadas
+library_index = LibraryIndex(DOWNLOADS_DIR, store)
+
+# 🎚️ Variantes 128/192/320 generadas bajo demanda (DOWNLOADS_DIR/.variants)
+variant_store = VariantStore(DOWNLOADS_DIR)
+
+# Catálogo en memoria para /health
+catalog = LibraryCatalog(
+    DOWNLOADS_DIR,
+    path_for=lambda file_path: f"/download/{file_path.name}",
+    rescan_interval=CATALOG_RESCAN_INTERVAL
+)
+
+def forget_evicted(path: Path):
+    """🧹 Quitar de índices y catálogo una pista desalojada por el presupuesto de disco"""
+    if path.parent == DOWNLOADS_DIR:
+        library_index.remove_file(path.name)
+        catalog.remove(path.name)
+        variant_store.remove(path.name)
+
+# 💾 Presupuesto de disco de DOWNLOADS_DIR (pistas y variantes; también
+# cuentan las carreras de estrategias y la base de datos, que no se desalojan)
+storage = StorageManager(
+    [DOWNLOADS_DIR, variant_store.directory],
+    STORAGE_BUDGET,
+    MAX_FILE_SIZE_BYTES,
+    on_evict=forget_evicted,
+    rescan_interval=CATALOG_RESCAN_INTERVAL,
+    scratch=[DOWNLOADS_DIR / '.hedge', *SQLITE_FILES]
+)
+variant_store.on_add = storage.add
+variant_store.on_remove = storage.remove
+
+@app.on_event("startup")
+async def load_library_index():
+    store.start()
+    library_index.load()
+    catalog.scan()
+    catalog.start_watching()
+    storage.rescan()
+    storage.start_rescanning()
+    storage.enforce()
+    # 🏁 Restos de carreras de estrategias interrumpidas
+    shutil.rmtree(DOWNLOADS_DIR / '.hedge', ignore_errors=True)
+
+@app.on_event("shutdown")
+async def stop_catalog():
+    catalog.stop_watching()
+    storage.stop_rescanning()
+    store.stop()
 
 @app.get("/")
 async def root():
@@ -61,9 +146,9 @@ async def root():
     }
 
 @app.get("/download/{filename:path}")
-async def download_file(filename: str):
+async def download_file(filename: str, request: Request, bitrate: str = None):
     """
-    Servir archivos descargados
+    Servir archivos descargados (variante más ligera con ?bitrate= o Save-Data)
     """
     try:
         print(f"\n📁 === INICIO DESCARGA ===")
@@ -73,6 +158,8 @@ async def download_file(filename: str):
         import urllib.parse
         decoded_filename = urllib.parse.unquote(filename)
         print(f"📁 Archivo decodificado: {decoded_filename}")
+        if bitrate and bitrate not in VARIANT_BITRATES:
+            raise HTTPException(400, f"Bitrate no soportado: {bitrate}")
         
         file_path = DOWNLOADS_DIR / decoded_filename
         print(f"📁 Ruta completa: {file_path}")
@@ -88,17 +175,6 @@ async def download_file(filename: str):
             file_size = file_path.stat().st_size
             print(f"✅ Archivo encontrado, tamaño: {file_size} bytes")
             
-            # Determinar el tipo de media basado en la extensión
-            if decoded_filename.lower().endswith('.m4a'):
-                media_type = 'audio/mp4'
-            elif decoded_filename.lower().endswith('.mp3'):
-                media_type = 'audio/mpeg'
-            elif decoded_filename.lower().endswith('.webm'):
-                media_type = 'audio/webm'
-            else:
-                media_type = 'audio/mpeg'  # Por defecto
-            
-            print(f"✅ Media type: {media_type}")
             print(f"📁 === FIN DESCARGA OK ===\n")
             
             # Sanitizar nombre de archivo para headers HTTP (solo ASCII)
@@ -107,15 +183,20 @@ async def download_file(filename: str):
             if not safe_filename:
                 safe_filename = 'audio.mp3'
             
-            return FileResponse(
-                path=str(file_path),
-                filename=safe_filename,
-                media_type=media_type,
-                headers={
-                    'Accept-Ranges': 'bytes',
-                    'Content-Length': str(file_size),
-                    'Cache-Control': 'public, max-age=31536000'
-                }
+            # 🎚️ Variante según ?bitrate= o las pistas de red del cliente
+            served_path, variant_bitrate = variant_store.select(
+                file_path, bitrate, request.headers, library_index.format_of(decoded_filename), lambda: FFMPEG_LOCATION
+            )
+            headers = {'Vary': VARIANT_HINT_HEADERS, 'Accept-CH': VARIANT_HINT_HEADERS}
+            if variant_bitrate:
+                print(f"🎚️ Sirviendo variante {variant_bitrate}kbps")
+                headers['X-Variant'] = f"{variant_bitrate}k"
+                safe_filename = str(Path(safe_filename).with_suffix('.mp3'))
+            
+            # Range/If-Range (206) y validadores ETag/Last-Modified (304)
+            return file_response(
+                request, served_path, filename=safe_filename, extra_headers=headers,
+                on_close=storage.acquire(served_path)
             )
         else:
             print(f"❌ Archivo no encontrado: {file_path}")
@@ -194,23 +275,13 @@ async def health_check():
     Verificar estado del servidor y listar archivos descargados
     """
     try:
-        # Leer archivos reales del directorio
-        files = []
-        if DOWNLOADS_DIR.exists():
-            for file_path in DOWNLOADS_DIR.iterdir():
-                if file_path.is_file() and file_path.suffix.lower() in ['.mp3', '.wav', '.m4a', '.webm']:
-                    stat = file_path.stat()
-                    files.append({
-                        "filename": file_path.name,
-                        "title": file_path.stem,
-                        "size": stat.st_size,
-                        "modified": stat.st_mtime,
-                        "path": f"/download/{file_path.name}"
-                    })
+        # Archivos reales del directorio (instantánea del catálogo en memoria)
+        files = catalog.snapshot()
         
         return {
             "status": "success", 
             "message": "API funcionando correctamente",
+            "upstream": upstream.stats(),
             "downloads": files,
             "total": len(files)
         }
@@ -238,12 +309,13 @@ async def search_music(query: str):
             'extract_flat': True,
             'quiet': True,
             'no_warnings': True,
+            **upstream.ydl_options(),
         }
         
         search_query = f"ytsearch10:{query.strip()}"
         
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            search_results = ydl.extract_info(search_query, download=False)
+            search_results = await upstream.call(worker_pools.run, 'search', ydl.extract_info, search_query, download=False)
             
         # VERIFICAR QUE SEARCH_RESULTS NO SEA NONE
         if search_results is None:
@@ -259,16 +331,16 @@ async def search_music(query: str):
         for entry in search_results['entries']:
             if entry and isinstance(entry, dict):  # Verificar que entry no sea None y sea un diccionario
                 try:
-                result = SearchResult(entry)
-                results.append({
-                    'id': result.id,
-                    'title': result.title,
-                    'artist': result.uploader,
-                    'duration': result.duration,
-                    'thumbnail': result.thumbnail,
-                    'url': result.url,
-                    'view_count': result.view_count
-                })
+                    result = SearchResult(entry)
+                    results.append({
+                        'id': result.id,
+                        'title': result.title,
+                        'artist': result.uploader,
+                        'duration': result.duration,
+                        'thumbnail': result.thumbnail,
+                        'url': result.url,
+                        'view_count': result.view_count
+                    })
                 except Exception as entry_error:
                     print(f"⚠️ Error procesando entrada: {entry_error}")
                     continue  # Continuar con la siguiente entrada
@@ -279,6 +351,9 @@ async def search_music(query: str):
             "total": len(results)
         }
         
+    except CircuitOpen as e:
+        print(f"🚫 Búsqueda rechazada: {str(e)}")
+        raise HTTPException(503, str(e), headers={"Retry-After": str(int(e.retry_after) or 1)})
     except Exception as e:
         print(f"Error en búsqueda: {str(e)}")
         raise HTTPException(500, f"Error en búsqueda: {str(e)}")
@@ -286,19 +361,56 @@ async def search_music(query: str):
 @app.post("/download")
 async def download_audio(url: str, quality: str = "best"):
     """
-    🔥 BACKEND PREMIUM - Solo MP3 máxima calidad (320kbps)
+    🔥 BACKEND PREMIUM - MP3 máxima calidad (320kbps), o audio nativo con quality=native
     """
     print(f"🔥 [PREMIUM] Descarga MP3 máxima calidad: {url}")
-        
-        if not url:
-            raise HTTPException(400, "URL es requerida")
-        
+    
+    if not url:
+        raise HTTPException(400, "URL es requerida")
+    
+    # 📚 Si ya está en la biblioteca, responder sin red ni FFmpeg
+    video_id = canonical_video_id(url)
+    cached = library_index.lookup(video_id, premium_format(quality))
+    if cached:
+        print(f"📚 [PREMIUM] Ya en la biblioteca: {cached['filename']}")
+        return {
+            "status": "success",
+            "task_id": "biblioteca-" + video_id,
+            "file": {
+                "title": cached.get('title'),
+                "artist": cached.get('artist'),
+                "duration": cached.get('duration', 0),
+                "thumbnail": cached.get('thumbnail', ''),
+                "file_path": str(DOWNLOADS_DIR / cached['filename']),
+                "file_size": cached['file_size'],
+                "filename": cached['filename'],
+                "strategy_used": "biblioteca"
+            },
+            "message": "Pista ya descargada"
+        }
+    
     # 🎯 SOLO ESTRATEGIA PREMIUM - MP3 320kbps
     try:
-        print(f"🔥 [PREMIUM] Descargando MP3 de máxima calidad...")
-        result = await download_premium_mp3(url, quality)
+        key = f"{video_id or url}:{premium_format(quality)}"
+        job = inflight_downloads.get(key)
+        if job is None:
+            print(f"🔥 [PREMIUM] Descargando MP3 de máxima calidad...")
+            job = asyncio.create_task(download_premium_mp3(url, quality))
+            inflight_downloads[key] = job
+            job.add_done_callback(lambda _: inflight_downloads.pop(key, None))
+        else:
+            print(f"🔗 [PREMIUM] Descarga ya en curso para {key}, esperando su resultado")
+        
+        # shield: si un cliente se desconecta no se cancela la descarga de los demás
+        result = await asyncio.shield(job)
         print(f"✅ [PREMIUM] ¡Descarga MP3 exitosa!")
         return result
+    except DownloadFailed as e:
+        print(f"❌ [PREMIUM] Error en descarga MP3: {str(e)}")
+        if e.error_class == "circuit_open":
+            # 🚫 YouTube está limitando: que el cliente vuelva más tarde
+            raise HTTPException(503, str(e), headers={"Retry-After": str(int(upstream.breaker.retry_after()) or 1)})
+        raise HTTPException(500, f"Error en descarga premium: {str(e)}")
     except Exception as e:
         print(f"❌ [PREMIUM] Error en descarga MP3: {str(e)}")
         raise HTTPException(500, f"Error en descarga premium: {str(e)}")
@@ -310,29 +422,25 @@ async def download_premium_mp3(url: str, quality: str):
     print(f"🔥 [PREMIUM] Descarga MP3 máxima calidad (320kbps)")
     
     # CONFIGURACIÓN PREMIUM ULTRA-OPTIMIZADA
-        ydl_opts = {
+    ydl_opts = {
         # FORMATO PREMIUM - Solo los mejores formatos de audio
         'format': 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best',
-            'outtmpl': str(DOWNLOADS_DIR / '%(title)s.%(ext)s'),
-            'writethumbnail': False,
-            'writeinfojson': False,
-            'quiet': False,
-            'no_warnings': False,
+        'outtmpl': str(DOWNLOADS_DIR / LIBRARY_OUTTMPL),
+        'writethumbnail': False,
+        'writeinfojson': False,
+        'quiet': False,
+        'no_warnings': False,
         
-        # CONVERSIÓN A MP3 PREMIUM
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-            'preferredquality': '320',  # MÁXIMA CALIDAD MP3
-        }],
+        # CONVERSIÓN A MP3 PREMIUM: etapa separada (ver transcode_premium_result)
         
         # FFMPEG OPTIMIZADO
-        'ffmpeg_location': 'C:\\ffmpeg\\bin',
+        'ffmpeg_location': FFMPEG_LOCATION,
         
         # BYPASS AGRESIVO PARA CALIDAD PREMIUM
         'age_limit': 0,
             'no_check_certificate': True,
-        'ignoreerrors': True,
+        # Sin ignoreerrors: los fallos de yt-dlp llegan como excepción a
+        # upstream.call (circuit breaker) y al motor de estrategias
             'extract_flat': False,
             'writedescription': False,
             'writecomments': False,
@@ -341,11 +449,8 @@ async def download_premium_mp3(url: str, quality: str):
         
         # CONFIGURACIÓN ULTRA-ROBUSTA PREMIUM
         'socket_timeout': 1800,  # Timeout SÚPER largo para completar descarga
-        'retries': 100,  # Múltiples reintentos SÚPER agresivos
-        'fragment_retries': 100,  # Reintentos de fragmentos SÚPER agresivos
+        'max_filesize': MAX_FILE_SIZE_BYTES or None,  # Límite por archivo (MAX_FILE_SIZE)
         'http_chunk_size': 1048576,  # 1MB chunks para descarga más estable
-        'sleep_interval': 0.01,  # Sleep mínimo
-        'max_sleep_interval': 0.1,  # Sleep máximo mínimo
         # OPCIONES SÚPER AGRESIVAS ADICIONALES
         'no_color': True,
         'prefer_insecure': False,
@@ -363,7 +468,6 @@ async def download_premium_mp3(url: str, quality: str):
         # ESTRATEGIA DE FRAGMENTACIÓN ANTI-RATAS
         'concurrent_fragment_downloads': 1,  # Un fragmento a la vez
         'keep_fragments': True,  # Mantener fragmentos
-        'fragment_retries': 50,  # Reintentos de fragmentos SÚPER agresivos
         'skip_unavailable_fragments': True,  # Saltar fragmentos no disponibles
         # EVITAR CONFLICTOS DE RECURSOS
         'concurrent_fragment_downloads': 1,  # Un fragmento a la vez
@@ -471,15 +575,6 @@ async def download_premium_mp3(url: str, quality: str):
                 'youtube_skip_hls_manifest': True,
             }
         },
-        # 💣💣💣 CONFIGURACIÓN ANTI-BOT QUE ARRASA CON TODO 💣💣💣
-        'sleep_interval': 1,
-        'max_sleep_interval': 3,
-        'sleep_interval_requests': 1,
-        'sleep_interval_subtitles': 1,
-        'sleep_interval_requests': 1,
-        'sleep_interval_subtitles': 1,
-        'sleep_interval_requests': 1,
-        'sleep_interval_subtitles': 1,
         # ROTACIÓN DE USER-AGENTS Y BYPASS GEO
         'geo_bypass': True,
         'geo_bypass_country': 'US',
@@ -493,13 +588,9 @@ async def download_premium_mp3(url: str, quality: str):
         'sec_ch_ua_mobile': '?0',
         'sec_ch_ua_platform': '"Windows"',
         # BYPASS ADICIONAL PARA YOUTUBE
-        'extractor_retries': 3,
-        'fragment_retries': 3,
         'skip_unavailable_fragments': True,
         # SIMULACIÓN DE NAVEGADOR REAL
-        'simulate': True,
         'min_filesize': 0,
-        'max_filesize': None,
         # ESTRATEGIAS ADICIONALES ANTI-DETECCIÓN
         'no_color': True,
         'prefer_insecure': False,
@@ -534,44 +625,120 @@ async def download_premium_mp3(url: str, quality: str):
         # CONFIGURACIÓN DE EXTRACTOR
         'youtube_extract_flat': False,
         'youtube_skip_download': False,
+        # 🚦 Reintentos con backoff exponencial + jitter y limitador compartido
+        # (sustituyen a los sleep_interval fijos y a los 100 reintentos)
+        **upstream.ydl_options(),
     }
     
     # ESTRATEGIA RADICAL - MÚLTIPLES INTENTOS CON DIFERENTES CONFIGURACIONES
+    # (los reintentos son siempre los de upstream.ydl_options(): ninguna los pisa)
     strategies = [
         ("PREMIUM MP3 320kbps", ydl_opts),
         ("FALLBACK MP3 256kbps", {**ydl_opts, 'format': 'bestaudio[ext=m4a]/bestaudio/best'}),
         ("EMERGENCY MP3 128kbps", {**ydl_opts, 'format': 'worstaudio/worst'}),
-        ("ULTRA PERSISTENT MP3", {**ydl_opts, 'socket_timeout': 600, 'retries': 20, 'fragment_retries': 20}),
-        ("MAC DISPERSION MP3", {**ydl_opts, 'http_chunk_size': 2097152, 'sleep_interval': 0.1, 'max_sleep_interval': 0.3}),
-        ("MICRO CHUNKS MP3", {**ydl_opts, 'http_chunk_size': 524288, 'sleep_interval': 0.02, 'max_sleep_interval': 0.1}),
-        ("CONFUSION ALGORITHM MP3", {**ydl_opts, 'sleep_interval': 0.001, 'max_sleep_interval': 0.01, 'retries': 50}),
-        ("ALGORITHM DISRUPTION MP3", {**ydl_opts, 'http_chunk_size': 262144, 'sleep_interval': 0.005, 'max_sleep_interval': 0.05}),
-        ("ALGORITHM CONFUSION MP3", {**ydl_opts, 'http_chunk_size': 131072, 'sleep_interval': 0.002, 'max_sleep_interval': 0.02}),
-        ("ULTRA CONFUSION MP3", {**ydl_opts, 'http_chunk_size': 65536, 'sleep_interval': 0.001, 'max_sleep_interval': 0.01}),
-        ("DEVICE RESOURCE BUSY FIX MP3", {**ydl_opts, 'fragment_retries': 100, 'retries': 100, 'socket_timeout': 1200}),
-        ("ULTRA PERSISTENT RESOURCE MP3", {**ydl_opts, 'fragment_retries': 200, 'retries': 200, 'socket_timeout': 1800}),
+        ("ULTRA PERSISTENT MP3", {**ydl_opts, 'socket_timeout': 600}),
+        ("MAC DISPERSION MP3", {**ydl_opts, 'http_chunk_size': 2097152}),
+        ("MICRO CHUNKS MP3", {**ydl_opts, 'http_chunk_size': 524288}),
+        ("ALGORITHM DISRUPTION MP3", {**ydl_opts, 'http_chunk_size': 262144}),
+        ("ALGORITHM CONFUSION MP3", {**ydl_opts, 'http_chunk_size': 131072}),
+        ("ULTRA CONFUSION MP3", {**ydl_opts, 'http_chunk_size': 65536}),
+        ("DEVICE RESOURCE BUSY FIX MP3", {**ydl_opts, 'socket_timeout': 1200}),
+        ("ULTRA PERSISTENT RESOURCE MP3", {**ydl_opts, 'socket_timeout': 1800}),
     ]
     
-    for strategy_name, strategy_opts in strategies:
+    # 🧠 El motor prueba primero las que mejor funcionan, poda las inútiles,
+    # corre las mejores en carrera (HEDGE_STRATEGIES) y corta al agotar el
+    # plazo del trabajo (DOWNLOAD_DEADLINE)
+    async def attempt(strategy_name: str, strategy_opts: dict, cancel_event: threading.Event):
+        # 🏁 Cada participante de la carrera baja a su propio directorio
+        workdir = DOWNLOADS_DIR / '.hedge' / uuid.uuid4().hex
+        workdir.mkdir(parents=True)
+        print(f"🔥 Intentando estrategia: {strategy_name}")
         try:
-            print(f"🔥 Intentando estrategia: {strategy_name}")
-            result = await execute_premium_download(url, strategy_opts, strategy_name)
-            if result and result.get("status") == "success":
-                return result
-        except Exception as e:
-            print(f"❌ Estrategia {strategy_name} falló: {str(e)}")
-            continue
+            result = await execute_premium_download(
+                url, {**strategy_opts, 'outtmpl': str(workdir / LIBRARY_OUTTMPL)}, strategy_name, cancel_event
+            )
+        except BaseException:
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise
+        if cancel_event.is_set():
+            # Perdió la carrera: borrar lo descargado
+            shutil.rmtree(workdir, ignore_errors=True)
+        return result
+    
+    result = await strategy_engine.run(strategies, attempt)
+    workdir_file = Path(result["file"]["file_path"])
+    
+    if premium_format(quality) == NATIVE_FORMAT:
+        # 🏆 La copia nativa es la de la biblioteca: mover el archivo del ganador
+        final_file = DOWNLOADS_DIR / workdir_file.name
+        os.replace(workdir_file, final_file)
+        shutil.rmtree(workdir_file.parent, ignore_errors=True)
+        result["file"]["file_path"] = str(final_file)
+        return await transcode_premium_result(result, ydl_opts.get('ffmpeg_location'), quality)
     
-    raise Exception("Todas las estrategias de descarga fallaron")
+    # El MP3 se convierte desde el directorio del ganador: el original no pasa
+    # por DOWNLOADS_DIR, donde puede estar (o escribiéndose) la copia nativa
+    try:
+        return await transcode_premium_result(result, ydl_opts.get('ffmpeg_location'), quality)
+    finally:
+        shutil.rmtree(workdir_file.parent, ignore_errors=True)
 
-async def execute_premium_download(url: str, ydl_opts: dict, strategy_name: str):
+async def transcode_premium_result(result: dict, ffmpeg_location: str, quality: str = "best"):
     """
-    🔥 PREMIUM: Ejecutar descarga MP3 de máxima calidad
+    🔥 PREMIUM: Etapa de transcodificación a MP3 320kbps (o audio nativo)
     """
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Extraer información primero
-                info = ydl.extract_info(url, download=False)
+    source = Path(result["file"]["file_path"])
+    fmt = premium_format(quality)
+    if fmt == NATIVE_FORMAT:
+        stored_file = await store_native(source, ffmpeg_location)
+        print(f"📦 [PREMIUM] Audio nativo guardado sin recodificar: {stored_file.name}")
+    else:
+        target = DOWNLOADS_DIR / source.with_suffix('.mp3').name
+        stored_file = await transcode_to_mp3(source, PREMIUM_MP3_QUALITY, ffmpeg_location, target=target)
+        print(f"🎛️ [PREMIUM] MP3 {PREMIUM_MP3_QUALITY}kbps listo: {stored_file.name}")
+    
+    storage.check_size(stored_file)
+    result["file"].update({
+        "file_path": str(stored_file),
+        "file_size": stored_file.stat().st_size,
+        "filename": stored_file.name
+    })
+    
+    catalog.add(stored_file)
+    storage.add(stored_file)
+    
+    file_info = result["file"]
+    library_index.record(file_info.get("video_id"), fmt, stored_file, {
+        "title": file_info["title"],
+        "artist": file_info["artist"],
+        "duration": file_info["duration"],
+        "thumbnail": file_info["thumbnail"]
+    })
+    storage.enforce()
+    return result
+
+async def execute_premium_download(url: str, ydl_opts: dict, strategy_name: str,
+                                   cancel_event: Optional[threading.Event] = None):
+    """
+    🔥 PREMIUM: Etapa de fetch - descargar el mejor audio nativo
+    (cancel_event corta la descarga si otra estrategia ganó la carrera)
+    """
+    tracker = OutputTracker()
+    
+    def check_cancelled(d: dict):
+        if cancel_event is not None and cancel_event.is_set():
+            raise DownloadCancelled(f"{strategy_name} cancelada: otra estrategia ganó")
+    
+    hooked_opts = tracker.hook_options(ydl_opts)
+    hooked_opts['progress_hooks'] = [check_cancelled, *hooked_opts['progress_hooks']]
+    try:
+        with yt_dlp.YoutubeDL(hooked_opts) as ydl:
+            # Extraer información una sola vez (o reutilizar la de la caché)
+            info = metadata_cache.get(canonical_video_id(url))
+            if info is None:
+                info = await upstream.call(worker_pools.run, 'extract', ydl.extract_info, url, download=False)
+                metadata_cache.put(info)
             
             # VERIFICAR QUE INFO NO SEA NONE
             if info is None:
@@ -592,58 +759,59 @@ async def execute_premium_download(url: str, ydl_opts: dict, strategy_name: str)
             
             # VERIFICAR OTROS CAMPOS CRÍTICOS
             uploader = info.get('uploader', 'Artista desconocido')
-                duration = info.get('duration', 0)
+            duration = info.get('duration', 0)
             
             print(f"✅ [{strategy_name}] Info validada correctamente:")
             print(f"   - Título: {title}")
             print(f"   - Artista: {uploader}")
             print(f"   - Duración: {duration}")
-                
-                # Descargar el archivo
+            
+            # Descargar reutilizando el info dict, sin una segunda extracción
+            check_cancelled({})
             print(f"🔽 [{strategy_name}] Iniciando descarga...")
-                ydl.download([url])
+            await upstream.call(worker_pools.run, 'download', ydl.process_ie_result, info, download=True)
             print(f"✅ [{strategy_name}] Descarga completada: {title}")
+        
+        # Ruta reportada por los hooks de yt-dlp (sin esperas ni escaneos)
+        if not tracker.path or not os.path.isfile(tracker.path):
+            print(f"❌ [{strategy_name}] yt-dlp no reportó el archivo descargado")
+            raise Exception("Archivo descargado pero no encontrado")
+        
+        downloaded_file = Path(tracker.path)
+        print(f"📁 [{strategy_name}] Archivo descargado: {downloaded_file.name}")
+        
+        return {
+            "status": "success",
+            "task_id": "bomba-" + str(int(time.time())),
+            "file": {
+                "title": title,
+                "artist": uploader,
+                "duration": duration,
+                "thumbnail": info.get('thumbnail', '') if info else '',
+                "file_path": str(downloaded_file),
+                "file_size": downloaded_file.stat().st_size,
+                "filename": downloaded_file.name,
+                "video_id": info.get('id'),
+                "strategy_used": strategy_name
+            },
+            "message": f"Descarga exitosa con {strategy_name}"
+        }
                 
-                # Buscar el archivo descargado
-                time.sleep(2)  # Esperar a que se complete la escritura
-                
-                # Buscar archivos recientes (últimos 30 segundos)
-                current_time = time.time()
-                recent_files = []
-                
-                for file_path in DOWNLOADS_DIR.glob("*"):
-                    if file_path.is_file() and (current_time - file_path.stat().st_mtime) < 30:
-                        recent_files.append(file_path)
-                
-                if recent_files:
-                    # Tomar el archivo más reciente
-                    downloaded_file = max(recent_files, key=os.path.getctime)
-                    print(f"📁 [{strategy_name}] Archivo encontrado: {downloaded_file.name}")
-                    
-                    return {
-                        "status": "success",
-                        "task_id": "bomba-" + str(int(time.time())),
-                        "file": {
-                            "title": title,
-                            "artist": uploader,
-                            "duration": duration,
-                        "thumbnail": info.get('thumbnail', '') if info else '',
-                            "file_path": str(downloaded_file),
-                            "file_size": downloaded_file.stat().st_size,
-                        "filename": downloaded_file.name,
-                        "strategy_used": strategy_name
-                    },
-                    "message": f"Descarga exitosa con {strategy_name}"
-                    }
-                else:
-                    print(f"❌ [{strategy_name}] No se encontró archivo descargado")
-                    raise Exception("Archivo descargado pero no encontrado")
-                    
-        except Exception as e:
+    except Exception as e:
+        # La siguiente estrategia vuelve a extraer con sus propias opciones
+        metadata_cache.invalidate(canonical_video_id(url))
         print(f"❌ [{strategy_name}] Error en descarga: {str(e)}")
         import traceback
         traceback.print_exc()
-        raise Exception(f"Error en {strategy_name}: {str(e)}")
+        # Clasificar el error real de yt-dlp, no el mensaje con el nombre de la estrategia
+        raise StrategyError(f"Error en {strategy_name}: {str(e)}", classify_error(e)) from e
+
+@app.get("/storage")
+async def storage_stats():
+    """
+    💾 Uso de disco, presupuesto y desalojos
+    """
+    return {"status": "success", "storage": storage.stats()}
 
 @app.get("/premium-status")
 async def premium_status():
@@ -666,6 +834,8 @@ async def premium_status():
             "logs_tab": "Ve a Logs en Railway para ver errores en tiempo real",
             "monitoring": "Todos los errores se registran con traceback completo"
         },
+        "strategies": strategy_engine.stats(),
+        "upstream": upstream.stats(),
         "timestamp": time.time()
     }
 
@@ -761,6 +931,10 @@ async def delete_downloaded_file(filename: str):
             raise HTTPException(404, "Archivo no encontrado")
         
         file_path.unlink()
+        storage.remove(file_path)
+        library_index.remove_file(filename)
+        catalog.remove(filename)
+        variant_store.remove(filename)
         
         return {"status": "success", "message": "Archivo eliminado correctamente"}
         
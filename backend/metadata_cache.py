@@ -0,0 +1,65 @@
+"""
+Caché de metadatos de yt-dlp por id de video.
+
+El info dict de extract_info() se reutiliza para descargar con
+process_ie_result(), así cada pista se extrae una sola vez. Las URLs de
+los formatos caducan, por eso las entradas tienen un TTL corto y se
+invalidan si la descarga con ellas falla.
+"""
+import copy
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import METADATA_CACHE_TTL, METADATA_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataCache:
+    """LRU con TTL de info dicts completos (no planos) de yt-dlp"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, video_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Devolver una copia del info dict (yt-dlp lo modifica al descargar)"""
+        if not video_id:
+            return None
+        item = self._entries.get(video_id)
+        if item is None or time.monotonic() - item[0] > self.ttl:
+            if item is not None:
+                del self._entries[video_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(video_id)
+        self.hits += 1
+        return copy.deepcopy(item[1])
+
+    def put(self, info: Optional[Dict[str, Any]]):
+        if not info or not info.get('id') or info.get('_type', 'video') != 'video':
+            return
+        self._entries[info['id']] = (time.monotonic(), copy.deepcopy(info))
+        self._entries.move_to_end(info['id'])
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, video_id: Optional[str]):
+        if video_id:
+            self._entries.pop(video_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+metadata_cache = MetadataCache(METADATA_CACHE_TTL, METADATA_CACHE_MAX_ENTRIES)
@@ -0,0 +1,169 @@
+"""
+Etapas del pipeline de descarga.
+
+La descarga se separa en dos etapas independientes:
+  1. fetch: yt-dlp baja el mejor audio nativo (m4a/webm) sin postprocesar,
+     en el pool "download" (I/O de red).
+  2. transcode: FFmpeg convierte a MP3 en el pool "transcode", un pool de
+     procesos del tamaño del número de núcleos (CPU).
+
+Así un slot de red queda libre en cuanto terminan de llegar los bytes, y
+cada etapa se puede escalar por separado.
+
+En modo nativo (quality=native) no se recodifica: el audio m4a/webm se
+guarda tal cual, solo remultiplexado (-c:a copy) para dejar el índice del
+contenedor al principio y poder reproducirlo mientras se descarga.
+"""
+import logging
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+from workers import worker_pools
+
+logger = logging.getLogger(__name__)
+
+# Formato de biblioteca del modo sin recodificar
+NATIVE_FORMAT = 'native'
+
+# Muxer de FFmpeg para remultiplexar cada contenedor nativo
+REMUX_MUXERS = {
+    '.m4a': ['-f', 'ipod', '-movflags', '+faststart'],
+    '.webm': ['-f', 'webm'],
+}
+
+
+def fetch_options(ydl_opts: dict) -> dict:
+    """Copiar opciones de yt-dlp quitando la conversión inline a MP3"""
+    opts = dict(ydl_opts)
+    opts['postprocessors'] = [
+        pp for pp in ydl_opts.get('postprocessors', [])
+        if pp.get('key') != 'FFmpegExtractAudio'
+    ]
+    return opts
+
+
+class OutputTracker:
+    """Guarda la ruta del archivo que reportan los hooks de yt-dlp"""
+
+    def __init__(self):
+        self.path: Optional[str] = None
+
+    def progress_hook(self, d: dict):
+        if d['status'] == 'finished' and d.get('filename'):
+            self.path = d['filename']
+
+    def postprocessor_hook(self, d: dict):
+        if d['status'] == 'finished' and d.get('info_dict', {}).get('filepath'):
+            self.path = d['info_dict']['filepath']
+
+    def hook_options(self, ydl_opts: dict) -> dict:
+        """Copiar opciones de yt-dlp añadiendo los hooks del tracker"""
+        return {
+            **ydl_opts,
+            'progress_hooks': [*ydl_opts.get('progress_hooks', []), self.progress_hook],
+            'postprocessor_hooks': [*ydl_opts.get('postprocessor_hooks', []), self.postprocessor_hook],
+        }
+
+
+def ffmpeg_binary(location: Optional[str]) -> Optional[str]:
+    """Resolver el ejecutable de FFmpeg a partir de una ruta o directorio"""
+    if location and os.path.isdir(location):
+        for name in ('ffmpeg.exe', 'ffmpeg'):
+            candidate = os.path.join(location, name)
+            if os.path.isfile(candidate):
+                return candidate
+    elif location and os.path.isfile(location):
+        return location
+    elif location and shutil.which(location):
+        return shutil.which(location)
+    # Ruta configurada inexistente (p.ej. C:\ffmpeg\bin en Linux): usar el PATH
+    return shutil.which('ffmpeg')
+
+
+def partial_path(target: str) -> str:
+    """Ruta temporal donde FFmpeg escribe antes del renombrado final"""
+    return target + '.part'
+
+
+def remux_partial_path(source: str) -> str:
+    """
+    Temporal del remux. No puede ser el .part de siempre: ese es el
+    tmpfilename de yt-dlp, al que apunta el GrowingFile de /stream
+    """
+    return source + '.remux.part'
+
+
+def run_ffmpeg(source: str, target: str, output_args: list, ffmpeg_bin: str, keep_source: bool = False,
+               partial: Optional[str] = None) -> str:
+    """Ejecutar FFmpeg de source a target pasando por un .part (en un proceso del pool)"""
+    partial = partial or partial_path(target)
+    command = [
+        ffmpeg_bin, '-y', '-nostdin', '-loglevel', 'error',
+        '-i', source, '-vn', *output_args, partial,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise RuntimeError(f"FFmpeg falló ({result.returncode}): {result.stderr.strip()[-500:]}")
+
+    # Renombrado atómico: el archivo nunca se ve a medio escribir
+    os.replace(partial, target)
+    if not keep_source and os.path.abspath(source) != os.path.abspath(target):
+        os.remove(source)
+    return target
+
+
+def transcode_audio(source: str, target: str, bitrate: str, ffmpeg_bin: str, keep_source: bool = False) -> str:
+    """Convertir un archivo de audio a MP3"""
+    output_args = ['-codec:a', 'libmp3lame', '-b:a', f'{bitrate}k', '-f', 'mp3']
+    return run_ffmpeg(source, target, output_args, ffmpeg_bin, keep_source)
+
+
+def remux_audio(source: str, ffmpeg_bin: str) -> str:
+    """Remultiplexar el audio nativo sin recodificar, en el mismo archivo"""
+    extension = os.path.splitext(source)[1].lower()
+    output_args = ['-codec:a', 'copy', '-map_metadata', '0', *REMUX_MUXERS[extension]]
+    return run_ffmpeg(source, source, output_args, ffmpeg_bin, partial=remux_partial_path(source))
+
+
+async def transcode_to_mp3(source: Path, bitrate: str, ffmpeg_location: Optional[str],
+                          keep_source: bool = False, target: Optional[Path] = None) -> Path:
+    """
+    Etapa de transcodificación: encolar la conversión en el pool de procesos.
+    keep_source conserva el original; target (por defecto el mismo nombre
+    con .mp3) permite convertir desde un directorio temporal a la biblioteca.
+    """
+    target = target or source.with_suffix('.mp3')
+    ffmpeg_bin = ffmpeg_binary(ffmpeg_location)
+    if source.suffix.lower() == '.mp3' or not ffmpeg_bin:
+        if source.suffix.lower() != '.mp3':
+            logger.warning(f"⚠️ FFmpeg no disponible, se conserva el audio original: {source.name}")
+        # Sin conversión el original es el resultado: llevarlo al destino
+        if target.parent != source.parent:
+            moved = target.parent / source.name
+            os.replace(source, moved)
+            return moved
+        return source
+
+    logger.info(f"🎛️ Transcodificando a MP3 {bitrate}kbps: {source.name}")
+    await worker_pools.run('transcode', transcode_audio, str(source), str(target), bitrate, ffmpeg_bin, keep_source)
+    return target
+
+
+async def store_native(source: Path, ffmpeg_location: Optional[str]) -> Path:
+    """Etapa del modo nativo: remultiplexar (-c:a copy) en lugar de recodificar"""
+    ffmpeg_bin = ffmpeg_binary(ffmpeg_location)
+    if source.suffix.lower() not in REMUX_MUXERS or not ffmpeg_bin:
+        return source
+
+    logger.info(f"📦 Guardando audio nativo sin recodificar: {source.name}")
+    try:
+        await worker_pools.run('transcode', remux_audio, str(source), ffmpeg_bin)
+    except RuntimeError as e:
+        # El archivo original sigue intacto y es reproducible
+        logger.warning(f"⚠️ No se pudo remultiplexar {source.name}: {e}")
+    return source
@@ -0,0 +1,260 @@
+"""
+Canal push del progreso de las tareas (SSE y WebSocket).
+
+Seguir una descarga con GET /tasks/{task_id} era una petición HTTP
+completa por consulta. Aquí las tareas publican y cada conexión se
+suscribe a varias a la vez (o a todas):
+  - etapas: cada cambio de estado (pending -> extracting -> downloading ->
+    transcoding -> completed | error) se entrega siempre y en orden
+  - progreso: bytes, velocidad y ETA, a ritmo fijo (cada
+    PROGRESS_EVENT_INTERVAL segundos); si un cliente va lento, solo se le
+    guarda el último de cada tarea (no crece una cola)
+
+yt-dlp llama a update_progress por cada bloque que escribe, desde sus
+hilos. Ese camino busca el TaskProgress de la tarea (reservado al empezar
+la descarga) con un solo dict.get y apunta los bytes: sin divisiones,
+relojes ni eventos. Un único publicador en el event loop recorre las descargas
+activas a ritmo fijo, calcula porcentaje, velocidad suavizada (EWMA) y
+ETA, actualiza task.progress y publica. Si solo hay tamaño estimado
+(total_bytes_estimate, descargas por fragmentos) el porcentaje se queda
+por debajo del 100 hasta que termina.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from config import PROGRESS_EVENT_INTERVAL
+from jobs import FINAL_STATES
+
+logger = logging.getLogger(__name__)
+
+# Etapas pendientes por suscripción antes de empezar a descartar las viejas
+MAX_PENDING_STAGES = 256
+# Peso de la última muestra en la velocidad suavizada
+SPEED_SMOOTHING = 0.3
+# Tope del porcentaje mientras el total es solo una estimación
+ESTIMATED_MAX_PERCENT = 99.0
+
+
+class TaskProgress:
+    """Contadores de una descarga en curso; los escribe el hilo de yt-dlp"""
+
+    __slots__ = (
+        'task', 'downloaded', 'total', 'estimated', 'updates',
+        'seen', 'sampled_at', 'sampled_bytes', 'speed', 'eta',
+    )
+
+    def __init__(self, task):
+        self.task = task
+        self.downloaded = 0
+        self.total = 0
+        self.estimated = False
+        self.updates = 0
+        # Estado del publicador (solo lo toca el event loop)
+        self.seen = 0
+        self.sampled_at = time.monotonic()
+        self.sampled_bytes = 0
+        self.speed: Optional[float] = None
+        self.eta: Optional[float] = None
+
+    def record(self, downloaded: Optional[int], total: Optional[int], estimate: Optional[float]):
+        """Hook de yt-dlp: apuntar sin calcular nada"""
+        if downloaded:
+            self.downloaded = downloaded
+        if total:
+            self.total = total
+            self.estimated = False
+        elif estimate:
+            self.total = estimate
+            self.estimated = True
+        self.updates += 1
+
+    def sample(self, now: float):
+        """Velocidad (EWMA sobre el intervalo), ETA y porcentaje de la tarea"""
+        downloaded, total = self.downloaded, self.total
+        elapsed = now - self.sampled_at
+        # La primera muestra solo fija la base: al reanudar un .part los
+        # bytes que ya había no son velocidad
+        if self.sampled_bytes and elapsed > 0:
+            # max(0, ...): yt-dlp puede volver a empezar tras un reintento
+            current = max(0, downloaded - self.sampled_bytes) / elapsed
+            self.speed = current if self.speed is None else (
+                SPEED_SMOOTHING * current + (1 - SPEED_SMOOTHING) * self.speed)
+        self.sampled_at = now
+        self.sampled_bytes = downloaded
+        self.eta = (total - downloaded) / self.speed if total and self.speed else None
+        if self.eta is not None:
+            self.eta = max(0.0, self.eta)
+        if total:
+            percent = downloaded / total * 100
+            self.task.progress = min(percent, ESTIMATED_MAX_PERCENT if self.estimated else 100.0)
+
+
+class Subscription:
+    """Eventos pendientes de una conexión (un stream SSE o un WebSocket)"""
+
+    def __init__(self, task_ids: Optional[Iterable[str]] = None):
+        # None = todas las tareas
+        self.task_ids: Optional[Set[str]] = set(task_ids) if task_ids is not None else None
+        self._stages: Deque[Dict[str, Any]] = deque(maxlen=MAX_PENDING_STAGES)
+        self._progress: Dict[str, Dict[str, Any]] = {}
+        self._wake = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+
+    def wants(self, task_id: str) -> bool:
+        return self.task_ids is None or task_id in self.task_ids
+
+    def follow(self, task_ids: Iterable[str]):
+        if self.task_ids is not None:
+            self.task_ids.update(task_ids)
+
+    def unfollow(self, task_ids: Iterable[str]):
+        if self.task_ids is not None:
+            self.task_ids.difference_update(task_ids)
+
+    def push(self, event: Dict[str, Any]):
+        if event["type"] == "progress":
+            self._progress[event["task_id"]] = event
+        else:
+            if len(self._stages) == self._stages.maxlen:
+                self.dropped += 1
+            # La etapa lleva la instantánea completa: el progreso anterior sobra
+            self._progress.pop(event["task_id"], None)
+            self._stages.append(event)
+        self._wake.set()
+
+    def close(self):
+        self.closed = True
+        self._wake.set()
+
+    async def next_batch(self, timeout: float) -> List[Dict[str, Any]]:
+        """Eventos acumulados (etapas primero); lista vacía si vence el timeout"""
+        if not self._stages and not self._progress and not self.closed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._wake.clear()
+        batch = list(self._stages) + list(self._progress.values())
+        self._stages.clear()
+        self._progress.clear()
+        return batch
+
+
+class ProgressHub:
+    """Reparte etapas y progreso (a ritmo fijo) a los suscritos"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._subscribers: Set[Subscription] = set()
+        self._tracked: Dict[str, TaskProgress] = {}
+        # Búsqueda por bloque desde el hook de yt-dlp: el dict.get sin más capas
+        self.tracker_for: Callable[[Optional[str]], Optional[TaskProgress]] = self._tracked.get
+        # Última etapa vista por tarea
+        self._last_status: Dict[str, str] = {}
+        self._publisher: Optional[asyncio.Task] = None
+        self.published = 0
+        self.ticks = 0
+        self.updates = 0
+
+    def start(self):
+        """Arrancar el publicador de progreso (desde el event loop)"""
+        if self._publisher is None:
+            self._publisher = asyncio.get_running_loop().create_task(self._publish_loop())
+
+    def subscribe(self, task_ids: Optional[Iterable[str]] = None) -> Subscription:
+        subscription = Subscription(task_ids)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def close(self):
+        """Cerrar todas las suscripciones y parar el publicador (apagado)"""
+        if self._publisher is not None:
+            self._publisher.cancel()
+            self._publisher = None
+        for subscription in list(self._subscribers):
+            subscription.close()
+        self._subscribers.clear()
+
+    # --- descargas en curso ---
+
+    def track(self, task) -> TaskProgress:
+        """Reservar los contadores de progreso de una descarga que empieza"""
+        tracker = TaskProgress(task)
+        self._tracked[task.id] = tracker
+        return tracker
+
+    def untrack(self, task):
+        """La descarga acabó: último cálculo y publicación, y liberar"""
+        tracker = self._tracked.pop(task.id, None)
+        if tracker is not None:
+            self._publish_progress(tracker, time.monotonic())
+
+    # --- publicación ---
+
+    def stage(self, task):
+        """Publicar la tarea si cambió de etapa (sin límite de frecuencia)"""
+        if self._last_status.get(task.id) == task.status:
+            return
+        if task.status in FINAL_STATES:
+            self._last_status.pop(task.id, None)
+        else:
+            self._last_status[task.id] = task.status
+        if self._subscribers:
+            self._emit({"type": "stage", **task.to_dict()})
+
+    async def _publish_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._tracked:
+                continue
+            self.ticks += 1
+            now = time.monotonic()
+            for tracker in list(self._tracked.values()):
+                # Sin bloques nuevos desde el último tick: nada que contar
+                if tracker.updates != tracker.seen:
+                    self._publish_progress(tracker, now)
+
+    def _publish_progress(self, tracker: TaskProgress, now: float):
+        self.updates += tracker.updates - tracker.seen
+        tracker.seen = tracker.updates
+        tracker.sample(now)
+        if self._subscribers:
+            task = tracker.task
+            self._emit({
+                "type": "progress",
+                "task_id": task.id,
+                "status": task.status,
+                "progress": task.progress,
+                "downloaded_bytes": tracker.downloaded,
+                "total_bytes": tracker.total or None,
+                "total_estimated": tracker.estimated,
+                "speed": round(tracker.speed, 1) if tracker.speed is not None else None,
+                "eta": round(tracker.eta, 1) if tracker.eta is not None else None,
+            })
+
+    def _emit(self, event: Dict[str, Any]):
+        self.published += 1
+        for subscription in self._subscribers:
+            if subscription.wants(event["task_id"]):
+                subscription.push(event)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self._subscribers),
+            "interval": self.interval,
+            "downloads": len(self._tracked),
+            "updates": self.updates,
+            "ticks": self.ticks,
+            "published": self.published,
+            "dropped": sum(subscription.dropped for subscription in self._subscribers),
+        }
+
+
+progress_hub = ProgressHub(PROGRESS_EVENT_INTERVAL)
@@ -0,0 +1,148 @@
+"""
+Caché de resultados de búsqueda (TTL + LRU con tope de memoria).
+
+Las claves son la query normalizada (mayúsculas, espacios y acentos
+unificados), así "Bad  Bunny" y "bad bunny" comparten entrada. Las entradas
+vencidas todavía se sirven durante un margen mientras se refrescan en
+segundo plano (stale-while-revalidate).
+"""
+import asyncio
+import json
+import logging
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Set, Tuple
+
+from config import (
+    SEARCH_CACHE_TTL,
+    SEARCH_CACHE_STALE_TTL,
+    SEARCH_CACHE_MAX_ENTRIES,
+    SEARCH_CACHE_MAX_BYTES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Unificar mayúsculas, espacios y acentos de una query"""
+    decomposed = unicodedata.normalize('NFKD', query)
+    without_accents = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(without_accents.casefold().split())
+
+
+class _Entry:
+    __slots__ = ('value', 'stored_at', 'size')
+
+    def __init__(self, value: Any, size: int):
+        self.value = value
+        self.stored_at = time.monotonic()
+        self.size = size
+
+
+class SearchCache:
+    """Caché LRU con TTL, tope de memoria y refresco en segundo plano"""
+
+    def __init__(self, ttl: float, stale_ttl: float, max_entries: int, max_bytes: int):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.total_bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+
+    async def get_or_load(self, query: str, loader: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        """Devolver (valor, estado) donde estado es hit, stale o miss"""
+        key = normalize_query(query)
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            age = time.monotonic() - entry.stored_at
+            if age < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry.value, "hit"
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                self._refresh(key, loader)
+                return entry.value, "stale"
+            self._remove(key)
+
+        self.misses += 1
+        value = await loader()
+        self.put(key, value)
+        return value, "miss"
+
+    def put(self, key: str, value: Any):
+        # Listas vacías suelen ser errores transitorios del extractor
+        if not value:
+            return
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(value, size)
+        self.total_bytes += size
+        self._evict()
+
+    def _refresh(self, key: str, loader: Callable[[], Awaitable[Any]]):
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def _run():
+            try:
+                self.put(key, await loader())
+                self.refreshes += 1
+            except Exception as e:
+                logger.warning(f"⚠️ Error refrescando caché de '{key}': {e}")
+            finally:
+                self._refreshing.discard(key)
+
+        task = asyncio.create_task(_run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry.size
+
+    def _evict(self):
+        while self._entries and (
+            len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes
+        ):
+            key, entry = self._entries.popitem(last=False)
+            self.total_bytes -= entry.size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "refreshes": self.refreshes,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0.0,
+        }
+
+
+search_cache = SearchCache(
+    ttl=SEARCH_CACHE_TTL,
+    stale_ttl=SEARCH_CACHE_STALE_TTL,
+    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+    max_bytes=SEARCH_CACHE_MAX_BYTES,
+)
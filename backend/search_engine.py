@@ -0,0 +1,179 @@
+"""
+Motor de búsqueda por variantes de query.
+
+En modo "sequential" las variantes (query, query música, query audio,
+query song) se prueban una tras otra como antes. En modo "first" se lanzan
+en paralelo y gana el primer conjunto de resultados no vacío: las que
+están en vuelo se cancelan y las que aún no habían salido ya no se lanzan;
+en modo "merge" se esperan todas dentro del presupuesto de tiempo y se
+combinan sin duplicados. Nunca hay más de `parallel` variantes en vuelo a
+la vez (cada una es una extracción de yt-dlp y una llamada al upstream).
+Cada variante registra su tiempo para poder ajustar la lista.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from config import SEARCH_MODE, SEARCH_BUDGET, SEARCH_VARIANTS, SEARCH_PARALLEL
+
+logger = logging.getLogger(__name__)
+
+VariantRunner = Callable[[str], Awaitable[List[Dict[str, Any]]]]
+
+
+class VariantStats:
+    __slots__ = ('runs', 'hits', 'errors', 'cancelled', 'skipped', 'total_ms', 'max_ms')
+
+    def __init__(self):
+        self.runs = 0
+        self.hits = 0
+        self.errors = 0
+        self.cancelled = 0
+        # Sin lanzar: "first" ya tenía resultado o se agotó el presupuesto
+        self.skipped = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        timed = self.runs - self.cancelled
+        return {
+            "runs": self.runs,
+            "hits": self.hits,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+            "skipped": self.skipped,
+            "avg_ms": round(self.total_ms / timed, 1) if timed else 0.0,
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+class SearchEngine:
+    """Ejecuta las variantes de una búsqueda según el modo configurado"""
+
+    def __init__(self, mode: str, budget: float, variants: List[str], parallel: int = 2):
+        self.mode = mode if mode in ("sequential", "first", "merge") else "first"
+        self.budget = budget
+        self.parallel = max(1, parallel)
+        self.variants = variants
+        self._stats: Dict[str, VariantStats] = {}
+
+    async def search(self, query: str, run_variant: VariantRunner) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Devolver (entradas, tiempos por variante)"""
+        timings: List[Dict[str, Any]] = []
+        attempts = [(template, template.format(q=query)) for template in self.variants]
+        entries = await self._run(attempts, run_variant, timings)
+
+        # Si no encontramos nada, probar palabra por palabra
+        words = [word for word in query.split() if len(word) > 2]
+        if not entries and len(words) > 1:
+            logger.info("🔍 Intentando búsqueda más amplia...")
+            attempts = [("{palabra} música", f"{word} música") for word in words]
+            entries = await self._run(attempts, run_variant, timings)
+
+        return entries, timings
+
+    async def _run(self, attempts, run_variant: VariantRunner, timings) -> List[Dict[str, Any]]:
+        if self.mode == "sequential":
+            for label, text in attempts:
+                entries = await self._timed(label, text, run_variant, timings)
+                if entries:
+                    return entries
+            return []
+        return await self._fan_out(attempts, run_variant, timings)
+
+    async def _fan_out(self, attempts, run_variant: VariantRunner, timings) -> List[Dict[str, Any]]:
+        waiting = list(enumerate(attempts))
+        pending: Dict[asyncio.Task, int] = {}
+        results: Dict[int, List[Dict[str, Any]]] = {}
+        deadline = time.monotonic() + self.budget
+
+        def launch():
+            while waiting and len(pending) < self.parallel:
+                index, (label, text) = waiting.pop(0)
+                pending[asyncio.create_task(self._timed(label, text, run_variant, timings))] = index
+
+        try:
+            launch()
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"⏱️ Presupuesto de búsqueda agotado ({self.budget}s)")
+                    break
+                done, _ = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results[pending.pop(task)] = task.result()
+                if self.mode == "first" and any(results.values()):
+                    break
+                launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            for _, (label, text) in waiting:
+                self._stats.setdefault(label, VariantStats()).skipped += 1
+                timings.append({"variant": label, "query": text, "status": "skipped", "results": 0, "elapsed_ms": 0.0})
+
+        if self.mode == "first":
+            # Entre las que ya terminaron, preferir la variante de mayor prioridad
+            for index in sorted(results):
+                if results[index]:
+                    return results[index]
+            return []
+
+        merged: List[Dict[str, Any]] = []
+        seen = set()
+        for index in sorted(results):
+            for entry in results[index]:
+                key = entry.get('id') or entry.get('url')
+                if key in seen:
+                    continue
+                seen.add(key)
+                merged.append(entry)
+        return merged
+
+    async def _timed(self, label: str, text: str, run_variant: VariantRunner, timings) -> List[Dict[str, Any]]:
+        stats = self._stats.setdefault(label, VariantStats())
+        stats.runs += 1
+        started = time.monotonic()
+        status = "empty"
+        entries: List[Dict[str, Any]] = []
+        try:
+            logger.info(f"🔍 Intentando búsqueda: {text}")
+            entries = [entry for entry in await run_variant(text) if entry]
+            if entries:
+                status = "ok"
+                stats.hits += 1
+        except asyncio.CancelledError:
+            status = "cancelled"
+            stats.cancelled += 1
+            raise
+        except Exception as e:
+            status = "error"
+            stats.errors += 1
+            logger.warning(f"⚠️ Error en búsqueda '{text}': {e}")
+        finally:
+            elapsed = (time.monotonic() - started) * 1000
+            if status != "cancelled":
+                stats.total_ms += elapsed
+                stats.max_ms = max(stats.max_ms, elapsed)
+            timings.append({
+                "variant": label,
+                "query": text,
+                "status": status,
+                "results": len(entries),
+                "elapsed_ms": round(elapsed, 1),
+            })
+        return entries
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "budget_s": self.budget,
+            "parallel": self.parallel,
+            "variants": {label: stats.to_dict() for label, stats in self._stats.items()},
+        }
+
+
+search_engine = SearchEngine(SEARCH_MODE, SEARCH_BUDGET, SEARCH_VARIANTS, SEARCH_PARALLEL)
@@ -2,11 +2,18 @@ from http.server import HTTPServer, BaseHTTPRequestHandler
 import json
 import os
 from pathlib import Path
+from catalog import LibraryCatalog
 
 # Directorio de descargas
 DOWNLOADS_DIR = Path(__file__).parent / "downloads"
 DOWNLOADS_DIR.mkdir(exist_ok=True)
 
+# Catálogo en memoria: /health no recorre el directorio en cada petición.
+# Este servidor no recibe los avisos de fin de descarga y watchdog es
+# opcional: cada petición comprueba el mtime del directorio y reescanea si
+# cambió (un stat, no un listado)
+catalog = LibraryCatalog(DOWNLOADS_DIR, path_for=lambda file_path: f"/download/{file_path.name}")
+
 class SimpleHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         if self.path == '/':
@@ -28,17 +35,8 @@ class SimpleHandler(BaseHTTPRequestHandler):
             self.end_headers()
             
             # Listar archivos
-            files = []
-            if DOWNLOADS_DIR.exists():
-                for file_path in DOWNLOADS_DIR.iterdir():
-                    if file_path.is_file() and file_path.suffix.lower() in ['.mp3', '.wav', '.m4a', '.webm']:
-                        stat = file_path.stat()
-                        files.append({
-                            "filename": file_path.name,
-                            "title": file_path.stem,
-                            "size": stat.st_size,
-                            "path": f"/download/{file_path.name}"
-                        })
+            catalog.scan_if_changed()
+            files = catalog.snapshot()
             
             response = {
                 "status": "success",
@@ -84,6 +82,8 @@ class SimpleHandler(BaseHTTPRequestHandler):
         self.end_headers()
 
 if __name__ == "__main__":
+    catalog.scan()
+    catalog.start_watching()
     server = HTTPServer(('localhost', 8000), SimpleHandler)
     print("🚀 Servidor simple iniciado en http://localhost:8000")
     print("📁 Directorio de descargas:", DOWNLOADS_DIR)
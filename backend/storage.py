@@ -0,0 +1,341 @@
+"""
+Presupuesto de disco para DOWNLOADS_DIR.
+
+En Railway DOWNLOADS_DIR vive en /tmp y solo se vaciaba a mano. El gestor
+suma lo que ocupan las pistas y sus variantes y, cuando se pasa del
+presupuesto, borra hasta quedar por debajo de un margen. Se desaloja
+primero lo que menos prioridad tiene:
+
+    prioridad = último acceso + POPULARITY_WEIGHT * log2(1 + reproducciones)
+
+es decir, cada vez que se duplican las reproducciones la pista "vale" como
+si se hubiera escuchado una hora más tarde. Nunca se desalojan archivos
+fijados (se están enviando) ni los modificados hace menos de WRITE_GRACE
+segundos (se están escribiendo o transcodificando); los .part tampoco
+cuentan como candidatos.
+
+Lo que no se puede desalojar también ocupa y cuenta para el presupuesto:
+los temporales (.part) que haya en los directorios, los de las descargas
+en curso (writing), y los directorios y archivos de trabajo (scratch:
+.fetch, .hedge, la base de datos SQLite con su WAL).
+
+La cuenta de las pistas se lleva en memoria: se escanea el disco al
+arrancar y en un hilo de fondo cada rescan_interval segundos (para
+reconciliar lo que cambie por fuera), y entre medias cada descarga o
+variante nueva se suma con un solo stat. Así enforce() tras cada descarga
+no recorre el directorio de la biblioteca en el event loop; solo mide los
+temporales en curso y scratch, que son pocos archivos.
+
+Los restos de descargas interrumpidas (.part, fragmentos -Frag y .ytdl)
+que ninguna tarea va a reanudar se borran al arrancar.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+from catalog import AUDIO_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+POPULARITY_WEIGHT = 3600.0
+WRITE_GRACE = 600.0
+LOW_WATERMARK = 0.9
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+def is_partial(name: str) -> bool:
+    """Archivo temporal de yt-dlp o de FFmpeg"""
+    return name.endswith(('.part', '.ytdl')) or '.part-Frag' in name
+
+
+def partial_target(name: str) -> str:
+    """Nombre final al que pertenece un temporal (X.m4a.part-Frag3 -> X.m4a)"""
+    if '.part-Frag' in name:
+        return name[:name.index('.part-Frag')]
+    for suffix in ('.part', '.ytdl'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def remove_orphan_partials(directory: Path, keep: Iterable[str], everything: bool = False) -> int:
+    """
+    Borrar los temporales de descargas interrumpidas salvo los de las
+    descargas que se van a reanudar (keep: nombres finales, sin .part).
+    everything: el directorio solo guarda temporales (.fetch), así que
+    también sobran los archivos completos. Devuelve los bytes liberados.
+    """
+    keep = set(keep)
+    now = time.time()
+    freed = 0
+    try:
+        with os.scandir(directory) as it:
+            for item in it:
+                if not item.is_file() or not (everything or is_partial(item.name)):
+                    continue
+                if partial_target(item.name) in keep:
+                    continue
+                stat = item.stat()
+                if now - stat.st_mtime < WRITE_GRACE:
+                    continue
+                try:
+                    os.unlink(item.path)
+                except OSError:
+                    continue
+                freed += stat.st_size
+                logger.info(f"🧹 Temporal huérfano borrado: {item.name}")
+    except FileNotFoundError:
+        pass
+    return freed
+
+
+class StorageManager:
+    """Mantiene DOWNLOADS_DIR (y sus variantes) dentro de un presupuesto de bytes"""
+
+    def __init__(self, directories: List[Path], budget_bytes: int, max_file_bytes: int,
+                 on_evict: Optional[Callable[[Path], None]] = None, rescan_interval: float = 300.0,
+                 scratch: Iterable[Path] = (), writing: Optional[Callable[[], Iterable[Path]]] = None):
+        self.directories = directories
+        self.budget_bytes = budget_bytes
+        self.max_file_bytes = max_file_bytes
+        self.on_evict = on_evict
+        self.rescan_interval = rescan_interval
+        # Directorios y archivos de trabajo que ocupan pero no se desalojan
+        self.scratch = list(scratch)
+        # Temporales de las descargas en curso (los da quien descarga)
+        self.writing = writing
+        # Ruta -> (tamaño, mtime) de los archivos de audio que cuentan
+        self._files: Dict[str, Tuple[int, float]] = {}
+        # Ruta -> tamaño de los temporales vistos en el último escaneo
+        self._partials: Dict[str, int] = {}
+        self.overhead_bytes = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.scans = 0
+        self._access: Dict[str, Tuple[float, int]] = {}
+        self._pins: Dict[str, int] = {}
+        self.used_bytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.rejected = 0
+        self.last_run: Optional[float] = None
+
+    def touch(self, path: Path):
+        """Registrar una reproducción/descarga del archivo"""
+        key = str(path)
+        _, hits = self._access.get(key, (0.0, 0))
+        self._access[key] = (time.time(), hits + 1)
+
+    def pin(self, path: Path):
+        key = str(path)
+        self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, path: Path):
+        key = str(path)
+        count = self._pins.get(key, 0) - 1
+        if count > 0:
+            self._pins[key] = count
+        else:
+            self._pins.pop(key, None)
+
+    def acquire(self, path: Path) -> Callable[[], None]:
+        """Registrar el acceso y fijar el archivo; devuelve la función que lo libera"""
+        self.touch(path)
+        self.pin(path)
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.unpin(path)
+        return release
+
+    async def pinned(self, path: Path, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Envolver un stream para que su archivo no se desaloje mientras se envía"""
+        self.pin(path)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            self.unpin(path)
+
+    def check_size(self, path: Path):
+        """Rechazar (y borrar) un archivo que supera MAX_FILE_SIZE"""
+        size = path.stat().st_size
+        if self.max_file_bytes and size > self.max_file_bytes:
+            self.rejected += 1
+            path.unlink(missing_ok=True)
+            raise FileTooLarge(
+                f"El archivo ocupa {size / 1024 / 1024:.1f} MB y el límite es "
+                f"{self.max_file_bytes / 1024 / 1024:.0f} MB"
+            )
+
+    # --- cuenta de bytes ---
+
+    @property
+    def total_bytes(self) -> int:
+        """Pistas y variantes más temporales y scratch (medidos en el último enforce)"""
+        return self.used_bytes + self.overhead_bytes
+
+    def rescan(self):
+        """Reconciliar la cuenta con el disco (al arrancar y en el hilo de fondo)"""
+        audio, partials = self._scan()
+        files = {str(path): (size, mtime) for path, size, mtime in audio}
+        with self._lock:
+            self._files = files
+            self._partials = partials
+            self.used_bytes = sum(size for size, _ in files.values())
+        self.scans += 1
+
+    def add(self, path: Path):
+        """Sumar (o actualizar) un archivo recién escrito"""
+        if path.suffix.lower() not in AUDIO_EXTENSIONS:
+            return
+        try:
+            stat = path.stat()
+        except OSError:
+            return
+        with self._lock:
+            previous = self._files.get(str(path))
+            self._files[str(path)] = (stat.st_size, stat.st_mtime)
+            self.used_bytes += stat.st_size - (previous[0] if previous else 0)
+            # Su .part ya no existe: deja de contar como temporal
+            self._partials.pop(f"{path}.part", None)
+
+    def remove(self, path: Path):
+        """Descontar un archivo borrado (y olvidar sus accesos)"""
+        with self._lock:
+            previous = self._files.pop(str(path), None)
+            if previous:
+                self.used_bytes -= previous[0]
+        self._access.pop(str(path), None)
+
+    def start_rescanning(self):
+        if self.rescan_interval > 0:
+            threading.Thread(target=self._rescan_loop, name="storage-rescan", daemon=True).start()
+
+    def stop_rescanning(self):
+        self._stop.set()
+
+    def _rescan_loop(self):
+        while not self._stop.wait(self.rescan_interval):
+            try:
+                self.rescan()
+            except Exception as e:
+                logger.warning(f"⚠️ Error reescaneando el almacenamiento: {e}")
+
+    # --- desalojo ---
+
+    def enforce(self) -> int:
+        """Desalojar archivos hasta volver al presupuesto; devuelve los bytes liberados"""
+        self.last_run = time.time()
+        if not self.budget_bytes:
+            return 0
+        self.overhead_bytes = self._measure_overhead()
+        if self.total_bytes <= self.budget_bytes:
+            return 0
+
+        with self._lock:
+            files = [(Path(key), size, mtime) for key, (size, mtime) in self._files.items()]
+        target = self.budget_bytes * LOW_WATERMARK
+        now = time.time()
+        freed = 0
+        for path, size, mtime in sorted(files, key=lambda f: self._priority(f[0], f[2])):
+            if self.total_bytes <= target:
+                break
+            key = str(path)
+            if self._pins.get(key) or now - mtime < WRITE_GRACE:
+                continue
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                # Ya no estaba (borrado por fuera): solo sobraba en la cuenta
+                self.remove(path)
+                continue
+            except OSError as e:
+                logger.warning(f"⚠️ No se pudo desalojar {path.name}: {e}")
+                continue
+            self.remove(path)
+            freed += size
+            self.evictions += 1
+            self.evicted_bytes += size
+            logger.info(f"🧹 Desalojado {path.name} ({size / 1024 / 1024:.1f} MB)")
+            if self.on_evict:
+                self.on_evict(path)
+
+        if self.total_bytes > self.budget_bytes:
+            logger.warning("⚠️ Presupuesto de disco superado: todo lo restante está en uso")
+        return freed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "budget_bytes": self.budget_bytes,
+            "max_file_bytes": self.max_file_bytes,
+            "used_bytes": self.used_bytes,
+            "overhead_bytes": self.overhead_bytes,
+            "total_bytes": self.total_bytes,
+            "files": len(self._files),
+            "partial_files": len(self._partials),
+            "scans": self.scans,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+            "rejected": self.rejected,
+            "pinned": len(self._pins),
+            "last_run": self.last_run,
+        }
+
+    def _priority(self, path: Path, mtime: float) -> float:
+        last_access, hits = self._access.get(str(path), (mtime, 0))
+        return max(last_access, mtime) + POPULARITY_WEIGHT * math.log2(1 + hits)
+
+    def _scan(self) -> Tuple[List[Tuple[Path, int, float]], Dict[str, int]]:
+        files = []
+        partials = {}
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as it:
+                    for item in it:
+                        if not item.is_file():
+                            continue
+                        path = Path(item.path)
+                        if path.suffix.lower() in AUDIO_EXTENSIONS:
+                            stat = item.stat()
+                            files.append((path, stat.st_size, stat.st_mtime))
+                        elif is_partial(item.name):
+                            partials[item.path] = item.stat().st_size
+            except FileNotFoundError:
+                continue
+        return files, partials
+
+    def _measure_overhead(self) -> int:
+        """Bytes de temporales y scratch: lo que ocupa disco sin poder desalojarse"""
+        with self._lock:
+            partials = dict(self._partials)
+        for path in self.writing() if self.writing else ():
+            try:
+                partials[str(path)] = path.stat().st_size
+            except OSError:
+                continue
+        total = sum(partials.values())
+        for path in self.scratch:
+            if path.is_dir():
+                for root, _, names in os.walk(path):
+                    for name in names:
+                        try:
+                            total += os.stat(os.path.join(root, name)).st_size
+                        except OSError:
+                            continue
+            else:
+                try:
+                    total += path.stat().st_size
+                except OSError:
+                    continue
+        return total
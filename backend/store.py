@@ -0,0 +1,306 @@
+"""
+Almacén persistente de la biblioteca y de las tareas de descarga.
+
+Por defecto es un SQLite en modo WAL dentro de DOWNLOADS_DIR (ver
+database.py). Las escrituras no tocan la base de datos durante la
+petición: se encolan y el hilo "db-writer" las vuelca por lotes en una
+sola transacción cada DB_FLUSH_INTERVAL segundos, o antes si se juntan
+DB_BATCH_SIZE pendientes. Varias actualizaciones de la misma tarea dentro
+de un lote se funden en una. Las lecturas miran primero lo pendiente.
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from config import DB_FLUSH_INTERVAL, DB_BATCH_SIZE
+from database import SessionLocal, DownloadedSong, DownloadTaskRecord, IS_SQLITE, create_tables
+from jobs import canonical_video_id, FINAL_STATES
+
+logger = logging.getLogger(__name__)
+
+TASK_COLUMNS = (
+    'url', 'video_id', 'quality', 'status', 'progress', 'title', 'artist', 'duration',
+    'file_path', 'error', 'result', 'created_at', 'started_at', 'finished_at',
+    'partial_path', 'attempts',
+)
+SONG_COLUMNS = (
+    'title', 'artist', 'filename', 'file_path', 'file_size', 'duration',
+    'thumbnail_url', 'download_date', 'url',
+)
+
+
+def _to_datetime(timestamp: Optional[float]) -> datetime:
+    moment = datetime.fromtimestamp(timestamp, timezone.utc) if timestamp else datetime.now(timezone.utc)
+    return moment.replace(tzinfo=None)
+
+
+def _to_timestamp(moment: Optional[datetime]) -> Optional[float]:
+    return moment.replace(tzinfo=timezone.utc).timestamp() if moment else None
+
+
+def song_row(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Fila de downloaded_songs a partir de una entrada del índice de biblioteca"""
+    return {
+        "video_id": entry["video_id"],
+        "format": entry["format"],
+        "title": entry.get("title") or entry["filename"],
+        "artist": entry.get("artist"),
+        "filename": entry["filename"],
+        "file_path": entry.get("file_path"),
+        "file_size": entry.get("file_size"),
+        "duration": entry.get("duration"),
+        "thumbnail_url": entry.get("thumbnail"),
+        "download_date": _to_datetime(entry.get("indexed_at")),
+        "url": entry.get("url"),
+    }
+
+
+def song_entry(song: DownloadedSong) -> Dict[str, Any]:
+    """Entrada del índice de biblioteca a partir de una fila"""
+    return {
+        "title": song.title,
+        "artist": song.artist,
+        "duration": song.duration,
+        "thumbnail": song.thumbnail_url or "",
+        "url": song.url,
+        "video_id": song.video_id,
+        "format": song.format,
+        "filename": song.filename,
+        "file_size": song.file_size,
+        "indexed_at": _to_timestamp(song.download_date),
+    }
+
+
+def task_row(task) -> Dict[str, Any]:
+    """Instantánea de una DownloadTask para download_tasks"""
+    return {
+        "id": task.id,
+        "url": task.url,
+        "video_id": canonical_video_id(task.url),
+        "quality": task.quality,
+        "status": task.status,
+        "progress": task.progress,
+        "title": getattr(task, "title", None),
+        "artist": getattr(task, "artist", None),
+        "duration": getattr(task, "duration", None),
+        "file_path": task.file_path,
+        "error": task.error,
+        "result": json.dumps(getattr(task, "result", None), default=str),
+        "created_at": getattr(task, "created_at", None),
+        "started_at": getattr(task, "started_at", None),
+        "finished_at": task.finished_at,
+        "partial_path": str(task.stream.path) if getattr(task, "stream", None) else None,
+        "attempts": getattr(task, "attempts", 0),
+    }
+
+
+def _record_row(record: DownloadTaskRecord) -> Dict[str, Any]:
+    return {"id": record.id, **{column: getattr(record, column) for column in TASK_COLUMNS}}
+
+
+def task_dict(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Misma forma que DownloadTask.to_dict() para una tarea guardada"""
+    return {
+        "task_id": row["id"],
+        "url": row["url"],
+        "status": row["status"],
+        "progress": row["progress"],
+        "title": row["title"],
+        "artist": row["artist"],
+        "error": row["error"],
+        "file": json.loads(row["result"]) if row["result"] else None,
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+    }
+
+
+class Store:
+    """Biblioteca y tareas en base de datos, con escritura diferida por lotes"""
+
+    def __init__(self, session_factory, flush_interval: float, batch_size: int):
+        self._session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # Operaciones de biblioteca en orden: ('put', fila) | ('delete', (id, formato)) | ('delete_file', nombre)
+        self._song_ops: List[Tuple[str, Any]] = []
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+        # Lote que se está escribiendo (sigue visible para get_task)
+        self._flushing: Dict[str, Dict[str, Any]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self.flushes = 0
+        self.rows_written = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        create_tables()
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Parar el hilo y volcar lo pendiente"""
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    # --- escrituras (no bloquean) ---
+
+    def put_song(self, entry: Dict[str, Any]):
+        self._enqueue_song(('put', song_row(entry)))
+
+    def delete_song(self, video_id: str, fmt: str):
+        self._enqueue_song(('delete', (video_id, fmt)))
+
+    def delete_file(self, filename: str):
+        self._enqueue_song(('delete_file', filename))
+
+    def put_task(self, task, urgent: bool = False):
+        """Encolar el estado de una tarea; urgent despierta al escritor ya (diario)"""
+        row = task_row(task)
+        with self._lock:
+            self._tasks[row["id"]] = row
+            pending = len(self._tasks) + len(self._song_ops)
+        if urgent or pending >= self.batch_size:
+            self._wake.set()
+
+    # --- lecturas ---
+
+    def load_songs(self) -> List[Dict[str, Any]]:
+        with self._session_factory() as session:
+            return [song_entry(song) for song in session.scalars(select(DownloadedSong))]
+
+    def unfinished_tasks(self) -> List[Dict[str, Any]]:
+        """Filas de tareas que no llegaron a terminar (para reencolarlas al arrancar)"""
+        self.flush()
+        with self._session_factory() as session:
+            records = session.scalars(
+                select(DownloadTaskRecord)
+                .where(DownloadTaskRecord.status.not_in(FINAL_STATES))
+                .order_by(DownloadTaskRecord.created_at)
+            )
+            return [_record_row(record) for record in records]
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Tarea guardada (pendiente de volcar o ya en la base de datos)"""
+        with self._lock:
+            row = self._tasks.get(task_id) or self._flushing.get(task_id)
+        if row is None:
+            with self._session_factory() as session:
+                record = session.get(DownloadTaskRecord, task_id)
+                if record is None:
+                    return None
+                row = _record_row(record)
+        return task_dict(row)
+
+    # --- volcado ---
+
+    def flush(self) -> int:
+        """Escribir todo lo pendiente en una transacción; devuelve las filas escritas"""
+        with self._lock:
+            song_ops, self._song_ops = self._song_ops, []
+            tasks, self._tasks = self._tasks, {}
+            self._flushing = tasks
+        if not song_ops and not tasks:
+            return 0
+
+        started = time.monotonic()
+        try:
+            with self._session_factory() as session, session.begin():
+                for op, value in song_ops:
+                    if op == 'put':
+                        self._upsert_song(session, value)
+                    elif op == 'delete':
+                        video_id, fmt = value
+                        session.execute(delete(DownloadedSong).where(
+                            DownloadedSong.video_id == video_id, DownloadedSong.format == fmt))
+                    else:
+                        session.execute(delete(DownloadedSong).where(DownloadedSong.filename == value))
+                if tasks:
+                    self._upsert_tasks(session, list(tasks.values()))
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"❌ Error volcando {len(song_ops) + len(tasks)} cambios a la base de datos: {e}")
+            # Reintentar en el siguiente volcado sin pisar cambios más nuevos
+            with self._lock:
+                self._song_ops = song_ops + self._song_ops
+                for task_id, row in tasks.items():
+                    self._tasks.setdefault(task_id, row)
+                self._flushing = {}
+            return 0
+
+        with self._lock:
+            self._flushing = {}
+        written = len(song_ops) + len(tasks)
+        self.flushes += 1
+        self.rows_written += written
+        self.last_flush_ms = round((time.monotonic() - started) * 1000, 2)
+        return written
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._song_ops) + len(self._tasks)
+        return {
+            "backend": "sqlite" if IS_SQLITE else "sql",
+            "pending": pending,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "errors": self.errors,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+    def _enqueue_song(self, op: Tuple[str, Any]):
+        with self._lock:
+            self._song_ops.append(op)
+            pending = len(self._tasks) + len(self._song_ops)
+        if pending >= self.batch_size:
+            self._wake.set()
+
+    def _loop(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def _upsert_song(self, session, row: Dict[str, Any]):
+        if IS_SQLITE:
+            stmt = sqlite_insert(DownloadedSong).values(**row)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['video_id', 'format'],
+                set_={column: stmt.excluded[column] for column in SONG_COLUMNS},
+            )
+            session.execute(stmt)
+            return
+        session.execute(delete(DownloadedSong).where(
+            DownloadedSong.video_id == row["video_id"], DownloadedSong.format == row["format"]))
+        session.add(DownloadedSong(**row))
+
+    def _upsert_tasks(self, session, rows: List[Dict[str, Any]]):
+        if IS_SQLITE:
+            # Un solo INSERT ... ON CONFLICT para todo el lote
+            stmt = sqlite_insert(DownloadTaskRecord)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['id'],
+                set_={column: stmt.excluded[column] for column in TASK_COLUMNS},
+            )
+            session.execute(stmt, rows)
+            return
+        for row in rows:
+            session.merge(DownloadTaskRecord(**row))
+
+
+store = Store(SessionLocal, DB_FLUSH_INTERVAL, DB_BATCH_SIZE)
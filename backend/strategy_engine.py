@@ -0,0 +1,305 @@
+"""
+Motor de estrategias de descarga con estadísticas.
+
+download_premium_mp3 probaba hasta 12 configuraciones de yt-dlp siempre en
+el mismo orden, cada una con cientos de reintentos, así que una URL que no
+se puede bajar ocupaba un worker durante minutos. El motor:
+  - registra por estrategia intentos, éxitos, latencia media y errores por
+    clase (no disponible, 403, 429, red, extracción...)
+  - ordena las estrategias por tiempo esperado hasta el éxito (duración
+    media de un intento / tasa de éxito, suavizada si no hay datos)
+  - descarta las que casi nunca funcionan (cada EXPLORE_EVERY trabajos se
+    vuelven a probar al final) y, dentro de un trabajo, las que suelen
+    fallar con la misma clase de error que acaba de aparecer
+  - corta en cuanto el error es definitivo (video no disponible) y no
+    lanza más estrategias si el circuito hacia YouTube está abierto
+  - respeta un plazo total por trabajo y recorta el timeout de cada
+    intento al tiempo que queda (los reintentos son siempre los de
+    upstream.ydl_options)
+  - opcionalmente corre las mejores 2-3 en carrera (hedging) con una
+    ventaja inicial para la primera: gana la que termina antes y las demás
+    se cancelan con su evento (el hook de progreso de yt-dlp lo consulta)
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from config import DOWNLOAD_DEADLINE, HEDGE_STRATEGIES, HEDGE_DELAY
+
+logger = logging.getLogger(__name__)
+
+MIN_SAMPLES = 5
+PRUNE_SUCCESS_RATE = 0.05
+SAME_ERROR_RATE = 0.8
+EXPLORE_EVERY = 10
+DEFAULT_LATENCY = 30.0
+# Coste mínimo de un intento: un fallo instantáneo tampoco es gratis
+MIN_ATTEMPT_COST = 1.0
+EWMA_ALPHA = 0.3
+
+# Errores tras los que ninguna otra estrategia va a funcionar
+PERMANENT_ERRORS = {"unavailable"}
+
+_ERROR_PATTERNS = [
+    ("circuit_open", ("circuito abierto",)),
+    ("unavailable", ("video unavailable", "private video", "has been removed", "copyright", "not available in your country")),
+    ("rate_limited", ("429", "too many requests")),
+    ("forbidden", ("403", "forbidden")),
+    ("bot_check", ("sign in to confirm", "confirm you're not a bot")),
+    ("timeout", ("timed out", "timeout", "plazo")),
+    ("network", ("connection", "resource busy", "errno", "network", "unreachable", "reset by peer")),
+    ("extract", ("unable to extract", "no se pudo extraer", "información")),
+    ("missing_file", ("no encontrado", "no reportó")),
+]
+
+
+def classify_error(error: BaseException) -> str:
+    """Clase de error a partir del mensaje de yt-dlp / de la excepción"""
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    # Ya clasificada antes de envolverla (StrategyError, DownloadFailed)
+    error_class = getattr(error, "error_class", None)
+    if error_class:
+        return error_class
+    message = str(error).lower()
+    for error_class, patterns in _ERROR_PATTERNS:
+        if any(pattern in message for pattern in patterns):
+            return error_class
+    return "other"
+
+
+class StrategyError(Exception):
+    """
+    Fallo de una estrategia con la clase de la excepción original: el
+    mensaje envuelto lleva el nombre de la estrategia, que no debe
+    confundirse con el texto del error
+    """
+
+    def __init__(self, message: str, error_class: str):
+        super().__init__(message)
+        self.error_class = error_class
+
+
+class DownloadFailed(Exception):
+    """Ninguna estrategia funcionó (o se agotó el plazo)"""
+
+    def __init__(self, message: str, error_class: str):
+        super().__init__(message)
+        self.error_class = error_class
+
+
+class StrategyStats:
+    def __init__(self):
+        self.attempts = 0
+        self.successes = 0
+        self.latency: Optional[float] = None
+        self.errors: Dict[str, int] = {}
+        self.last_error: Optional[str] = None
+
+    @property
+    def success_rate(self) -> float:
+        # Suavizado de Laplace: sin datos vale 0.5
+        return (self.successes + 1) / (self.attempts + 2)
+
+    def expected_cost(self) -> float:
+        latency = DEFAULT_LATENCY if self.latency is None else max(self.latency, MIN_ATTEMPT_COST)
+        return latency / self.success_rate
+
+    def record(self, elapsed: float, error_class: Optional[str]):
+        self.attempts += 1
+        # Duración media de un intento, haya salido bien o mal
+        self.latency = elapsed if self.latency is None else EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.latency
+        if error_class is None:
+            self.successes += 1
+        else:
+            self.errors[error_class] = self.errors.get(error_class, 0) + 1
+            self.last_error = error_class
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "attempts": self.attempts,
+            "successes": self.successes,
+            "success_rate": round(self.success_rate, 3),
+            "avg_latency": round(self.latency, 2) if self.latency is not None else None,
+            "errors": dict(self.errors),
+        }
+
+
+class StrategyEngine:
+    """Ordena, poda y ejecuta estrategias con plazo total por trabajo"""
+
+    def __init__(self, deadline: float, hedge: int = 1, hedge_delay: float = 5.0):
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self._stats: Dict[str, StrategyStats] = {}
+        self._background: Set[asyncio.Task] = set()
+        self.jobs = 0
+        self.deadline_exceeded = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.cancelled = 0
+
+    def plan(self, names: List[str]) -> List[str]:
+        """Orden de prueba para un trabajo nuevo"""
+        explore = self.jobs % EXPLORE_EVERY == 0
+        ranked = sorted(
+            range(len(names)),
+            key=lambda i: (self._stats_for(names[i]).expected_cost(), i)
+        )
+        active = [names[i] for i in ranked if not self._pruned(names[i])]
+        if explore:
+            active += [names[i] for i in ranked if self._pruned(names[i])]
+        return active or [names[ranked[0]]]
+
+    def attempt_options(self, ydl_opts: dict, remaining: float) -> dict:
+        """Recortar el timeout de yt-dlp al tiempo que queda"""
+        opts = dict(ydl_opts)
+        opts['socket_timeout'] = max(5, min(opts.get('socket_timeout') or remaining, remaining))
+        return opts
+
+    async def run(self, strategies: List[Tuple[str, dict]],
+                  attempt: Callable[[str, dict, threading.Event], Awaitable[Any]],
+                  deadline: Optional[float] = None,
+                  hedge: Optional[int] = None,
+                  hedge_delay: Optional[float] = None) -> Any:
+        """
+        Probar estrategias en el orden aprendido hasta que una funcione.
+
+        Con hedge > 1 se corren hasta `hedge` a la vez: la siguiente arranca
+        si la actual no ha terminado tras hedge_delay segundos (o en cuanto
+        falla). Gana la primera que termina bien; a las demás se les activa
+        su evento de cancelación y terminan (y limpian) en segundo plano.
+        """
+        self.jobs += 1
+        hedge = max(1, hedge or self.hedge)
+        hedge_delay = self.hedge_delay if hedge_delay is None else hedge_delay
+        options = dict(strategies)
+        started = time.monotonic()
+        limit = started + (deadline or self.deadline)
+        queue = deque(self.plan([name for name, _ in strategies]))
+        running: Dict[asyncio.Task, Tuple[str, threading.Event, float]] = {}
+        failed_classes = set()
+        last_error = None
+        circuit_error = None
+        first_launched = None
+
+        def launch() -> bool:
+            while queue:
+                name = queue.popleft()
+                if any(self._fails_with(name, error_class) for error_class in failed_classes):
+                    logger.info(f"⏭️ Estrategia {name} omitida: suele fallar con {', '.join(failed_classes)}")
+                    continue
+                remaining = limit - time.monotonic()
+                cancel_event = threading.Event()
+                task = asyncio.create_task(attempt(name, self.attempt_options(options[name], remaining), cancel_event))
+                running[task] = (name, cancel_event, time.monotonic())
+                return True
+            return False
+
+        def abandon_running():
+            # Los perdedores no se esperan: su evento los corta y limpian solos
+            for task, (name, cancel_event, _) in running.items():
+                cancel_event.set()
+                self.cancelled += 1
+                self._background.add(task)
+                task.add_done_callback(self._discard_background)
+            running.clear()
+
+        launch()
+        if running:
+            first_launched = next(iter(running.values()))[0]
+        while running:
+            remaining = limit - time.monotonic()
+            if remaining <= 0:
+                abandon_running()
+                break
+            can_hedge = len(running) < hedge and bool(queue)
+            done, _ = await asyncio.wait(
+                running.keys(),
+                timeout=min(remaining, hedge_delay) if can_hedge else remaining,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                if can_hedge and limit > time.monotonic() and launch():
+                    self.hedged += 1
+                    logger.info(f"🏁 Carrera: lanzada también {list(running.values())[-1][0]}")
+                continue
+
+            for task in done:
+                name, _, attempt_started = running.pop(task)
+                elapsed = time.monotonic() - attempt_started
+                error = task.exception()
+                if error is None:
+                    self._stats_for(name).record(elapsed, None)
+                    if name != first_launched:
+                        self.hedge_wins += 1
+                    abandon_running()
+                    logger.info(f"✅ Estrategia {name} funcionó en {time.monotonic() - started:.1f}s")
+                    return task.result()
+
+                error_class = classify_error(error)
+                if error_class != "circuit_open":
+                    # Rechazada sin llegar a YouTube: no dice nada de la estrategia
+                    self._stats_for(name).record(elapsed, error_class)
+                last_error = f"{name}: {error or type(error).__name__}"
+                logger.warning(f"❌ Estrategia {name} falló ({error_class}): {error}")
+                if error_class in PERMANENT_ERRORS:
+                    abandon_running()
+                    raise DownloadFailed(str(error), error_class)
+                if error_class == "circuit_open":
+                    # YouTube está limitando: las demás fallarían igual; las
+                    # que ya corren (la de prueba del circuito) siguen
+                    circuit_error = error
+                    queue.clear()
+                failed_classes.add(error_class)
+
+            # Un fallo libera un hueco: la siguiente arranca sin esperar
+            while len(running) < hedge and launch():
+                pass
+
+        if circuit_error is not None:
+            raise DownloadFailed(str(circuit_error), "circuit_open")
+        if time.monotonic() >= limit:
+            self.deadline_exceeded += 1
+            raise DownloadFailed(f"Plazo de {limit - started:g}s agotado (último error: {last_error})", "timeout")
+        raise DownloadFailed(f"Todas las estrategias de descarga fallaron (último error: {last_error})", "exhausted")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "jobs": self.jobs,
+            "deadline": self.deadline,
+            "deadline_exceeded": self.deadline_exceeded,
+            "hedge": self.hedge,
+            "hedge_delay": self.hedge_delay,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "cancelled": self.cancelled,
+            "cancelling": len(self._background),
+            "strategies": {name: stats.to_dict() for name, stats in self._stats.items()},
+        }
+
+    def _discard_background(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.info(f"🛑 Estrategia cancelada terminó: {task.exception()}")
+
+    def _stats_for(self, name: str) -> StrategyStats:
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = StrategyStats()
+        return stats
+
+    def _pruned(self, name: str) -> bool:
+        stats = self._stats_for(name)
+        return stats.attempts >= MIN_SAMPLES and stats.successes / stats.attempts < PRUNE_SUCCESS_RATE
+
+    def _fails_with(self, name: str, error_class: str) -> bool:
+        stats = self._stats_for(name)
+        return stats.attempts >= MIN_SAMPLES and stats.errors.get(error_class, 0) / stats.attempts >= SAME_ERROR_RATE
+
+
+strategy_engine = StrategyEngine(DOWNLOAD_DEADLINE, HEDGE_STRATEGIES, HEDGE_DELAY)
@@ -0,0 +1,195 @@
+"""
+Reproducción progresiva: servir un archivo mientras todavía se escribe.
+
+Una tarea publica el archivo que está creciendo (el .part de yt-dlp o la
+salida del transcodificador) como un GrowingFile. El lector abre el
+descriptor una vez y va leyendo hasta el frente de escritura; al llegar al
+final espera a que haya más datos y continúa, hasta que el escritor marca
+el archivo como completo. Como el descriptor sigue abierto, los renombrados
+(.part -> final) y el borrado del original tras transcodificar no cortan
+la lectura.
+
+Para escuchas puntuales también se puede transcodificar al vuelo: FFmpeg
+lee el audio de origen y su stdout va directo a la respuesta, sin escribir
+nada en DOWNLOADS_DIR. Esos FFmpeg no pasan por el pool de transcodificación,
+así que LiveTranscodes limita cuántos corren a la vez.
+"""
+import asyncio
+import logging
+import subprocess
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = 64 * 1024
+POLL_INTERVAL = 0.2
+
+
+class LiveTranscodes:
+    """Plazas para transcodificaciones al vuelo; sin plaza libre se rechaza (no se encola)"""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+        self.started = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> Optional[Callable[[], None]]:
+        """Reservar una plaza; devuelve la función que la libera o None si no hay"""
+        if self.active >= self.limit:
+            self.rejected += 1
+            return None
+        self.active += 1
+        self.started += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.active -= 1
+        return release
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "active": self.active, "started": self.started, "rejected": self.rejected}
+
+
+class GrowingFile:
+    """Archivo en escritura: ruta temporal, ruta final y estado del escritor"""
+
+    def __init__(self, path: Path, final_path: Optional[Path] = None):
+        self.path = path
+        self.final_path = final_path or path
+        self.complete = False
+        self.failed = False
+
+    def finish(self):
+        self.complete = True
+
+    def fail(self):
+        self.failed = True
+
+    def open(self):
+        """Abrir la ruta temporal o, si ya se renombró, la final"""
+        for candidate in (self.path, self.final_path):
+            try:
+                return open(candidate, 'rb')
+            except FileNotFoundError:
+                continue
+        return None
+
+
+async def tail_growing_file(
+    growing: GrowingFile,
+    is_disconnected: Callable[[], Awaitable[bool]],
+    open_timeout: float = 30.0,
+) -> AsyncIterator[bytes]:
+    """Leer un GrowingFile hasta el final, esperando en el frente de escritura"""
+    loop = asyncio.get_running_loop()
+
+    # El escritor puede tardar un momento en crear el archivo
+    waited = 0.0
+    f = growing.open()
+    while f is None:
+        if growing.failed or growing.complete or waited >= open_timeout or await is_disconnected():
+            return
+        await asyncio.sleep(POLL_INTERVAL)
+        waited += POLL_INTERVAL
+        f = growing.open()
+
+    sent = 0
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, f.read, STREAM_CHUNK_SIZE)
+            if chunk:
+                sent += len(chunk)
+                yield chunk
+                continue
+            # En el frente de escritura: terminar o esperar más datos
+            if growing.failed:
+                logger.warning(f"⚠️ Stream cortado, falló la escritura de {growing.final_path.name}")
+                return
+            if growing.complete:
+                rest = await loop.run_in_executor(None, f.read)
+                if rest:
+                    sent += len(rest)
+                    yield rest
+                return
+            if await is_disconnected():
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+    finally:
+        f.close()
+        logger.info(f"📡 Stream de {growing.final_path.name}: {sent} bytes enviados")
+
+
+def select_audio_source(info: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, str]]]:
+    """URL y cabeceras HTTP del mejor audio de un info dict de yt-dlp"""
+    if info.get('url'):
+        return info['url'], info.get('http_headers') or {}
+    formats = [f for f in info.get('formats') or [] if f.get('url')]
+    audio_only = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') != 'none']
+    candidates = audio_only or formats
+    if not candidates:
+        return None
+    best = max(candidates, key=lambda f: f.get('abr') or f.get('tbr') or 0)
+    return best['url'], best.get('http_headers') or {}
+
+
+def ffmpeg_pipe_command(ffmpeg_bin: str, source_url: str, http_headers: Dict[str, str], bitrate: str) -> List[str]:
+    """Comando de FFmpeg que lee el origen y escribe MP3 por stdout"""
+    command = [ffmpeg_bin, '-nostdin', '-loglevel', 'error']
+    if source_url.startswith(('http://', 'https://')):
+        command += ['-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5']
+        if http_headers:
+            command += ['-headers', ''.join(f'{k}: {v}\r\n' for k, v in http_headers.items())]
+    command += [
+        '-i', source_url,
+        '-vn', '-codec:a', 'libmp3lame', '-b:a', f'{bitrate}k',
+        '-f', 'mp3', 'pipe:1',
+    ]
+    return command
+
+
+async def ffmpeg_stream(command: List[str], release: Optional[Callable[[], None]] = None) -> AsyncIterator[bytes]:
+    """
+    Ejecutar FFmpeg y entregar su stdout por bloques. La memoria por stream
+    queda acotada al buffer del lector (un bloque) más el de la tubería: si
+    el cliente no consume, FFmpeg se bloquea al escribir. Si el cliente se
+    desconecta, la cancelación llega aquí y el proceso se mata. release
+    libera la plaza de LiveTranscodes cuando el proceso ya no corre.
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            limit=STREAM_CHUNK_SIZE,
+        )
+    except BaseException:
+        if release:
+            release()
+        raise
+    sent = 0
+    try:
+        while True:
+            chunk = await process.stdout.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            sent += len(chunk)
+            yield chunk
+        returncode = await process.wait()
+        if returncode != 0:
+            stderr = (await process.stderr.read()).decode(errors='replace').strip()
+            logger.error(f"❌ FFmpeg terminó con código {returncode}: {stderr[-500:]}")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+            logger.info(f"🛑 Transcodificación al vuelo cancelada tras {sent} bytes")
+        else:
+            logger.info(f"📡 Transcodificación al vuelo: {sent} bytes enviados")
+        if release:
+            release()
@@ -0,0 +1,94 @@
+"""
+Registro acotado de tareas de descarga.
+
+download_tasks era un dict que solo crecía: las tareas terminadas (bien o
+con error) se quedaban para siempre. El registro conserva las tareas en
+curso sin límite y, de las terminadas, solo las de los últimos TASK_TTL
+segundos y como mucho MAX_FINISHED_TASKS (se olvidan primero las que
+terminaron antes). La purga es perezosa: se hace al registrar o listar
+tareas, como mucho una vez cada PURGE_INTERVAL segundos salvo que se haya
+pasado del tope.
+
+Con un store (ver store.py) las tareas además se guardan en la base de
+datos, así que se pueden consultar después de olvidarlas o de reiniciar.
+"""
+import logging
+import time
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL = 30.0
+
+
+class TaskRegistry:
+    """Tareas por id; las terminadas caducan por edad y por número"""
+
+    def __init__(self, ttl: float, max_finished: int, store=None):
+        self.ttl = ttl
+        self.max_finished = max(0, max_finished)
+        self.store = store
+        self._tasks: Dict[str, Any] = {}
+        self._last_purge = 0.0
+        self.evicted = 0
+
+    def add(self, task):
+        self._tasks[task.id] = task
+        # Entra en el diario cuanto antes: si el proceso muere se reencola
+        self.save(task, urgent=True)
+        self.purge()
+
+    def save(self, task, urgent: bool = False):
+        """Persistir el estado actual de la tarea (escritura diferida)"""
+        if self.store is not None:
+            self.store.put_task(task, urgent)
+
+    def get(self, task_id: Optional[str]):
+        if task_id is None:
+            return None
+        return self._tasks.get(task_id)
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._tasks
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def values(self) -> Iterator[Any]:
+        self.purge()
+        return iter(list(self._tasks.values()))
+
+    def purge(self, force: bool = False) -> int:
+        """Olvidar tareas terminadas caducadas o que sobran; devuelve cuántas"""
+        now = time.time()
+        if not force and now - self._last_purge < PURGE_INTERVAL and len(self._tasks) <= self.max_finished:
+            return 0
+        self._last_purge = now
+
+        finished = sorted(
+            (task.finished_at, task_id)
+            for task_id, task in self._tasks.items()
+            if task.finished_at is not None
+        )
+        expired = [task_id for finished_at, task_id in finished if now - finished_at > self.ttl]
+        keep = finished[len(expired):]
+        if len(keep) > self.max_finished:
+            expired += [task_id for _, task_id in keep[:len(keep) - self.max_finished]]
+
+        for task_id in expired:
+            del self._tasks[task_id]
+        if expired:
+            self.evicted += len(expired)
+            logger.info(f"🧹 {len(expired)} tareas terminadas olvidadas ({len(self._tasks)} en el registro)")
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        finished = sum(1 for task in self._tasks.values() if task.finished_at is not None)
+        return {
+            "total": len(self._tasks),
+            "active": len(self._tasks) - finished,
+            "finished": finished,
+            "evicted": self.evicted,
+            "ttl": self.ttl,
+            "max_finished": self.max_finished,
+        }
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Los módulos del backend se importan planos (como en improved_main.py)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Base de datos propia de los tests (store.py la abre al importarse)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='backend-tests-')}/tests.db")
@@ -0,0 +1,33 @@
+import os
+
+from catalog import LibraryCatalog
+
+
+def make_catalog(directory):
+    catalog = LibraryCatalog(directory, path_for=lambda path: f"/download/{path.name}")
+    catalog.scan()
+    return catalog
+
+
+def test_scan_if_changed_picks_up_new_and_deleted_files(tmp_path):
+    catalog = make_catalog(tmp_path)
+    assert catalog.scan_if_changed() is False
+
+    (tmp_path / "nueva [abc].mp3").write_bytes(b'x' * 10)
+    assert catalog.scan_if_changed() is True
+    assert [entry["title"] for entry in catalog.snapshot()] == ["nueva"]
+
+    os.unlink(tmp_path / "nueva [abc].mp3")
+    assert catalog.scan_if_changed() is True
+    assert catalog.snapshot() == []
+
+
+def test_scan_if_changed_is_a_no_op_without_changes(tmp_path, monkeypatch):
+    (tmp_path / "tema.mp3").write_bytes(b'x')
+    catalog = make_catalog(tmp_path)
+    scans = []
+    monkeypatch.setattr(catalog, "scan", lambda: scans.append(1))
+
+    for _ in range(100):
+        catalog.scan_if_changed()
+    assert scans == []
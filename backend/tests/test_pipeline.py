@@ -0,0 +1,71 @@
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from pipeline import ffmpeg_binary, remux_audio, transcode_audio
+
+# Duración del audio de prueba (segundos)
+SAMPLE_SECONDS = 120
+
+
+@pytest.fixture(scope="module")
+def ffmpeg_bin():
+    ffmpeg_bin = ffmpeg_binary(None)
+    if not ffmpeg_bin:
+        pytest.skip("FFmpeg no disponible")
+    return ffmpeg_bin
+
+
+@pytest.fixture(scope="module")
+def native_sample(ffmpeg_bin, tmp_path_factory):
+    """Audio nativo como el que baja yt-dlp: AAC 128k en m4a"""
+    path = tmp_path_factory.mktemp("pipeline") / "sample.m4a"
+    subprocess.run([
+        ffmpeg_bin, '-y', '-nostdin', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={SAMPLE_SECONDS}',
+        '-codec:a', 'aac', '-b:a', '128k', str(path),
+    ], check=True)
+    return path
+
+
+def test_remux_does_not_touch_the_download_part(ffmpeg_bin, native_sample, tmp_path):
+    source = tmp_path / "song.m4a"
+    shutil.copy(native_sample, source)
+    # Ruta del tmpfilename de yt-dlp, a la que sigue apuntando task.stream
+    stream_part = tmp_path / "song.m4a.part"
+    stream_part.write_bytes(b'lo que ya ha leido /stream')
+
+    remux_audio(str(source), ffmpeg_bin)
+
+    assert stream_part.read_bytes() == b'lo que ya ha leido /stream'
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["song.m4a", "song.m4a.part"]
+    assert source.stat().st_size > 0
+
+
+def test_native_vs_mp3_benchmark(ffmpeg_bin, native_sample, tmp_path):
+    """Tiempo de codificación y disco: remux nativo frente a MP3 (192k improved_main, 320k main.py)"""
+    results = {}
+
+    source = tmp_path / "native.m4a"
+    shutil.copy(native_sample, source)
+    started = time.perf_counter()
+    remux_audio(str(source), ffmpeg_bin)
+    results['native'] = (time.perf_counter() - started, source.stat().st_size)
+
+    for bitrate in ('192', '320'):
+        target = tmp_path / f"mp3-{bitrate}.mp3"
+        started = time.perf_counter()
+        transcode_audio(str(native_sample), str(target), bitrate, ffmpeg_bin, keep_source=True)
+        results[f'mp3-{bitrate}'] = (time.perf_counter() - started, target.stat().st_size)
+
+    print(f"\nAudio de {SAMPLE_SECONDS} s (AAC 128k):")
+    for name, (elapsed, size) in results.items():
+        print(f"  {name:8} {elapsed * 1000:8.1f} ms  {size / 1024:8.1f} KB")
+
+    native_time, native_size = results['native']
+    for name in ('mp3-192', 'mp3-320'):
+        elapsed, size = results[name]
+        assert native_time < elapsed
+        assert native_size < size
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import improved_main
+from improved_main import DownloadTask, TASK_ID_KEY, download_tasks, task_for_hook, update_progress
+from progress_events import ESTIMATED_MAX_PERCENT, ProgressHub, TaskProgress, progress_hub
+from streaming import GrowingFile
+
+BENCHMARK_CHUNKS = 100_000
+
+
+def make_task():
+    return SimpleNamespace(id="t1", status="downloading", progress=0, to_dict=lambda: {"task_id": "t1"})
+
+
+def test_estimate_only_total_stays_below_100():
+    task = make_task()
+    tracker = TaskProgress(task)
+    tracker.record(50, None, 100.0)
+    tracker.sample(time.monotonic())
+    assert tracker.estimated and task.progress == 50.0
+
+    # La estimación se queda corta: no llegar al 100 hasta terminar
+    tracker.record(120, None, 100.0)
+    tracker.sample(time.monotonic())
+    assert task.progress == ESTIMATED_MAX_PERCENT
+
+    # En cuanto hay tamaño real deja de ser estimado
+    tracker.record(120, 200, None)
+    tracker.sample(time.monotonic())
+    assert not tracker.estimated and task.progress == 60.0
+
+
+def test_speed_is_smoothed_and_ignores_resumed_bytes():
+    tracker = TaskProgress(make_task())
+    tracker.sampled_at = 0.0
+    # Al reanudar un .part ya hay 5000 bytes: eso no es velocidad
+    tracker.record(5000, 100_000, None)
+    tracker.sample(1.0)
+    assert tracker.speed is None and tracker.eta is None
+
+    tracker.record(6000, 100_000, None)
+    tracker.sample(2.0)
+    assert tracker.speed == pytest.approx(1000.0)
+
+    tracker.record(8000, 100_000, None)
+    tracker.sample(3.0)
+    # EWMA: 0.3 * 2000 + 0.7 * 1000
+    assert tracker.speed == pytest.approx(1300.0)
+    assert tracker.eta == pytest.approx(92_000 / 1300.0)
+
+
+def test_publisher_runs_at_a_fixed_rate():
+    async def scenario():
+        hub = ProgressHub(interval=0.05)
+        subscription = hub.subscribe()
+        task = make_task()
+        tracker = hub.track(task)
+        hub.start()
+        # Muchos bloques entre tick y tick
+        for n in range(1, 301):
+            tracker.record(n * 1000, 300_000, None)
+            if n % 30 == 0:
+                await asyncio.sleep(0.025)
+        await asyncio.sleep(0.06)
+        published = [event for event in await subscription.next_batch(0) if event["type"] == "progress"]
+        ticks = hub.ticks
+        # Sin bloques nuevos no se publica nada aunque el publicador siga
+        await asyncio.sleep(0.2)
+        idle = await subscription.next_batch(0)
+        hub.close()
+        return hub, published, ticks, idle
+
+    hub, published, ticks, idle = asyncio.run(scenario())
+    assert hub.updates == 300
+    assert 1 <= hub.published <= ticks < 300
+    assert published[-1]["downloaded_bytes"] == 300_000
+    assert idle == []
+
+
+class LegacyHub:
+    """Progreso tal como se publicaba antes: reloj y dict por cada bloque"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._subscribers = {object()}
+        self._last_progress = {}
+        self.throttled = 0
+
+    def progress(self, task, downloaded_bytes, total_bytes, speed, eta):
+        if not self._subscribers:
+            return
+        now = time.monotonic()
+        if now - self._last_progress.get(task.id, 0.0) < self.interval:
+            self.throttled += 1
+            return
+        self._last_progress[task.id] = now
+
+
+legacy_hub = LegacyHub(0.5)
+
+
+def legacy_update_progress(d):
+    task = task_for_hook(d)
+    if task is None:
+        return
+    if d['status'] == 'downloading':
+        if 'total_bytes' in d and d['total_bytes']:
+            task.progress = (d['downloaded_bytes'] / d['total_bytes']) * 100
+        legacy_hub.progress(task, d.get('downloaded_bytes'), d.get('total_bytes'), d.get('speed'), d.get('eta'))
+        if task.stream is None and d.get('tmpfilename'):
+            pass
+
+
+def ns_per_chunk(hook, d) -> float:
+    best = float('inf')
+    for _ in range(7):
+        started = time.perf_counter_ns()
+        for _ in range(BENCHMARK_CHUNKS):
+            hook(d)
+        best = min(best, (time.perf_counter_ns() - started) / BENCHMARK_CHUNKS)
+    return best
+
+
+def test_progress_hook_overhead_benchmark(monkeypatch):
+    """Coste por bloque del hook de progreso: contadores frente a división + reloj + dict"""
+    monkeypatch.setattr(improved_main.download_tasks, "store", None)
+    task = DownloadTask("https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+    task.status = "downloading"
+    task.stream = GrowingFile(Path('/tmp/x.part'))
+    download_tasks.add(task)
+    progress_hub.track(task)
+    try:
+        d = {
+            'status': 'downloading', 'downloaded_bytes': 1 << 20, 'total_bytes': 4 << 20,
+            'total_bytes_estimate': None, 'speed': 1e6, 'eta': 3, 'tmpfilename': '/tmp/x.part',
+            'info_dict': {TASK_ID_KEY: task.id},
+        }
+        current = ns_per_chunk(update_progress, d)
+        legacy = ns_per_chunk(legacy_update_progress, d)
+    finally:
+        progress_hub.untrack(task)
+        task.stream.finish()
+        task.finished_at = time.time()
+    print(f"\nHook de progreso por bloque: actual {current:.0f} ns, anterior {legacy:.0f} ns")
+    assert current < legacy
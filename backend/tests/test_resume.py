@@ -0,0 +1,183 @@
+import asyncio
+import http.server
+import os
+import re
+import threading
+import time
+
+import pytest
+import yt_dlp
+
+import improved_main
+from config import LIBRARY_OUTTMPL
+from improved_main import DownloadTask, GrowingFile, download_tasks, resume_unfinished_tasks, run_download
+from storage import WRITE_GRACE, remove_orphan_partials
+from store import store
+
+DATA = os.urandom(400 * 1024)
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """Sirve DATA con soporte de Range y anota los bytes enviados por petición"""
+    served = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        header = self.headers.get('Range')
+        start, end = 0, len(DATA) - 1
+        if header:
+            match = re.match(r'bytes=(\d+)-(\d*)', header)
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(DATA)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'audio/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        sent = 0
+        try:
+            for offset in range(start, end + 1, 8192):
+                chunk = DATA[offset:min(offset + 8192, end + 1)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                time.sleep(0.002)
+        except OSError:
+            pass
+        self.served.append((header, sent))
+
+
+@pytest.fixture
+def range_server():
+    RangeHandler.served = []
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/song.m4a"
+    server.shutdown()
+
+
+class Crash(BaseException):
+    """El proceso muere a mitad de descarga"""
+
+
+def interrupted_download(url, directory):
+    """Primera ejecución: yt-dlp escribe el .part y el proceso muere a la mitad"""
+    task = DownloadTask(url, "native")
+    task.status = "downloading"
+
+    def hook(d):
+        if d['status'] == 'downloading':
+            if task.stream is None:
+                task.stream = GrowingFile(directory / os.path.basename(d['tmpfilename']))
+            if d['downloaded_bytes'] > len(DATA) // 2:
+                raise Crash()
+
+    options = {'outtmpl': str(directory / LIBRARY_OUTTMPL), 'quiet': True, 'no_warnings': True,
+               'progress_hooks': [hook], 'continuedl': True}
+    with pytest.raises(Crash):
+        with yt_dlp.YoutubeDL(options) as ydl:
+            ydl.download([url])
+    # Lo que quedó en el diario antes de morir
+    store.put_task(task, urgent=True)
+    store.flush()
+    return task
+
+
+def test_resume_refetches_only_the_missing_bytes(range_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(improved_main, "DOWNLOADS_DIR", tmp_path)
+    monkeypatch.setattr(improved_main, "FETCH_DIR", tmp_path / ".fetch")
+    store.start()
+    try:
+        crashed = interrupted_download(range_server, tmp_path)
+        partial = tmp_path / "song [song].m4a.part"
+        partial_size = partial.stat().st_size
+        assert 0 < partial_size < len(DATA)
+        RangeHandler.served.clear()
+
+        async def restart():
+            resume_unfinished_tasks()
+            task = download_tasks.get(crashed.id)
+            deadline = time.monotonic() + 30
+            while task.finished_at is None and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            return task
+
+        task = asyncio.run(restart())
+    finally:
+        store.stop()
+
+    assert task.status == "completed", task.error
+    assert task.attempts == 1
+    assert (tmp_path / "song [song].m4a").read_bytes() == DATA
+    # La descarga continúa desde el tamaño del .part...
+    ranges = [(header, sent) for header, sent in RangeHandler.served if header]
+    assert ranges == [(f"bytes={partial_size}-", len(DATA) - partial_size)]
+    # ...y lo único extra es el sondeo del extractor genérico
+    refetched = sum(sent for _, sent in RangeHandler.served)
+    assert refetched - (len(DATA) - partial_size) <= 16 * 1024
+
+
+def test_remove_orphan_partials_respects_keep_and_grace(tmp_path):
+    old = time.time() - WRITE_GRACE - 60
+
+    def make(name, size, mtime=None):
+        path = tmp_path / name
+        path.write_bytes(b'x' * size)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    orphan = make("otra.webm.part", 100, old)
+    fragment = make("lista.mp4.part-Frag3", 50, old)
+    ytdl = make("lista.mp4.ytdl", 10, old)
+    resumed = make("song.m4a.part", 1000, old)
+    writing = make("nueva.m4a.part", 1000)
+    finished = make("tema.mp3", 1000, old)
+
+    freed = remove_orphan_partials(tmp_path, {"song.m4a"})
+
+    assert freed == 160
+    assert not orphan.exists() and not fragment.exists() and not ytdl.exists()
+    # Se va a reanudar, se está escribiendo o no es un temporal
+    assert resumed.exists() and writing.exists() and finished.exists()
+
+
+def test_remove_orphan_partials_everything_clears_finished_fetches(tmp_path):
+    old = time.time() - WRITE_GRACE - 60
+    for name in ("sin convertir.webm", "otra.m4a.part"):
+        (tmp_path / name).write_bytes(b'x' * 10)
+        os.utime(tmp_path / name, (old, old))
+
+    assert remove_orphan_partials(tmp_path, set(), everything=True) == 20
+    assert not any(tmp_path.iterdir())
+
+
+def test_failed_mp3_conversion_removes_the_fetched_source(range_server, tmp_path, monkeypatch):
+    fetch_dir = tmp_path / ".fetch"
+    fetch_dir.mkdir()
+    monkeypatch.setattr(improved_main, "DOWNLOADS_DIR", tmp_path)
+    monkeypatch.setattr(improved_main, "FETCH_DIR", fetch_dir)
+
+    async def broken_ffmpeg(*args, **kwargs):
+        raise RuntimeError("FFmpeg falló (1)")
+    monkeypatch.setattr(improved_main, "transcode_to_mp3", broken_ffmpeg)
+
+    task = DownloadTask(range_server, "mp3")
+    download_tasks.add(task)
+    with pytest.raises(Exception, match="FFmpeg falló"):
+        asyncio.run(run_download(task))
+    assert list(fetch_dir.iterdir()) == []
+
+
+def test_same_title_different_videos_get_different_files(tmp_path):
+    options = {'outtmpl': str(tmp_path / LIBRARY_OUTTMPL)}
+    with yt_dlp.YoutubeDL(options) as ydl:
+        first = ydl.prepare_filename({'id': 'aaaaaaaaaaa', 'title': 'Intro', 'ext': 'm4a'})
+        second = ydl.prepare_filename({'id': 'bbbbbbbbbbb', 'title': 'Intro', 'ext': 'm4a'})
+    assert first != second
+    assert os.path.basename(first) == "Intro [aaaaaaaaaaa].m4a"
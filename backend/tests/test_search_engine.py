@@ -0,0 +1,76 @@
+import asyncio
+
+from search_engine import SearchEngine
+from workers import worker_pools
+
+VARIANTS = ["{q}", "{q} música", "{q} audio", "{q} song"]
+
+
+class FakeUpstream:
+    """Variantes con retardo y resultados fijos; cuenta las que hay en vuelo"""
+
+    def __init__(self, delays, hits):
+        self.delays = delays
+        self.hits = hits
+        self.started = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, text):
+        self.started.append(text)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delays[text])
+            return [{"id": f"{text}-{n}"} for n in range(self.hits[text])]
+        finally:
+            self.in_flight -= 1
+
+
+def test_first_caps_variants_in_flight_and_skips_the_rest():
+    engine = SearchEngine("first", budget=5, variants=VARIANTS, parallel=2)
+    upstream = FakeUpstream(
+        delays={"x": 0.2, "x música": 0.05, "x audio": 0.01, "x song": 0.01},
+        hits={"x": 3, "x música": 2, "x audio": 0, "x song": 0},
+    )
+
+    entries, timings = asyncio.run(engine.search("x", upstream))
+
+    assert [entry["id"] for entry in entries] == ["x música-0", "x música-1"]
+    assert upstream.max_in_flight == 2
+    # "x audio" y "x song" no llegaron a lanzarse; "x" se canceló
+    assert upstream.started == ["x", "x música"]
+    statuses = {timing["query"]: timing["status"] for timing in timings}
+    assert statuses == {"x": "cancelled", "x música": "ok", "x audio": "skipped", "x song": "skipped"}
+    assert engine.stats()["variants"]["{q} song"]["skipped"] == 1
+
+
+def test_first_launches_the_next_variant_when_one_comes_back_empty():
+    engine = SearchEngine("first", budget=5, variants=VARIANTS, parallel=2)
+    upstream = FakeUpstream(
+        delays={"x": 0.01, "x música": 0.3, "x audio": 0.01, "x song": 0.01},
+        hits={"x": 0, "x música": 0, "x audio": 1, "x song": 1},
+    )
+
+    entries, _ = asyncio.run(engine.search("x", upstream))
+
+    assert [entry["id"] for entry in entries] == ["x audio-0"]
+    assert upstream.max_in_flight == 2
+    assert "x song" not in upstream.started
+
+
+def test_merge_runs_every_variant_within_the_cap():
+    engine = SearchEngine("merge", budget=5, variants=VARIANTS, parallel=3)
+    upstream = FakeUpstream(
+        delays={text: 0.02 for text in ("x", "x música", "x audio", "x song")},
+        hits={"x": 1, "x música": 1, "x audio": 1, "x song": 1},
+    )
+
+    entries, _ = asyncio.run(engine.search("x", upstream))
+
+    assert len(entries) == 4
+    assert upstream.max_in_flight == 3
+
+
+def test_search_has_its_own_pool():
+    assert worker_pools["search"] is not worker_pools["extract"]
@@ -0,0 +1,70 @@
+import os
+import time
+
+from storage import WRITE_GRACE, StorageManager, remove_orphan_partials
+
+OLD = time.time() - WRITE_GRACE - 60
+
+
+def make(path, size, mtime=OLD):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'x' * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_keep_matches_exact_names(tmp_path):
+    resumed = make(tmp_path / "Song.m4a.part", 10)
+    fragment = make(tmp_path / "Song.m4a.part-Frag2", 10)
+    other = make(tmp_path / "Song 2.m4a.part", 10)
+    remux = make(tmp_path / "Song.m4a.remux.part", 10)
+
+    assert remove_orphan_partials(tmp_path, {"Song.m4a"}) == 20
+    assert resumed.exists() and fragment.exists()
+    assert not other.exists() and not remux.exists()
+
+
+def test_budget_counts_partials_scratch_and_writes_in_progress(tmp_path):
+    library, fetch = tmp_path / "library", tmp_path / "library" / ".fetch"
+    tracks = [make(library / f"{n}.mp3", 1000, OLD + n) for n in range(4)]
+    make(library / "interrumpida.m4a.part", 500)
+    make(fetch / "a.webm", 700)
+    make(tmp_path / ".library.db-wal", 300)
+    writing = make(library / "bajando.m4a.part", 0)
+    storage = StorageManager(
+        [library], budget_bytes=4000, max_file_bytes=0,
+        scratch=[fetch, tmp_path / ".library.db-wal", tmp_path / "no-existe.db"],
+        writing=lambda: [writing],
+    )
+    storage.rescan()
+    # 4000 de pistas y 1600 sin desalojar: hay que bajar a 3600
+    writing.write_bytes(b'x' * 100)
+    freed = storage.enforce()
+
+    assert storage.overhead_bytes == 500 + 700 + 300 + 100
+    assert freed == 2000
+    assert [track.exists() for track in tracks] == [False, False, True, True]
+    assert storage.stats()["total_bytes"] == 2000 + 1600
+
+
+def test_finished_download_stops_counting_its_part(tmp_path):
+    make(tmp_path / "tema.m4a.part", 400)
+    storage = StorageManager([tmp_path], budget_bytes=10_000, max_file_bytes=0)
+    storage.rescan()
+    os.replace(tmp_path / "tema.m4a.part", tmp_path / "tema.m4a")
+
+    storage.add(tmp_path / "tema.m4a")
+    storage.enforce()
+    assert storage.used_bytes == 400 and storage.overhead_bytes == 0
+
+
+def test_remove_forgets_access_history(tmp_path):
+    track = make(tmp_path / "tema.mp3", 100)
+    storage = StorageManager([tmp_path], budget_bytes=0, max_file_bytes=0)
+    storage.rescan()
+    storage.touch(track)
+    track.unlink()
+
+    storage.remove(track)
+    assert storage._access == {}
+    assert storage.used_bytes == 0
@@ -0,0 +1,61 @@
+import asyncio
+import sys
+
+from fastapi.testclient import TestClient
+
+import improved_main
+from metadata_cache import metadata_cache
+from streaming import LiveTranscodes, ffmpeg_stream
+
+# Sustituto de FFmpeg: escribe 1 MB por stdout
+FAKE_ENCODER = [sys.executable, '-c', 'import sys; sys.stdout.buffer.write(b"x" * (1024 * 1024))']
+
+
+def test_live_transcodes_rejects_when_full():
+    limiter = LiveTranscodes(2)
+    first, second = limiter.try_acquire(), limiter.try_acquire()
+    assert first and second
+    assert limiter.try_acquire() is None
+    first()
+    first()  # liberar dos veces no devuelve dos plazas
+    assert limiter.active == 1
+    assert limiter.try_acquire() is not None
+    assert limiter.stats() == {"limit": 2, "active": 2, "started": 3, "rejected": 1}
+
+
+def test_ffmpeg_stream_releases_its_slot():
+    limiter = LiveTranscodes(1)
+
+    async def read_all():
+        return sum([len(chunk) async for chunk in ffmpeg_stream(FAKE_ENCODER, limiter.try_acquire())])
+
+    assert asyncio.run(read_all()) == 1024 * 1024
+    assert limiter.active == 0
+
+
+def test_ffmpeg_stream_releases_its_slot_when_the_client_leaves():
+    limiter = LiveTranscodes(1)
+
+    async def read_one_chunk():
+        stream = ffmpeg_stream(FAKE_ENCODER, limiter.try_acquire())
+        await stream.__anext__()
+        assert limiter.active == 1
+        await stream.aclose()
+
+    asyncio.run(read_one_chunk())
+    assert limiter.active == 0
+
+
+def test_listen_answers_503_when_every_slot_is_taken(monkeypatch):
+    video_id = "dQw4w9WgXcQ"
+    metadata_cache.put({"id": video_id, "title": "x", "url": "http://127.0.0.1:9/audio.m4a"})
+    monkeypatch.setattr(improved_main, "ffmpeg_binary", lambda location: "/bin/true")
+    limiter = LiveTranscodes(1)
+    monkeypatch.setattr(improved_main, "live_transcodes", limiter)
+    limiter.try_acquire()
+
+    response = TestClient(improved_main.app).get("/listen", params={"url": f"https://www.youtube.com/watch?v={video_id}"})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert limiter.rejected == 1
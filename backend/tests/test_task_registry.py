@@ -0,0 +1,96 @@
+import time
+import tracemalloc
+
+from improved_main import DownloadTask
+from task_registry import TaskRegistry
+
+# Mismos campos sin __slots__ (como era DownloadTask antes del registro)
+LegacyTask = type("LegacyTask", (), {"__init__": DownloadTask.__init__})
+
+BENCHMARK_TASKS = 10_000
+
+
+def finished_task(ago: float) -> DownloadTask:
+    task = DownloadTask("https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+    task.status = "completed"
+    task.finished_at = time.time() - ago
+    return task
+
+
+def test_finished_tasks_expire_by_ttl():
+    registry = TaskRegistry(ttl=60, max_finished=100)
+    old, recent = finished_task(ago=120), finished_task(ago=10)
+    running = DownloadTask("https://youtu.be/dQw4w9WgXcQ")
+    running.created_at -= 3600
+    for task in (old, recent, running):
+        registry.add(task)
+
+    registry.purge(force=True)
+    assert registry.stats()["evicted"] == 1
+    assert old.id not in registry
+    assert recent.id in registry and running.id in registry
+
+
+def test_finished_tasks_are_capped_oldest_first():
+    registry = TaskRegistry(ttl=3600, max_finished=2)
+    tasks = [finished_task(ago=50 - n) for n in range(5)]
+    for task in tasks:
+        registry.add(task)
+
+    registry.purge(force=True)
+    assert [task.id in registry for task in tasks] == [False, False, False, True, True]
+    assert registry.stats()["evicted"] == 3
+
+
+def test_active_tasks_are_never_evicted():
+    registry = TaskRegistry(ttl=0, max_finished=0)
+    running = [DownloadTask("https://youtu.be/dQw4w9WgXcQ") for _ in range(3)]
+    for task in running:
+        registry.add(task)
+    registry.add(finished_task(ago=1))
+
+    registry.purge(force=True)
+    assert len(registry) == 3
+    assert all(task.id in registry for task in running)
+    assert registry.stats()["active"] == 3
+
+
+def bytes_per_task(factory) -> float:
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tasks = [factory("https://www.youtube.com/watch?v=dQw4w9WgXcQ") for _ in range(BENCHMARK_TASKS)]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del tasks
+    return total / BENCHMARK_TASKS
+
+
+def test_memory_per_task_benchmark():
+    """Memoria por tarea (tracemalloc): registro compacto con __slots__ frente a __dict__"""
+    slots = bytes_per_task(DownloadTask)
+    legacy = bytes_per_task(LegacyTask)
+    print(f"\nMemoria por tarea ({BENCHMARK_TASKS} tareas): __slots__ {slots:.0f} B, __dict__ {legacy:.0f} B")
+    assert slots < legacy
+
+
+def test_bounded_registry_memory_benchmark():
+    """Memoria del registro tras muchas tareas terminadas: acotada por MAX_FINISHED_TASKS"""
+    registry = TaskRegistry(ttl=3600, max_finished=1000)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for n in range(BENCHMARK_TASKS):
+            task = finished_task(ago=BENCHMARK_TASKS - n)
+            task.result = {"file_path": f"/download/{n}.mp3", "filename": f"{n}.mp3", "file_size": n}
+            registry.add(task)
+        registry.purge(force=True)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    print(f"\nRegistro tras {BENCHMARK_TASKS} tareas terminadas: {len(registry)} tareas, {retained / 1024:.0f} KB")
+    assert len(registry) == 1000
+    assert retained / 1000 < 2048
@@ -0,0 +1,59 @@
+import pytest
+from yt_dlp.utils import RetryManager
+
+from upstream import Upstream, TokenBucket, CircuitBreaker, CircuitOpen
+
+
+def make_upstream(retries=3):
+    # Sin límite de tasa ni espera real entre reintentos
+    return Upstream(TokenBucket(0, 1), CircuitBreaker(2, 60), retries, 0, 0)
+
+
+def retry_manager(upstream, kind):
+    """RetryManager configurado como lo hace yt-dlp con retry_sleep_functions"""
+    sleep_func = upstream.ydl_options()['retry_sleep_functions'][kind]
+    warnings = []
+    manager = RetryManager(
+        upstream.retries, RetryManager.report_retry,
+        sleep_func=sleep_func, info=lambda msg: None, warn=warnings.append,
+    )
+    return manager, warnings
+
+
+@pytest.mark.parametrize("kind", ["http", "fragment", "extractor"])
+def test_yt_dlp_retries_use_backoff(kind):
+    upstream = make_upstream()
+    manager, warnings = retry_manager(upstream, kind)
+    attempts = 0
+    with pytest.raises(ValueError):
+        for retry in manager:
+            attempts += 1
+            retry.error = ValueError("HTTP Error 503")
+    assert attempts == upstream.retries + 1
+    assert upstream.retry_sleeps == upstream.retries
+    assert len(warnings) == upstream.retries
+
+
+def test_open_circuit_stops_yt_dlp_retries():
+    upstream = make_upstream()
+    upstream.breaker.record_failure()
+    upstream.breaker.record_failure()
+    manager, _ = retry_manager(upstream, "http")
+    attempts = 0
+    with pytest.raises(CircuitOpen):
+        for retry in manager:
+            attempts += 1
+            retry.error = ValueError("HTTP Error 429: Too Many Requests")
+    assert attempts == 1
+    assert upstream.retry_sleeps == 0
+
+
+def test_retry_policy_only_comes_from_upstream():
+    from config import UPSTREAM_RETRIES, YT_DLP_CONFIG
+    from strategy_engine import strategy_engine
+    from upstream import upstream
+
+    assert not {'retries', 'fragment_retries', 'extractor_retries', 'ignoreerrors'} & YT_DLP_CONFIG.keys()
+    opts = strategy_engine.attempt_options({'socket_timeout': 600, **upstream.ydl_options()}, remaining=30)
+    assert opts['retries'] == opts['fragment_retries'] == opts['extractor_retries'] == UPSTREAM_RETRIES
+    assert opts['socket_timeout'] == 30
@@ -0,0 +1,268 @@
+"""
+Control del tráfico saliente hacia YouTube (extractor y descargas).
+
+Con 'retries': 100, 'fragment_retries': 100 y 12 estrategias de respaldo,
+un solo episodio de throttling se convertía en una tormenta de reintentos
+de todos los trabajos a la vez. Todo el proceso comparte:
+  - un token bucket (UPSTREAM_RATE peticiones/s con ráfagas de hasta
+    UPSTREAM_BURST) que se consume antes de cada extracción o descarga y
+    antes de cada reintento de yt-dlp
+  - un circuit breaker: tras CIRCUIT_FAILURE_THRESHOLD fallos seguidos de
+    salud de YouTube (429, 403, bot check, red, timeout) se abre y todo
+    falla al momento durante CIRCUIT_COOLDOWN segundos; después deja pasar
+    una petición de prueba y se cierra si sale bien. Los reintentos en curso
+    también se cortan mientras está abierto
+  - backoff exponencial con jitter completo para los reintentos de yt-dlp
+    (retry_sleep_functions), en lugar de los sleep_interval fijos
+"""
+import asyncio
+import logging
+import math
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from yt_dlp.utils import DownloadCancelled
+
+from config import (
+    UPSTREAM_RATE, UPSTREAM_BURST, UPSTREAM_RETRIES,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN,
+    RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX,
+)
+from strategy_engine import classify_error
+
+logger = logging.getLogger(__name__)
+
+# Clases de error (ver strategy_engine.classify_error) que indican que
+# YouTube está limitando o no responde; el resto (video no disponible,
+# archivo no encontrado...) no dice nada de su salud
+UPSTREAM_FAILURES = {"rate_limited", "forbidden", "bot_check", "timeout", "network"}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """YouTube está limitando: se falla sin hacer la petición"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuito abierto: YouTube está limitando las peticiones, reintentar en {math.ceil(retry_after)}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Limitador compartido entre el event loop y los hilos de yt-dlp"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def _reserve(self) -> float:
+        """Reservar un token; devuelve cuánto hay que esperar para usarlo"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Los tokens pueden quedar en negativo: cada uno espera su turno
+            self._tokens -= 1
+            self.granted += 1
+            if self._tokens >= 0:
+                return 0.0
+            wait = -self._tokens / self.rate
+            self.throttled += 1
+            self.waited += wait
+            return wait
+
+    def acquire(self):
+        """Versión bloqueante para los hilos de yt-dlp"""
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": round(self._tokens, 2),
+            "granted": self.granted,
+            "throttled": self.throttled,
+            "waited_seconds": round(self.waited, 2),
+        }
+
+
+class CircuitBreaker:
+    """Cerrado -> abierto tras N fallos seguidos -> semiabierto tras el enfriamiento"""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def check(self):
+        """Fallar si está abierto (para reintentos y comprobaciones previas)"""
+        if self.state == OPEN and self.retry_after() > 0:
+            self.rejected += 1
+            raise CircuitOpen(self.retry_after())
+
+    def before_call(self):
+        """Autorizar una petición nueva; en semiabierto solo pasa una de prueba"""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.retry_after()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpen(remaining)
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    raise CircuitOpen(self.cooldown)
+                self._probing = True
+                logger.info("🔌 Circuito semiabierto: petición de prueba a YouTube")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("✅ Circuito cerrado: YouTube vuelve a responder")
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.opened += 1
+                logger.warning(
+                    f"🚫 Circuito abierto tras {self.failures} fallos seguidos: "
+                    f"sin peticiones a YouTube durante {self.cooldown:g}s"
+                )
+
+    def release(self):
+        """La petición se canceló: no cuenta ni como éxito ni como fallo"""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "cooldown": self.cooldown,
+            "retry_after": round(self.retry_after(), 1) if self.state == OPEN else 0,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class Upstream:
+    """Limitador + circuit breaker + backoff para todas las peticiones a YouTube"""
+
+    def __init__(self, limiter: TokenBucket, breaker: CircuitBreaker,
+                 retries: int, backoff_base: float, backoff_max: float):
+        self.limiter = limiter
+        self.breaker = breaker
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_sleeps = 0
+        self.backoff_slept = 0.0
+
+    async def call(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Ejecutar una petición (p. ej. worker_pools.run(...)) bajo limitador y circuito"""
+        self.breaker.before_call()
+        try:
+            await self.limiter.acquire_async()
+            result = await fn(*args, **kwargs)
+        except DownloadCancelled:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            error_class = classify_error(e)
+            if error_class in UPSTREAM_FAILURES:
+                self.breaker.record_failure()
+            elif error_class == "circuit_open":
+                # Un reintento se cortó porque el circuito se abrió entretanto
+                self.breaker.release()
+            else:
+                # YouTube respondió (aunque sea con "video no disponible")
+                self.breaker.record_success()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def backoff(self, attempt: int) -> float:
+        """Backoff exponencial con jitter completo: uniforme en [0, min(max, base * 2^n)]"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _retry_sleep(self, n: int) -> float:
+        # yt-dlp llama a esto desde su hilo antes de cada reintento, como
+        # sleep_func(n=reintento - 1) (RetryManager.report_retry)
+        self.breaker.check()
+        self.limiter.acquire()
+        delay = self.backoff(n)
+        self.retry_sleeps += 1
+        self.backoff_slept += delay
+        return delay
+
+    def ydl_options(self) -> Dict[str, Any]:
+        """Opciones de reintento para yt-dlp (sustituyen a sleep_interval)"""
+        return {
+            'retries': self.retries,
+            'fragment_retries': self.retries,
+            'extractor_retries': self.retries,
+            'retry_sleep_functions': {
+                'http': self._retry_sleep,
+                'fragment': self._retry_sleep,
+                'extractor': self._retry_sleep,
+            },
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limiter": self.limiter.stats(),
+            "circuit": self.breaker.stats(),
+            "retries": self.retries,
+            "backoff_base": self.backoff_base,
+            "backoff_max": self.backoff_max,
+            "retry_sleeps": self.retry_sleeps,
+            "backoff_slept_seconds": round(self.backoff_slept, 2),
+        }
+
+
+upstream = Upstream(
+    TokenBucket(UPSTREAM_RATE, UPSTREAM_BURST),
+    CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN),
+    UPSTREAM_RETRIES, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX,
+)
@@ -0,0 +1,146 @@
+"""
+Variantes de bitrate generadas bajo demanda.
+
+Cada pista tiene una copia maestra en DOWNLOADS_DIR (la que se descargó).
+Las variantes MP3 de 128/192/320 kbps se crean la primera vez que alguien
+las pide, en el pool "transcode" y en segundo plano, y quedan en disco en
+DOWNLOADS_DIR/.variants. Mientras una variante no existe se sirve la
+maestra; las peticiones siguientes ya reciben la variante.
+
+La variante se elige con ?bitrate= o, si no viene, con las pistas del
+cliente: Save-Data: on, ECT (2g/3g) o Downlink bajo piden 128 kbps.
+"""
+import asyncio
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from pipeline import ffmpeg_binary, transcode_audio
+from workers import worker_pools
+
+logger = logging.getLogger(__name__)
+
+VARIANT_BITRATES = ('128', '192', '320')
+LOW_DATA_BITRATE = '128'
+SLOW_NETWORKS = {'slow-2g', '2g', '3g'}
+
+# Cabeceras que cambian la variante servida
+VARIANT_HINT_HEADERS = 'Save-Data, ECT, Downlink'
+
+
+def bitrate_of_format(fmt: Optional[str]) -> Optional[int]:
+    """Bitrate de un formato de biblioteca tipo 'mp3-320' (None si no se sabe)"""
+    if fmt and fmt.startswith('mp3-') and fmt[4:].isdigit():
+        return int(fmt[4:])
+    return None
+
+
+def choose_bitrate(requested: Optional[str], headers: Mapping[str, str]) -> Optional[str]:
+    """Elegir variante por parámetro o por las pistas de red del cliente"""
+    if requested:
+        return requested if requested in VARIANT_BITRATES else None
+    if headers.get('save-data', '').strip().lower() == 'on':
+        return LOW_DATA_BITRATE
+    if headers.get('ect', '').strip().lower() in SLOW_NETWORKS:
+        return LOW_DATA_BITRATE
+    try:
+        if float(headers.get('downlink', '')) < 1.0:
+            return LOW_DATA_BITRATE
+    except ValueError:
+        pass
+    return None
+
+
+class VariantStore:
+    """Caché en disco de variantes de bitrate de las copias maestras"""
+
+    def __init__(self, downloads_dir: Path):
+        self.directory = downloads_dir / '.variants'
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.failed = 0
+        # Avisos al llevar la cuenta del disco (StorageManager.add / remove)
+        self.on_add: Optional[Callable[[Path], None]] = None
+        self.on_remove: Optional[Callable[[Path], None]] = None
+
+    def variant_path(self, master: Path, bitrate: str) -> Path:
+        return self.directory / f"{master.name}.{bitrate}k.mp3"
+
+    def request(self, master: Path, bitrate: str, ffmpeg_location: Optional[str]) -> Optional[Path]:
+        """
+        Devolver la variante si ya está en disco y al día con la maestra; si
+        no, encargarla en segundo plano y devolver None (servir la maestra).
+        """
+        variant = self.variant_path(master, bitrate)
+        try:
+            if variant.stat().st_mtime >= master.stat().st_mtime:
+                self.hits += 1
+                return variant
+        except OSError:
+            pass
+
+        self.misses += 1
+        key = str(variant)
+        if key not in self._pending:
+            job = asyncio.create_task(self._generate(master, variant, bitrate, ffmpeg_location))
+            self._pending[key] = job
+            job.add_done_callback(lambda _: self._pending.pop(key, None))
+        return None
+
+    def select(self, master: Path, requested: Optional[str], headers: Mapping[str, str],
+               master_format: Optional[str], ffmpeg_location: Callable[[], Optional[str]]) -> Tuple[Path, Optional[str]]:
+        """
+        Archivo a servir (variante o maestra) y bitrate de la variante
+        elegida. ffmpeg_location solo se resuelve si hace falta una variante.
+        """
+        bitrate = choose_bitrate(requested, headers)
+        if bitrate is None:
+            return master, None
+        # No tiene sentido una variante igual o mayor que la maestra
+        master_kbps = bitrate_of_format(master_format)
+        if master_kbps is not None and int(bitrate) >= master_kbps:
+            return master, None
+        variant = self.request(master, bitrate, ffmpeg_location())
+        if variant is None:
+            return master, None
+        return variant, bitrate
+
+    def remove(self, filename: str):
+        """Borrar las variantes de una maestra eliminada"""
+        for bitrate in VARIANT_BITRATES:
+            variant = self.directory / f"{filename}.{bitrate}k.mp3"
+            try:
+                variant.unlink()
+            except FileNotFoundError:
+                continue
+            if self.on_remove:
+                self.on_remove(variant)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "generated": self.generated,
+            "failed": self.failed,
+            "pending": len(self._pending),
+        }
+
+    async def _generate(self, master: Path, variant: Path, bitrate: str, ffmpeg_location: Optional[str]):
+        ffmpeg_bin = ffmpeg_binary(ffmpeg_location)
+        if not ffmpeg_bin:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        logger.info(f"🎚️ Generando variante {bitrate}kbps: {master.name}")
+        try:
+            await worker_pools.run('transcode', transcode_audio, str(master), str(variant), bitrate, ffmpeg_bin, True)
+            self.generated += 1
+            # La maestra se borró mientras se generaba
+            if not master.exists():
+                variant.unlink(missing_ok=True)
+            elif self.on_add:
+                self.on_add(variant)
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"⚠️ No se pudo generar la variante {variant.name}: {e}")
@@ -0,0 +1,151 @@
+"""
+Pools de trabajo para sacar yt-dlp del event loop.
+
+Cada etapa (extracción, descarga de red y transcodificación) tiene su
+propio executor con tamaño configurable, así una descarga lenta no
+bloquea /health ni el servido de archivos. La transcodificación usa un
+pool de procesos porque es trabajo de CPU. Los pools llevan la cuenta
+de cola, trabajos activos y tiempo de espera para poder exponerlos.
+
+Cancelar la espera (p. ej. una variante de búsqueda que perdió) no para
+el hilo ni el proceso: si el trabajo ya había empezado, su slot sigue
+ocupado y cuenta como activo hasta que termine de verdad.
+"""
+import asyncio
+import functools
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from config import EXTRACT_WORKERS, DOWNLOAD_WORKERS, TRANSCODE_WORKERS, SEARCH_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """Executor con métricas de cola y tiempo de espera"""
+
+    def __init__(self, name: str, max_workers: int, processes: bool = False):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.processes = processes
+        if processes:
+            # spawn evita heredar locks de los hilos del servidor al hacer fork
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix=f"{name}-worker",
+            )
+        # Los slots se controlan desde el event loop para poder medir la
+        # espera igual en hilos y en procesos
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        # Trabajos cancelados que ya corrían y siguen ocupando su slot
+        self.abandoned = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Ejecutar una función bloqueante en el pool y esperar su resultado"""
+        loop = asyncio.get_running_loop()
+        submitted = time.monotonic()
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        except asyncio.CancelledError:
+            self.queued -= 1
+            raise
+
+        wait = time.monotonic() - submitted
+        self.queued -= 1
+        self.active += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        job = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        try:
+            result = await asyncio.wrap_future(job)
+        except asyncio.CancelledError:
+            if job.cancel():
+                # No había empezado: el slot queda libre ya
+                self._release()
+            else:
+                self.abandoned += 1
+                job.add_done_callback(lambda _: self._release_threadsafe(loop))
+            raise
+        except Exception:
+            self.failed += 1
+            self._release()
+            raise
+
+        self._release()
+        self.completed += 1
+        return result
+
+    def _release(self):
+        self.active -= 1
+        self._slots.release()
+
+    def _release_threadsafe(self, loop: asyncio.AbstractEventLoop):
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # El loop ya se cerró (apagado)
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.completed + self.failed
+        return {
+            "kind": "process" if self.processes else "thread",
+            "workers": self.max_workers,
+            "queued": self.queued,
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "abandoned": self.abandoned,
+            "avg_wait_ms": round(self.total_wait / finished * 1000, 2) if finished else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class WorkerPools:
+    """Conjunto de pools separados por etapa"""
+
+    def __init__(self, pools: List[WorkerPool]):
+        self._pools = {pool.name: pool for pool in pools}
+
+    def __getitem__(self, name: str) -> WorkerPool:
+        return self._pools[name]
+
+    async def run(self, pool: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        return await self._pools[pool].run(fn, *args, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.stats() for name, pool in self._pools.items()}
+
+    def shutdown(self):
+        for pool in self._pools.values():
+            pool.shutdown()
+        logger.info("🧵 Pools de trabajo detenidos")
+
+
+worker_pools = WorkerPools([
+    WorkerPool("extract", EXTRACT_WORKERS),
+    WorkerPool("download", DOWNLOAD_WORKERS),
+    # FFmpeg es CPU: un proceso por núcleo
+    WorkerPool("transcode", TRANSCODE_WORKERS, processes=True),
+    # Las variantes de búsqueda que pierden siguen en su hilo hasta acabar:
+    # que lo hagan aquí y no en "extract"
+    WorkerPool("search", SEARCH_WORKERS),
+])
@@ -1,4 +1,4 @@
-import React, { createContext, useContext, useState, useEffect } from 'react';
+import React, { createContext, useContext, useState, useEffect, useRef } from 'react';
 import { Alert } from 'react-native';
 import * as FileSystem from 'expo-file-system/legacy';
 import { supabase } from '@/lib/supabase';
@@ -51,6 +51,12 @@ export function DownloadsProvider({ children }: { children: React.ReactNode }) {
   const [searchQuery, setSearchQuery] = useState('');
   const [searching, setSearching] = useState(false);
   const [isOnline, setIsOnline] = useState(true); // Estado de conexión
+  // Copia local del catálogo del backend para pedir solo los cambios (?since=)
+  const backendCatalog = useRef<{ version: string | null; etag: string | null; files: Map<string, any> }>({
+    version: null,
+    etag: null,
+    files: new Map(),
+  });
 
   useEffect(() => {
     if (user) {
@@ -93,20 +99,40 @@ export function DownloadsProvider({ children }: { children: React.ReactNode }) {
       
       // Fallback: cargar desde el backend global
       try {
-        const response = await fetch(`${API_URL}/downloads`, {
+        const catalog = backendCatalog.current;
+        const query = catalog.version ? `?since=${encodeURIComponent(catalog.version)}` : '';
+        const response = await fetch(`${API_URL}/downloads${query}`, {
           // timeout: 5000, // No está disponible en RequestInit
+          headers: catalog.etag ? { 'If-None-Match': catalog.etag } : undefined,
         });
         
+        if (response.status === 304) {
+          // Sin cambios desde la última consulta: reutilizar la copia local
+          console.log('✅ Catálogo del backend sin cambios');
+          return;
+        }
+        
         if (response.ok) {
           const data = await response.json();
           if (data.status === 'success' && data.downloads) {
+            // Aplicar delta o reemplazar la copia completa
+            if (data.mode !== 'delta') {
+              catalog.files = new Map();
+            }
+            data.downloads.forEach((file: any) => catalog.files.set(file.filename, file));
+            (data.deleted || []).forEach((filename: string) => catalog.files.delete(filename));
+            catalog.version = data.version || null;
+            catalog.etag = response.headers.get('ETag');
+            
             // Convertir formato del backend al formato esperado por la app
-            const backendFiles = data.downloads.map((file: any) => ({
-              filename: file.filename,
-              file_path: file.path, // Ruta del backend
-              file_size: file.size,
-              created_at: file.modified,
-            }));
+            const backendFiles = Array.from(catalog.files.values())
+              .sort((a: any, b: any) => b.modified - a.modified)
+              .map((file: any) => ({
+                filename: file.filename,
+                file_path: file.path, // Ruta del backend
+                file_size: file.size,
+                created_at: file.modified,
+              }));
             
             setDownloadedFiles(backendFiles);
             console.log(`✅ ${backendFiles.length} archivos cargados desde el backend`);
@@ -257,7 +283,8 @@ export function DownloadsProvider({ children }: { children: React.ReactNode }) {
         headers: {
           'Content-Type': 'application/json',
         },
-        // Aumentar timeout para descargas largas
+        // improved_main responde al momento con un task_id en cola, pero main:app
+        // (render.yaml) descarga dentro de la petición: mantener el timeout largo
         signal: AbortSignal.timeout(300000) // 5 minutos
       });
       
@@ -266,7 +293,12 @@ export function DownloadsProvider({ children }: { children: React.ReactNode }) {
         throw new Error(`Error del servidor (${response.status}): ${errorText}`);
       }
       
-      const data = await response.json();
+      let data = await response.json();
+      
+      // El servidor encola la descarga: seguir la tarea hasta que termine
+      if (data.status === 'queued') {
+        data = await waitForTask(data.task_id, result.id);
+      }
       
       if (data.status === 'success') {
         console.log('✅ Descarga completada:', data.file.title);
@@ -363,6 +395,41 @@ export function DownloadsProvider({ children }: { children: React.ReactNode }) {
     }
   };
 
+  // Consultar la tarea en el servidor hasta que termine (máximo 10 minutos)
+  const waitForTask = async (taskId: string, itemId: string) => {
+    const deadline = Date.now() + 600000;
+    
+    while (Date.now() < deadline) {
+      await new Promise(resolve => setTimeout(resolve, 1500));
+      
+      const response = await fetch(`${API_URL}/tasks/${taskId}`, {
+        signal: AbortSignal.timeout(15000)
+      });
+      
+      if (!response.ok) {
+        throw new Error(`Error del servidor (${response.status}): ${await response.text()}`);
+      }
+      
+      const task = await response.json();
+      
+      if (task.status === 'completed') {
+        return { status: 'success', task_id: taskId, file: task.file };
+      }
+      if (task.status === 'error') {
+        return { status: 'error', message: task.error };
+      }
+      
+      setDownloadingItems(prev => ({
+        ...prev,
+        [itemId]: Math.min(Math.round(task.progress || 0), 99)
+      }));
+    }
+    
+    const timeoutError = new Error('La descarga tardó demasiado');
+    timeoutError.name = 'AbortError';
+    throw timeoutError;
+  };
+
   // Función auxiliar para formatear tamaño de archivo
   const formatFileSize = (bytes: number): string => {
     if (bytes === 0) return '0 Bytes';